@@ -8,17 +8,17 @@ from pathlib import Path
 from typing import Optional, Tuple, Any, Dict, List
 
 from eth_account import Account  # type: ignore
-from eth_utils import to_checksum_address  # type: ignore
+from eth_utils import event_abi_to_log_topic, to_checksum_address  # type: ignore
 from hexbytes import HexBytes  # type: ignore
 from web3 import Web3  # type: ignore
 from web3.contract import Contract  # type: ignore
-from web3.exceptions import ContractLogicError  # type: ignore
+from web3.exceptions import ContractLogicError, TimeExhausted, TransactionNotFound  # type: ignore
 
+from . import fees, logscan, nonce, rpc
 from .schemas import ChainMatch
 
 
 # Environment/config
-FLARE_RPC = os.getenv("FLARE_RPC_URL", "https://coston2-api.flare.network/ext/C/rpc")
 PRIVATE_KEY = os.getenv("ANCHOR_PRIVATE_KEY")  # hex string 0x...
 CONTRACT_ADDR = os.getenv("ANCHOR_CONTRACT_ADDR")  # 0x...
 ABI_PATH = os.getenv("ANCHOR_ABI_PATH", "contracts/EvidenceAnchor.abi.json")
@@ -51,6 +51,7 @@ FALLBACK_ABI = [
 _w3: Optional[Web3] = None
 _contract: Optional[Contract] = None
 _acct = None
+_scanner: Optional["logscan.LogScanner"] = None
 
 
 def _hex32_from_prefixed(hex_str: str) -> bytes:
@@ -65,7 +66,8 @@ def _hex32_from_prefixed(hex_str: str) -> bytes:
 def _load_web3() -> Web3:
     global _w3
     if _w3 is None:
-        _w3 = Web3(Web3.HTTPProvider(FLARE_RPC))
+        # Pooled keep-alive session, endpoint selection and cached chain id (see app/rpc.py)
+        _w3 = Web3(rpc.web3_provider())
     return _w3
 
 
@@ -96,122 +98,286 @@ def _load_contract() -> Tuple[Web3, Contract]:
     return w3, contract
 
 
-def _estimate_fees_eip1559(w3: Web3) -> Optional[Tuple[int, int]]:
-    try:
-        # Use fee_history to derive a reasonable tip
-        history = w3.eth.fee_history(5, "latest", [10, 50, 90])
-        base_fees = history["baseFeePerGas"]
-        base = int(base_fees[-1])
-        # Pick a conservative tip (2 gwei) or max priority from history
-        tip = int(2e9)
-        try:
-            prio = history.get("reward", [])
-            if prio and prio[-1]:
-                # Use median (50th percentile)
-                tip = max(tip, int(prio[-1][1]))
-        except Exception:
-            pass
-        max_priority = tip
-        # Max fee = base * 2 + tip (simple rule)
-        max_fee = base * 2 + max_priority
-        return max_fee, max_priority
-    except Exception:
-        return None
-
-
 def _build_tx_anchor(
-    w3: Web3, contract: Contract, from_addr: str, bundle_hash32: bytes
+    w3: Web3, contract: Contract, from_addr: str, bundle_hash32: bytes, nonce_value: int
 ) -> Dict[str, Any]:
     func = contract.functions.anchorEvidence(bundle_hash32)
-    # Start with a basic tx skeleton
+    data = func._encode_transaction_data()  # type: ignore
+    call = {"from": from_addr, "to": contract.address, "data": data}
+    # Fees come from the per-block oracle, gas from the per-selector cache, chain id is cached
+    # and the nonce comes from the NonceManager: no RPC call before the send
     tx: Dict[str, Any] = {
         "from": from_addr,
-        "nonce": w3.eth.get_transaction_count(from_addr, "pending"),
-        "chainId": w3.eth.chain_id,
+        "nonce": nonce_value,
+        "chainId": rpc.get_client().chain_id(),
+        "gas": fees.gas_cache.gas_limit(_selector(data), lambda: int(rpc.get_client().call("eth_estimateGas", [call]), 16)),
     }
+    tx.update(fees.oracle.current())
+
+    # Every field is set, so building the tx makes no further RPC calls
+    built = func.build_transaction(tx)
+    return built
+
+
+def _selector(data: str) -> str:
+    return data[:10]
+
+
+def _anchor_selector(contract: Contract) -> str:
+    return _selector(contract.functions.anchorEvidence(b"\x00" * 32)._encode_transaction_data())  # type: ignore
 
-    # Try EIP-1559
-    fees = _estimate_fees_eip1559(w3)
-    if fees:
-        max_fee, max_priority = fees
-        tx.update({"type": 2, "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority})
+
+def _fees_of(tx: Dict[str, Any]) -> Dict[str, int]:
+    return {k: int(tx[k]) for k in nonce.FEE_FIELDS if tx.get(k) is not None}
+
+
+def _apply_fees(tx: Dict[str, Any], bumped: Dict[str, int]) -> None:
+    """Use the given (bumped) fees unless the current estimate of the same tx type is higher."""
+    if not bumped:
+        return
+    if "maxFeePerGas" in bumped:
+        tx.pop("gasPrice", None)
+        tx["type"] = 2
+        for k in ("maxFeePerGas", "maxPriorityFeePerGas"):
+            if k in bumped:
+                tx[k] = max(int(tx.get(k) or 0), bumped[k])
     else:
-        # Fallback to legacy
-        tx.update({"gasPrice": w3.eth.gas_price})
+        for k in ("type", "maxFeePerGas", "maxPriorityFeePerGas"):
+            tx.pop(k, None)
+        tx["gasPrice"] = max(int(tx.get("gasPrice") or 0), bumped["gasPrice"])
 
-    # Gas estimate
+
+def _send(w3: Web3, acct, tx: Dict[str, Any]) -> str:
+    signed = acct.sign_transaction(tx)
+    # The hash is known before the node answers, so an interrupted send can still be tracked
+    tx_hash = Web3.to_hex(signed.hash)
     try:
-        gas_est = func.estimate_gas({"from": from_addr})
-        # Add a safety margin
-        gas_est = int(gas_est * 1.2)
-    except Exception:
-        # Fallback fixed gas
-        gas_est = 200_000
+        w3.eth.send_raw_transaction(signed.rawTransaction)
+    except Exception as e:
+        if nonce.is_already_known(e):
+            return tx_hash
+        if nonce.is_ambiguous_send(e):
+            raise nonce.AmbiguousSend(tx_hash, _fees_of(tx)) from e
+        raise
+    return tx_hash
+
+
+def _send_replacing_underpriced(w3: Web3, acct, tx: Dict[str, Any]) -> str:
+    # A tx with this nonce is already in the mempool (e.g. from before a crash): outbid it
+    for _ in range(nonce.NONCE_MAX_REPLACEMENTS):
+        try:
+            return _send(w3, acct, tx)
+        except Exception as e:
+            if not nonce.is_underpriced(e):
+                raise
+            _apply_fees(tx, nonce.bump_fees(_fees_of(tx)))
+    return _send(w3, acct, tx)
 
-    tx.update({"gas": gas_est})
 
-    built = func.build_transaction(tx)
-    return built
+def _resend(nonce_value: int, anchored_hash: Optional[str], bumped: Dict[str, int]) -> Tuple[str, Dict[str, int]]:
+    """NonceManager callback: re-send a stuck anchor with bumped fees, or fill a nonce gap."""
+    w3, contract = _load_contract()
+    acct = w3.eth.account.from_key(PRIVATE_KEY)
+    if anchored_hash is None:
+        # Gap filler: zero-value self-transfer
+        tx: Dict[str, Any] = {
+            "from": acct.address,
+            "to": acct.address,
+            "value": 0,
+            "gas": 21_000,
+            "nonce": nonce_value,
+            "chainId": rpc.get_client().chain_id(),
+        }
+        tx.update(fees.oracle.current())
+    else:
+        tx = _build_tx_anchor(w3, contract, acct.address, _hex32_from_prefixed(anchored_hash), nonce_value)
+        _apply_fees(tx, bumped)
+    return _send(w3, acct, tx), _fees_of(tx)
+
+
+def _nonce_manager(w3: Web3, from_addr: str) -> "nonce.NonceManager":
+    mgr = nonce.get_manager(from_addr, lambda ident: w3.eth.get_transaction_count(from_addr, ident))
+    mgr.start_sweeper(_resend)
+    return mgr
+
+
+def _wait_for_nonce(w3: Web3, mgr: "nonce.NonceManager", nonce_value: int, tx_hash: str, timeout: float = 180):
+    # The sweeper may replace a stuck tx while we wait, and the original may still be the
+    # one mined: poll every hash sent for the nonce
+    deadline = time.monotonic() + timeout
+    while True:
+        for h in mgr.tx_hashes(nonce_value) or [tx_hash]:
+            try:
+                return w3.eth.get_transaction_receipt(h)
+            except TransactionNotFound:
+                continue
+        if time.monotonic() >= deadline:
+            raise TimeExhausted(f"no tx for nonce {nonce_value} mined within {timeout:g}s")
+        time.sleep(2)
+
+
+def _submit(w3: Web3, contract: Contract, acct, mgr: "nonce.NonceManager", bundle_hash_hex: str) -> Tuple[int, str]:
+    bundle_hash32 = _hex32_from_prefixed(bundle_hash_hex)
+    from_addr = acct.address
+
+    # Retry loop for send/gas issues; nonces come from the manager, never from a racy RPC read
+    last_err: Optional[Exception] = None
+    for attempt in range(3):
+        nonce_value = mgr.allocate()
+        try:
+            tx = _build_tx_anchor(w3, contract, from_addr, bundle_hash32, nonce_value)
+            tx_hash = _send_replacing_underpriced(w3, acct, tx)
+        except nonce.AmbiguousSend as e:
+            # May be in a mempool: never re-send under another nonce; the sweeper and the
+            # confirmation watcher resolve it like any other pending tx
+            mgr.record_sent(nonce_value, e.tx_hash, bundle_hash_hex, e.fees)
+            return nonce_value, e.tx_hash
+        except Exception as e:
+            last_err = e
+            if nonce.is_nonce_too_low(e):
+                # Nonce was consumed elsewhere; jump ahead instead of reusing it
+                mgr.resync()
+            else:
+                # Built but rejected by the node (or never built): the nonce is free again
+                mgr.release(nonce_value)
+            time.sleep(1 + attempt)
+            continue
+        mgr.record_sent(nonce_value, tx_hash, bundle_hash_hex, _fees_of(tx))
+        return nonce_value, tx_hash
+    if last_err:
+        raise last_err  # propagate last error
+    raise RuntimeError("Unknown error anchoring bundle")
+
+
+def submit_bundle(bundle_hash_hex: str) -> str:
+    """
+    Signs and broadcasts anchorEvidence(bundle_hash) without waiting for it to be mined.
+    Returns the tx hash; confirmation is tracked by app.confirm.
+    """
+    if not PRIVATE_KEY:
+        raise RuntimeError("ANCHOR_PRIVATE_KEY is not set")
+
+    w3, contract = _load_contract()
+    acct = w3.eth.account.from_key(PRIVATE_KEY)
+    mgr = _nonce_manager(w3, acct.address)
+    _, tx_hash = _submit(w3, contract, acct, mgr, bundle_hash_hex)
+    return tx_hash
 
 
 def anchor_bundle(bundle_hash_hex: str) -> Tuple[str, int]:
     """
     Anchors the 32-byte bundle hash on-chain by calling anchorEvidence.
-    Returns (txid_hex, blockNumber) after waiting for 1 confirmation.
+    Returns (txid_hex, blockNumber) after waiting for 1 confirmation; raises
+    nonce.BroadcastUnconfirmed if the tx went out but was not mined in time.
     """
     if not PRIVATE_KEY:
         raise RuntimeError("ANCHOR_PRIVATE_KEY is not set")
 
     w3, contract = _load_contract()
     acct = w3.eth.account.from_key(PRIVATE_KEY)
-    from_addr = acct.address
-
-    bundle_hash32 = _hex32_from_prefixed(bundle_hash_hex)
+    mgr = _nonce_manager(w3, acct.address)
 
-    # Retry loop for nonce/gas issues
-    last_err = None
-    for attempt in range(3):
+    last_err: Optional[Exception] = None
+    for _ in range(3):
+        nonce_value, tx_hash = _submit(w3, contract, acct, mgr, bundle_hash_hex)
         try:
-            tx = _build_tx_anchor(w3, contract, from_addr, bundle_hash32)
-            signed = acct.sign_transaction(tx)
-            tx_hash = w3.eth.send_raw_transaction(signed.rawTransaction)
-            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=180)
-            if receipt and receipt.get("status", 1) == 1:
-                return tx_hash.hex(), receipt["blockNumber"]
-            last_err = RuntimeError("Transaction failed with status != 1")
-        except Exception as e:
-            last_err = e
-            # Small backoff and nonce bump
-            time.sleep(1 + attempt)
+            receipt = _wait_for_nonce(w3, mgr, nonce_value, tx_hash)
+        except TimeExhausted as e:
+            # Still tracked by the sweeper: never re-send it under a new nonce
+            raise nonce.BroadcastUnconfirmed(mgr.current_tx_hash(nonce_value) or tx_hash) from e
+        if receipt and receipt.get("status", 1) == 1:
+            mgr.mark(nonce_value, "mined")
+            return Web3.to_hex(receipt["transactionHash"]), receipt["blockNumber"]
+        mgr.mark(nonce_value, "failed")
+        # Likely out of gas: re-estimate with a wider margin before the retry
+        fees.gas_cache.failed(_anchor_selector(contract))
+        last_err = RuntimeError("Transaction failed with status != 1")
     if last_err:
         raise last_err  # propagate last error
     raise RuntimeError("Unknown error anchoring bundle")
 
 
+def _event_topic(contract: Contract) -> str:
+    event_abi = contract.events.EvidenceAnchored().abi  # type: ignore
+    return Web3.to_hex(event_abi_to_log_topic(event_abi))
+
+
+def log_scanner(w3: Web3, contract: Contract) -> "logscan.LogScanner":
+    """Shared EvidenceAnchored log scanner; keeps the block span it learned from the provider."""
+    global _scanner
+    if _scanner is None:
+        address = to_checksum_address(CONTRACT_ADDR)  # type: ignore
+        topic = _event_topic(contract)
+
+        def _get_logs(from_block: int, to_block: int) -> List[Any]:
+            # Filter by event signature only; parameter may not be indexed
+            return w3.eth.get_logs(
+                {"fromBlock": from_block, "toBlock": to_block, "address": address, "topics": [topic]}
+            )
+
+        _scanner = logscan.LogScanner(_get_logs)
+    return _scanner
+
+
+def _scan_for_anchor(w3: Web3, contract: Contract, bundle_hash32: bytes, from_block: int, to_block: int) -> ChainMatch:
+    event = contract.events.EvidenceAnchored()  # type: ignore
+
+    def _decode(log):
+        ev_hash = event.process_log(log)["args"].get("bundleHash", b"")
+        if isinstance(ev_hash, HexBytes):
+            ev_hash = bytes(ev_hash)
+        return log if ev_hash == bundle_hash32 else None
+
+    # Newest-first; closing the iterator at the first match cancels the remaining ranges
+    matches = log_scanner(w3, contract).scan(from_block, to_block, decode=_decode)
+    try:
+        log = next(matches, None)
+    except Exception:
+        log = None
+    finally:
+        matches.close()
+    if log is None:
+        return ChainMatch(matches=False)
+
+    tx_hash = Web3.to_hex(log["transactionHash"])
+    blk = w3.eth.get_block(log["blockNumber"])
+    ts = blk.get("timestamp")
+    anchored_at = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, int) else None
+    return ChainMatch(matches=True, txid=tx_hash, anchored_at=anchored_at)
+
+
 def find_anchor(bundle_hash_hex: str) -> ChainMatch:
     """
     Attempts to find the EvidenceAnchored event for the given bundle hash.
     Returns ChainMatch(matches, txid?, anchored_at?).
     Strategy:
-      - Query logs for the EvidenceAnchored event from latest-LOOKBACK to latest.
+      - Answer from the local event index (app/indexer.py) when it has the hash.
+      - Otherwise query logs from latest-LOOKBACK to latest, skipping blocks the index covers.
       - Decode logs and compare bundleHash (in data) to provided hash.
       - Return the first match with txid and block timestamp.
     Works whether or not bundleHash is indexed (topics) due to decoding step.
     """
     try:
-        w3, contract = _load_contract()
+        bundle_hash32 = _hex32_from_prefixed(bundle_hash_hex)
     except Exception:
-        # Read-only without contract address is not possible
         return ChainMatch(matches=False)
 
+    covered: Optional[Tuple[int, int]] = None
     try:
-        bundle_hash32 = _hex32_from_prefixed(bundle_hash_hex)
+        from . import indexer
+
+        indexed = indexer.lookup(bundle_hash_hex)
+        if indexed is not None:
+            return indexed
+        covered = indexer.coverage()
     except Exception:
-        return ChainMatch(matches=False)
+        covered = None
 
-    latest = w3.eth.block_number
-    from_block = max(0, latest - LOOKBACK_BLOCKS)
-    address = to_checksum_address(CONTRACT_ADDR)  # type: ignore
+    try:
+        w3, contract = _load_contract()
+    except Exception:
+        # Read-only without contract address is not possible
+        return ChainMatch(matches=False)
 
     # Build event signature topic for filtering (first topic)
     event_abi = None
@@ -224,41 +390,20 @@ def find_anchor(bundle_hash_hex: str) -> ChainMatch:
         # Without ABI, cannot decode; bail
         return ChainMatch(matches=False)
 
-    try:
-        # Filter by event signature only; parameter may not be indexed
-        event = contract.events.EvidenceAnchored()  # type: ignore
-        logs = w3.eth.get_logs(
-            {
-                "fromBlock": from_block,
-                "toBlock": latest,
-                "address": address,
-                "topics": [event._get_event_abi() and event._get_event_topic()],  # type: ignore
-            }
-        )
-    except Exception:
-        # If provider rejects topics param, fallback to contract.events filter (less control)
-        try:
-            evt_filter = event.create_filter(fromBlock=from_block, toBlock=latest)  # type: ignore
-            logs = evt_filter.get_all_entries()  # type: ignore
-        except Exception:
-            logs = []
-
-    # Iterate newest-first for speed
-    for log in reversed(logs):
-        try:
-            decoded = contract.events.EvidenceAnchored().process_log(log)  # type: ignore
-            args = decoded["args"]
-            ev_hash: bytes = args.get("bundleHash", b"")
-            if isinstance(ev_hash, HexBytes):
-                ev_hash = bytes(ev_hash)
-            if ev_hash == bundle_hash32:
-                tx_hash = log["transactionHash"].hex()
-                blk = w3.eth.get_block(log["blockNumber"])
-                ts = blk.get("timestamp")
-                anchored_at = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, int) else None
-                return ChainMatch(matches=True, txid=tx_hash, anchored_at=anchored_at)
-        except Exception:
-            # Ignore decode issues and continue
-            continue
-
+    latest = w3.eth.block_number
+    from_block = max(0, latest - LOOKBACK_BLOCKS)
+    ranges: List[Tuple[int, int]] = [(from_block, latest)]
+    if covered is not None:
+        # Only blocks the indexer has not reached (newest first), plus any lookback before its start
+        start, indexed_to = covered
+        ranges = []
+        if indexed_to < latest:
+            ranges.append((max(from_block, indexed_to + 1), latest))
+        if from_block < start:
+            ranges.append((from_block, min(start - 1, latest)))
+
+    for lo, hi in ranges:
+        match = _scan_for_anchor(w3, contract, bundle_hash32, lo, hi)
+        if match.matches:
+            return match
     return ChainMatch(matches=False)
@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from . import db, merkle, models
+
+
+# "single": one anchorEvidence tx per receipt (default)
+# "batch": collect bundle hashes and anchor one Merkle root per batch
+ANCHOR_MODE = os.getenv("ANCHOR_MODE", "single").strip().lower()
+BATCH_MAX_SIZE = int(os.getenv("ANCHOR_BATCH_MAX_SIZE", "256"))
+BATCH_WINDOW_SECONDS = float(os.getenv("ANCHOR_BATCH_WINDOW_SECONDS", "30"))
+# Seconds between checks for a due batch (enqueueing in the same process wakes the flusher early)
+BATCH_POLL_SECONDS = float(os.getenv("ANCHOR_BATCH_POLL_SECONDS", "1"))
+# Batch roots being submitted at once; the flush loop itself never waits on a tx
+BATCH_SUBMIT_WORKERS = int(os.getenv("ANCHOR_BATCH_SUBMIT_WORKERS", "4"))
+# A claimed batch with no recorded root tx after this long (flusher crashed mid-submit) is
+# released to be batched again; keep above ANCHOR_NODE_TIMEOUT
+BATCH_CLAIM_SECONDS = int(os.getenv("ANCHOR_BATCH_CLAIM_SECONDS", "600"))
+
+PROOF_FILENAME = "inclusion_proof.json"
+PROOF_ALGORITHM = "sha256-sorted-pair"
+
+logger = logging.getLogger("anchor_batch")
+
+
+@dataclass
+class BatchAnchorResult:
+    txid: str
+    block_number: Optional[int]  # None while the root tx is only submitted
+    root: str  # 0x-prefixed Merkle root that was anchored on-chain
+    leaf: str  # 0x-prefixed bundle hash
+    leaf_index: int
+    batch_size: int
+    proof: List[str] = field(default_factory=list)
+
+
+def _hex32(hex_str: str) -> bytes:
+    if not isinstance(hex_str, str) or not hex_str.startswith("0x") or len(hex_str) != 66:
+        raise ValueError("bundle_hash must be 0x-prefixed 32-byte hex")
+    return bytes.fromhex(hex_str[2:])
+
+
+def _anchor_root(root_hex: str) -> Tuple[str, Optional[int]]:
+    # Python web3 only broadcasts (app.confirm confirms the root tx); the Node fallback
+    # returns once the tx is mined
+    try:
+        from . import anchor  # type: ignore
+        return anchor.submit_bundle(root_hex), None
+    except Exception:
+        pass
+    from . import anchor_node  # type: ignore
+    try:
+        return anchor_node.anchor_bundle(root_hex)
+    except anchor_node.SidecarError as e:
+        if e.txid:
+            return e.txid, None  # signed and possibly sent: the watcher confirms it
+        raise
+
+
+def _tree(bundle_hashes: List[str]) -> Tuple[List[str], List[List[bytes]]]:
+    # Leaves in hash order, so every process rebuilds the same tree from the claimed rows
+    leaves = sorted(bundle_hashes)
+    return leaves, merkle.build_tree([_hex32(h) for h in leaves])
+
+
+_wake = threading.Event()
+
+
+def wake() -> None:
+    """Check for a due batch now (called after a receipt is batched in this process)."""
+    _wake.set()
+
+
+class BatchFlusher:
+    """
+    Anchors `batched` receipts. Once `max_size` are waiting or the oldest has waited
+    `window_seconds`, claims them (conditional updates, so workers never share a leaf),
+    submits the batch's Merkle root on a small pool and, when it went out, writes each
+    receipt's inclusion proof and marks it submitted/anchored. Jobs never wait on a batch.
+    """
+    def __init__(
+        self,
+        max_size: int = BATCH_MAX_SIZE,
+        window_seconds: float = BATCH_WINDOW_SECONDS,
+        poll_seconds: float = BATCH_POLL_SECONDS,
+        submit_workers: int = BATCH_SUBMIT_WORKERS,
+        anchor_fn: Callable[[str], Tuple[str, Optional[int]]] = _anchor_root,
+    ) -> None:
+        self.max_size = max(1, max_size)
+        self.window = max(0.0, window_seconds)
+        self.poll_seconds = poll_seconds
+        self._anchor_fn = anchor_fn
+        self._workers = max(1, submit_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="batch-submit")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _due(self, session) -> List[Tuple[object, str]]:
+        rows = session.execute(
+            select(models.Receipt.id, models.Receipt.bundle_hash, models.Receipt.batched_at)
+            .where(models.Receipt.status == "batched", models.Receipt.merkle_root.is_(None))
+            .order_by(models.Receipt.batched_at, models.Receipt.id)
+            .limit(self.max_size)
+        ).all()
+        if not rows:
+            return []
+        oldest = rows[0].batched_at
+        if len(rows) < self.max_size and oldest is not None:
+            if oldest.replace(tzinfo=None) + timedelta(seconds=self.window) > datetime.utcnow():
+                return []
+        return [(r.id, r.bundle_hash) for r in rows]
+
+    def _claim(self, session, rows: List[Tuple[object, str]]) -> Optional[str]:
+        """Stamps the batch root on every row, or on none if another worker took one of them."""
+        _, levels = _tree([h for _, h in rows])
+        root = "0x" + merkle.root_of(levels).hex()
+        now = datetime.utcnow()
+        for rid, _ in rows:
+            res = session.execute(
+                update(models.Receipt)
+                .where(
+                    models.Receipt.id == rid,
+                    models.Receipt.status == "batched",
+                    models.Receipt.merkle_root.is_(None),
+                )
+                .values(merkle_root=root, batched_at=now)
+            )
+            if res.rowcount != 1:
+                session.rollback()
+                return None
+        session.commit()
+        return root
+
+    def poll_once(self) -> int:
+        """Claims every due batch and hands its root to the submit pool; returns the count."""
+        self.recover()
+        started = 0
+        session = db.SessionLocal()
+        try:
+            while True:
+                with self._lock:
+                    if self._in_flight >= self._workers:
+                        break  # leaves keep waiting (and batches grow) until a submit finishes
+                rows = self._due(session)
+                if not rows:
+                    break
+                root = self._claim(session, rows)
+                if root is None:
+                    break
+                with self._lock:
+                    self._in_flight += 1
+                self._pool.submit(self._submit, root)
+                started += 1
+        finally:
+            session.close()
+        return started
+
+    def _submit(self, root: str) -> None:
+        try:
+            try:
+                txid, block_number = self._anchor_fn(root)
+            except Exception:
+                logger.exception("anchoring batch root %s failed", root)
+                finish_batch(root, None, None)
+                return
+            finish_batch(root, txid, block_number)
+        except Exception:
+            logger.exception("finishing batch %s failed", root)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            _wake.set()
+
+    def recover(self) -> None:
+        """
+        Claimed batches older than ANCHOR_BATCH_CLAIM_SECONDS: finished as submitted when
+        their root tx was recorded (the watcher confirms it), released to be batched again otherwise.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=BATCH_CLAIM_SECONDS)
+        session = db.SessionLocal()
+        try:
+            roots = list(
+                session.scalars(
+                    select(models.Receipt.merkle_root)
+                    .where(
+                        models.Receipt.status == "batched",
+                        models.Receipt.merkle_root.is_not(None),
+                        models.Receipt.batched_at < cutoff,
+                    )
+                    .distinct()
+                )
+            )
+            for root in roots:
+                txid = session.scalars(
+                    select(models.AnchorTx.tx_hash)
+                    .where(models.AnchorTx.anchored_hash == root, models.AnchorTx.status != "failed")
+                    .order_by(models.AnchorTx.sent_at.desc())
+                ).first()
+                if txid:
+                    finish_batch(root, txid, None)
+                    continue
+                session.execute(
+                    update(models.Receipt)
+                    .where(models.Receipt.merkle_root == root, models.Receipt.status == "batched")
+                    .values(merkle_root=None)
+                )
+                session.commit()
+                logger.warning("released stale batch %s", root)
+        finally:
+            session.close()
+
+    def run(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception("batch flush failed")
+            _wake.wait(self.poll_seconds)
+            _wake.clear()
+        self._pool.shutdown(wait=True)
+
+    def start_in_thread(self, stop: threading.Event) -> None:
+        self._thread = threading.Thread(target=self.run, args=(stop,), name="anchor-batcher", daemon=True)
+        self._thread.start()
+
+
+def finish_batch(root: str, txid: Optional[str], block_number: Optional[int]) -> List[str]:
+    """
+    Moves the receipts claimed for `root` on: with a txid, writes each inclusion proof next
+    to its evidence.zip and marks it submitted (anchored when the block is known); without
+    one, marks them failed. Updates are conditional on the claim; returns the receipt ids moved.
+    """
+    from .confirm import _notify
+
+    session = db.SessionLocal()
+    done: List[str] = []
+    try:
+        recs = list(
+            session.scalars(
+                select(models.Receipt).where(
+                    models.Receipt.merkle_root == root, models.Receipt.status == "batched"
+                )
+            )
+        )
+        if not recs:
+            return done
+        leaves, levels = _tree([r.bundle_hash for r in recs])
+        if "0x" + merkle.root_of(levels).hex() != root:
+            logger.error("batch %s: claimed receipts do not reproduce the root", root)
+            txid = None
+        by_hash = {r.bundle_hash: r for r in recs}
+        now = datetime.utcnow()
+        if txid is None:
+            status, values = "failed", {"merkle_root": None}
+        else:
+            status = "submitted" if block_number is None else "anchored"
+            values = {"flare_txid": txid}
+            if block_number is not None:
+                values["anchored_at"] = now
+        for idx, leaf in enumerate(leaves):
+            rec = by_hash[leaf]
+            if txid is not None:
+                write_proof(
+                    Path(rec.bundle_path).parent,
+                    BatchAnchorResult(
+                        txid=txid,
+                        block_number=block_number,
+                        root=root,
+                        leaf=leaf,
+                        leaf_index=idx,
+                        batch_size=len(leaves),
+                        proof=["0x" + p.hex() for p in merkle.inclusion_proof(levels, idx)],
+                    ),
+                )
+            res = session.execute(
+                update(models.Receipt)
+                .where(
+                    models.Receipt.id == rec.id,
+                    models.Receipt.status == "batched",
+                    models.Receipt.merkle_root == root,
+                )
+                .values(status=status, **values)
+            )
+            if res.rowcount == 1:
+                done.append(str(rec.id))
+        session.commit()
+    finally:
+        session.close()
+    for rid in done:
+        _notify(rid)
+    return done
+
+
+def batch_enabled() -> bool:
+    return ANCHOR_MODE == "batch"
+
+
+def write_proof(out_dir: Path, result: BatchAnchorResult) -> Path:
+    """Persist the inclusion proof next to evidence.zip (outside the hashed archive)."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    doc = {
+        "version": "1.0",
+        "algorithm": PROOF_ALGORITHM,
+        "leaf": result.leaf,
+        "leaf_index": result.leaf_index,
+        "batch_size": result.batch_size,
+        "proof": result.proof,
+        "root": result.root,
+        "flare_txid": result.txid,
+        "block_number": result.block_number,
+    }
+    path = out_dir / PROOF_FILENAME
+    path.write_text(json.dumps(doc, indent=2, separators=(",", ": ")))
+    return path
+
+
+def root_from_proof(doc: dict, bundle_hash_hex: str) -> str:
+    """
+    Recompute the Merkle root from a stored proof document for the given bundle hash.
+    Raises ValueError if the proof does not belong to this bundle or is malformed.
+    """
+    if doc.get("algorithm") != PROOF_ALGORITHM:
+        raise ValueError(f"unsupported proof algorithm: {doc.get('algorithm')}")
+    leaf = _hex32(bundle_hash_hex)
+    if _hex32(doc.get("leaf", "")) != leaf:
+        raise ValueError("proof leaf does not match bundle hash")
+    proof = [_hex32(p) for p in doc.get("proof", [])]
+    root = merkle.compute_root(leaf, proof)
+    expected = doc.get("root")
+    if expected and _hex32(expected) != root:
+        raise ValueError("proof does not reproduce stated root")
+    return "0x" + root.hex()
+
+
+def stored_proof_root(bundle_hash_hex: str) -> Optional[str]:
+    """
+    Merkle root of a batch-anchored receipt with this bundle hash, recomputed from the
+    inclusion proof stored next to its evidence.zip and checked against the recorded root.
+    None when no receipt has this bundle or it was not anchored in a batch; raises
+    ValueError when the proof is missing or does not reproduce the root.
+    """
+    session = db.SessionLocal()
+    try:
+        rec = session.scalars(
+            select(models.Receipt)
+            .where(
+                models.Receipt.bundle_hash == bundle_hash_hex.lower(),
+                models.Receipt.merkle_root.is_not(None),
+                models.Receipt.status != "batched",  # claimed, root not sent yet
+            )
+            .limit(1)
+        ).first()
+        if rec is None or not rec.bundle_path:
+            return None
+        path = Path(rec.bundle_path).parent / PROOF_FILENAME
+        try:
+            doc = json.loads(path.read_text())
+        except FileNotFoundError:
+            raise ValueError(f"{PROOF_FILENAME} missing for receipt {rec.id}") from None
+        root = root_from_proof(doc, bundle_hash_hex)
+        if root.lower() != rec.merkle_root.lower():
+            raise ValueError("proof root does not match the recorded batch root")
+        return root
+    finally:
+        session.close()
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import itertools
 import json
+import logging
 import os
 import subprocess
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from datetime import datetime, timezone
-from typing import Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 from dotenv import load_dotenv
 
@@ -13,6 +17,12 @@ from .schemas import ChainMatch
 # Load .env so FLARE_RPC_URL and ANCHOR_CONTRACT_ADDR are available for Node scripts
 load_dotenv()
 
+# Keep one Node process (scripts/anchor_sidecar.js) running instead of spawning one per call
+ANCHOR_NODE_SIDECAR = os.getenv("ANCHOR_NODE_SIDECAR", "1") in {"1", "true", "TRUE", "yes", "on"}
+ANCHOR_NODE_TIMEOUT_SECONDS = float(os.getenv("ANCHOR_NODE_TIMEOUT_SECONDS", "300"))
+
+logger = logging.getLogger("anchor_node")
+
 
 def _parse_iso_utc(ts: Optional[str]) -> Optional[datetime]:
     if not ts:
@@ -62,44 +72,234 @@ def _run_node(args: list[str]) -> Tuple[int, str, str]:
     return proc.returncode, proc.stdout.strip(), proc.stderr.strip()
 
 
+class SidecarUnavailable(RuntimeError):
+    """The request could not be written to the sidecar, so it never ran (safe to retry elsewhere)."""
+
+
+class SidecarNoReply(RuntimeError):
+    """The request was written but no reply came (sidecar exited or timed out): it may have run."""
+
+
+class SidecarError(RuntimeError):
+    """
+    The sidecar replied with an error. For anchors, `sent` is False when the node provably
+    never got the tx (None when unknown) and `txid` is set once the tx was signed.
+    """
+    def __init__(self, message: str, sent: Optional[bool] = None, txid: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.sent = sent
+        self.txid = txid
+
+
+class _Sidecar:
+    """
+    JSON-lines client for scripts/anchor_sidecar.js. Requests carry an id and may be
+    in flight concurrently; a reader thread resolves them as replies arrive. The
+    process is (re)started on demand; a crash fails every pending request with
+    SidecarNoReply (they were delivered and may have run).
+    """
+    def __init__(self) -> None:
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+
+    def _start(self) -> subprocess.Popen:
+        proc = subprocess.Popen(
+            ["node", "scripts/anchor_sidecar.js"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=None,  # sidecar errors go to our stderr
+            text=True,
+            bufsize=1,
+            env=_node_env(),
+            cwd=os.getcwd(),
+            shell=False,
+        )
+        threading.Thread(target=self._read, args=(proc,), name="anchor-sidecar", daemon=True).start()
+        return proc
+
+    def _read(self, proc: subprocess.Popen) -> None:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                logger.warning("unexpected sidecar output: %s", line.strip())
+                continue
+            with self._lock:
+                fut = self._pending.pop(msg.get("id"), None)
+            if fut is None:
+                continue
+            if msg.get("ok"):
+                fut.set_result(msg.get("result"))
+            else:
+                fut.set_exception(SidecarError(msg.get("error") or "sidecar error", msg.get("sent"), msg.get("txid")))
+        # stdout closed: the process exited
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+            pending = list(self._pending.items())
+            self._pending.clear()
+        for _, fut in pending:
+            fut.set_exception(SidecarNoReply(f"sidecar exited with code {proc.wait()}"))
+
+    def request(self, op: str, payload: Dict[str, Any], timeout: float = ANCHOR_NODE_TIMEOUT_SECONDS) -> Any:
+        fut: Future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = fut
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    self._proc = self._start()
+                assert self._proc.stdin is not None
+                self._proc.stdin.write(json.dumps({"id": req_id, "op": op, **payload}) + "\n")
+                self._proc.stdin.flush()
+            except (OSError, ValueError) as e:
+                self._pending.pop(req_id, None)
+                raise SidecarUnavailable(str(e)) from e
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._pending.pop(req_id, None)
+            raise SidecarNoReply(f"no reply to {op} within {timeout:g}s") from None
+
+
+_sidecar = _Sidecar()
+
+
+def _via_sidecar(op: str, bundle_hash_hex: str, **extra: Any) -> Optional[Dict[str, Any]]:
+    """
+    Sidecar result, or None if the sidecar is disabled or the request could not be written
+    (it never ran, so a one-off node process may do it instead). Any failure after the
+    write raises: the sidecar may have sent the tx already.
+    """
+    if not ANCHOR_NODE_SIDECAR:
+        return None
+    try:
+        return _sidecar.request(op, {"hash": bundle_hash_hex, **extra})
+    except SidecarUnavailable as e:
+        logger.warning("anchor sidecar unavailable (%s); using one-off node process", e)
+        return None
+
+
+def _nonce_manager():
+    """
+    The shared NonceManager of the anchoring wallet (the one app.anchor uses), so sidecar
+    anchors take their nonces from `anchor_nonces` too; None when it cannot be derived here.
+    """
+    pk = _node_env().get("ANCHOR_PRIVATE_KEY")
+    if not pk:
+        return None
+    try:
+        from eth_account import Account  # type: ignore
+
+        from . import nonce, rpc
+    except ImportError:
+        return None
+    address = Account.from_key(pk).address
+    client = rpc.get_client()
+    return nonce.get_manager(address, lambda ident: int(client.call("eth_getTransactionCount", [address, ident]), 16))
+
+
+def _anchor_via_sidecar(bundle_hash_hex: str) -> Optional[Dict[str, Any]]:
+    mgr = _nonce_manager() if ANCHOR_NODE_SIDECAR else None
+    if mgr is None:
+        return _via_sidecar("anchor", bundle_hash_hex)
+
+    from . import nonce
+
+    for _ in range(3):
+        nonce_value = mgr.allocate()
+        try:
+            data = _via_sidecar("anchor", bundle_hash_hex, nonce=nonce_value)
+        except SidecarError as e:
+            if e.txid:
+                # Signed and possibly broadcast: track it like any other sent tx
+                mgr.record_sent(nonce_value, e.txid, bundle_hash_hex, {})
+            elif e.sent is False and nonce.is_nonce_too_low(e):
+                mgr.resync()
+                continue
+            elif e.sent is False:
+                mgr.release(nonce_value)
+            else:
+                mgr.forget(nonce_value)
+            raise
+        except Exception:
+            mgr.forget(nonce_value)  # no reply: the tx may or may not exist
+            raise
+        if data is None:
+            mgr.release(nonce_value)  # never written; the one-off script picks its own nonce
+            return None
+        if data.get("txid"):
+            mgr.record_sent(nonce_value, data["txid"], bundle_hash_hex, {})
+            mgr.mark(nonce_value, "mined")
+        return data
+    raise RuntimeError("sidecar anchor failed: nonce too low after resync")
+
+
 def anchor_bundle(bundle_hash_hex: str) -> Tuple[str, int]:
     """
-    Anchors the bundle hash using Node script (scripts/anchor.js).
+    Anchors the bundle hash using the Node sidecar (scripts/anchor_sidecar.js),
+    or a one-off Node script (scripts/anchor.js) if the sidecar is unavailable.
     Requires env: FLARE_RPC_URL, ANCHOR_CONTRACT_ADDR, ANCHOR_PRIVATE_KEY.
     Returns (txid_hex, blockNumber).
     """
     if not isinstance(bundle_hash_hex, str) or not bundle_hash_hex.startswith("0x") or len(bundle_hash_hex) != 66:
         raise ValueError("bundle_hash must be 0x-prefixed 32-byte hex")
 
-    code, out, err = _run_node(["node", "scripts/anchor.js", bundle_hash_hex])
-    if code != 0:
-        raise RuntimeError(f"node anchor failed: {err or out}")
+    out = ""
+    data = _anchor_via_sidecar(bundle_hash_hex)
+    if data is None:
+        code, out, err = _run_node(["node", "scripts/anchor.js", bundle_hash_hex])
+        if code != 0:
+            raise RuntimeError(f"node anchor failed: {err or out}")
 
     try:
-        data = json.loads(out)
+        if data is None:
+            data = json.loads(out)
         txid = data.get("txid")
         block_number = int(data.get("blockNumber")) if data.get("blockNumber") is not None else 0
         if not txid:
             raise ValueError("missing txid in node output")
         return txid, block_number
     except Exception as e:
-        raise RuntimeError(f"invalid node anchor output: {e}; raw={out}") from e
+        raise RuntimeError(f"invalid node anchor output: {e}; raw={out or data}") from e
 
 
 def find_anchor(bundle_hash_hex: str) -> ChainMatch:
     """
-    Looks up the EvidenceAnchored event using Node script (scripts/find.js).
+    Looks up the EvidenceAnchored event in the local index, then via Node script (scripts/find.js).
     Requires env: FLARE_RPC_URL, ANCHOR_CONTRACT_ADDR.
     """
     if not isinstance(bundle_hash_hex, str) or not bundle_hash_hex.startswith("0x") or len(bundle_hash_hex) != 66:
         return ChainMatch(matches=False)
 
-    code, out, err = _run_node(["node", "scripts/find.js", bundle_hash_hex])
-    if code != 0:
+    # The local event index answers without spawning Node
+    try:
+        from . import indexer
+
+        indexed = indexer.lookup(bundle_hash_hex)
+        if indexed is not None:
+            return indexed
+    except Exception:
+        pass
+
+    try:
+        data = _via_sidecar("find", bundle_hash_hex)
+    except SidecarNoReply:
+        data = None  # read-only: safe to run again in a one-off process
+    except Exception:
         return ChainMatch(matches=False)
+    if data is None:
+        code, out, err = _run_node(["node", "scripts/find.js", bundle_hash_hex])
+        if code != 0:
+            return ChainMatch(matches=False)
 
     try:
-        data = json.loads(out)
+        if data is None:
+            data = json.loads(out)
         matches = bool(data.get("matches"))
         txid = data.get("txid") if matches else None
         anchored_at = _parse_iso_utc(data.get("anchored_at")) if matches else None
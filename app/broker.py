@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Optional
+
+
+# "memory": events stay in this process; "postgres": fan out to every process via LISTEN/NOTIFY
+SSE_BROKER = os.getenv("SSE_BROKER", "memory").strip().lower()
+SSE_BROKER_CHANNEL = os.getenv("SSE_BROKER_CHANNEL", "receipt_events")
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+_MAX_NOTIFY_BYTES = 7999
+
+logger = logging.getLogger("broker")
+
+# handler(receipt_id, payload, event_id): local delivery of an event, from any thread
+Handler = Callable[[str, dict, int], None]
+
+
+class Broker:
+    """
+    Carries hub events between processes. `publish` may be called from any thread
+    and delivers locally right away; `start` opens the (single) upstream subscription
+    of this process, whose events are handed to the same handler.
+    """
+    # publish() does I/O; async callers should run it in a thread
+    blocking = False
+
+    def __init__(self) -> None:
+        self._handler: Optional[Handler] = None
+
+    def set_handler(self, handler: Handler) -> None:
+        self._handler = handler
+
+    def _deliver(self, rid: str, payload: dict, event_id: int) -> None:
+        if self._handler is not None:
+            self._handler(rid, payload, event_id)
+
+    def publish(self, rid: str, payload: dict, event_id: int) -> None:
+        self._deliver(rid, payload, event_id)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MemoryBroker(Broker):
+    """Single process: publish is local delivery only."""
+
+
+class PostgresBroker(Broker):
+    """
+    NOTIFY on publish (through the sync engine, so worker processes can publish too)
+    and one asyncpg connection per process that LISTENs and reconnects with backoff.
+    Events published by this process are delivered locally and skipped when they
+    come back from the server.
+    """
+    blocking = True
+
+    def __init__(self, channel: str = SSE_BROKER_CHANNEL) -> None:
+        super().__init__()
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, rid: str, payload: dict, event_id: int) -> None:
+        self._deliver(rid, payload, event_id)
+        message = json.dumps({"o": self.origin, "rid": rid, "i": event_id, "p": payload}, separators=(",", ":"), default=str)
+        if len(message.encode("utf-8")) > _MAX_NOTIFY_BYTES:
+            logger.warning("event for %s too large for NOTIFY; delivered locally only", rid)
+            return
+        from sqlalchemy import text
+
+        from . import db
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :message)"), {"channel": self.channel, "message": message})
+                conn.commit()
+        except Exception:
+            logger.warning("NOTIFY for %s failed", rid, exc_info=True)
+
+    def _on_notify(self, _conn, _pid, _channel, message: str) -> None:
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        if data.get("o") == self.origin:
+            return
+        self._deliver(data["rid"], data["p"], int(data["i"]))
+
+    async def _listen(self) -> None:
+        import asyncpg  # type: ignore
+        from sqlalchemy.engine import make_url
+
+        from . import db
+
+        dsn = make_url(db.ASYNC_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _c: lost.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                logger.info("listening on %s", self.channel)
+                backoff = 1.0
+                await lost.wait()
+                logger.warning("LISTEN connection lost; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("LISTEN on %s failed; retrying in %.0fs", self.channel, backoff, exc_info=True)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(backoff)
+            backoff = min(30.0, backoff * 2)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def from_env() -> Broker:
+    if SSE_BROKER == "postgres":
+        from . import db
+
+        if db.DATABASE_URL.startswith("postgres"):
+            return PostgresBroker()
+        logger.warning("SSE_BROKER=postgres needs a Postgres DATABASE_URL; using the in-memory broker")
+    elif SSE_BROKER != "memory":
+        logger.warning("unknown SSE_BROKER %r; using the in-memory broker", SSE_BROKER)
+    return MemoryBroker()
@@ -29,7 +29,7 @@ except Exception:  # pragma: no cover
 from zipfile import ZipFile, ZipInfo, ZIP_STORED
 import hashlib
 
-from . import iso
+from . import iso_stream, anchor_batch
 from .schemas import VerificationResult
 
 
@@ -293,8 +293,22 @@ def verify_bundle(bundle_url: str) -> VerificationResult:
                     errors.append(f"missing_file:{name}")
                     return b""
 
+            def member_sha256(name: str) -> str:
+                # Streamed: members of a batch bundle can be far larger than memory should hold
+                hasher = hashlib.sha256()
+                try:
+                    with zf.open(name) as f:
+                        for chunk in iter(lambda: f.read(65536), b""):
+                            hasher.update(chunk)
+                except KeyError:
+                    errors.append(f"missing_file:{name}")
+                    return _sha256_hex(b"")
+                return "0x" + hasher.hexdigest()
+
             manifest_bytes = read("manifest.json")
-            xml_bytes = read("pain001.xml")
+            has_xml = "pain001.xml" in namelist
+            if not has_xml:
+                errors.append("missing_file:pain001.xml")
             receipt_bytes = read("receipt.json")
             tip_bytes = read("tip.json")
             pk_pem_bytes = read("public_key.pem")
@@ -308,20 +322,21 @@ def verify_bundle(bundle_url: str) -> VerificationResult:
                     if not name or not expected_sha:
                         errors.append("manifest_entry_invalid")
                         continue
-                    content = read(name)
-                    actual = _sha256_hex(content)
+                    actual = member_sha256(name)
                     if actual != expected_sha:
                         errors.append(f"file_hash_mismatch:{name}")
             except Exception as e:
                 errors.append(f"manifest_invalid:{e}")
 
-            # XML validation (if schema present)
+            # XML validation (if schema present): every transaction is checked, streamed from the
+            # zip, with the line and path of each error
             try:
-                # iso.generate_pain001 validates using vendored schema if present,
-                # but here we only want to validate the given XML
-                schema = iso._get_schema()  # type: ignore
-                if schema is not None and xml_bytes:
-                    schema.validate(xml_bytes)
+                if has_xml:
+                    with zf.open("pain001.xml") as f:
+                        checked = iso_stream.validate_stream(f)
+                    errors.extend(f"xml_invalid:{issue}" for issue in checked.errors)
+                    if checked.truncated:
+                        errors.append(f"xml_invalid:stopped after {len(checked.errors)} errors")
             except Exception as e:
                 errors.append(f"xml_invalid:{e}")
 
@@ -351,4 +366,11 @@ def verify_bundle(bundle_url: str) -> VerificationResult:
         except Exception as e:
             errors.append(f"signature_check_failed:{e}")
 
-    return VerificationResult(bundle_hash=bundle_hash, errors=errors)
+    # Inclusion proof: only for a receipt of ours that was batch-anchored
+    merkle_root = None
+    try:
+        merkle_root = anchor_batch.stored_proof_root(bundle_hash)
+    except Exception as e:
+        errors.append(f"proof_invalid:{e}")
+
+    return VerificationResult(bundle_hash=bundle_hash, errors=errors, merkle_root=merkle_root)
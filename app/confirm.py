@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
+
+from . import db, fees, models, rpc
+
+
+# "wait": workers block until the anchor tx is mined (default)
+# "watch": workers only broadcast and mark receipts `submitted`; ConfirmationWatcher confirms them
+ANCHOR_CONFIRM_MODE = os.getenv("ANCHOR_CONFIRM_MODE", "wait").strip().lower()
+CONFIRM_POLL_SECONDS = float(os.getenv("CONFIRM_POLL_SECONDS", "3"))
+CONFIRM_BATCH_SIZE = int(os.getenv("CONFIRM_BATCH_SIZE", "200"))
+# Submitted receipts whose tx is not mined and no longer tracked as pending this long after it
+# was sent are failed
+CONFIRM_TIMEOUT_SECONDS = int(os.getenv("CONFIRM_TIMEOUT_SECONDS", "3600"))
+
+logger = logging.getLogger("confirm")
+
+
+def watch_enabled() -> bool:
+    return ANCHOR_CONFIRM_MODE == "watch"
+
+
+def _get_receipts(tx_hashes: List[str]) -> Dict[str, Optional[dict]]:
+    """eth_getTransactionReceipt for many txs in one JSON-RPC batch request."""
+    results = rpc.get_client().batch([("eth_getTransactionReceipt", [h]) for h in tx_hashes])
+    return {h: r for h, r in zip(tx_hashes, results) if not isinstance(r, Exception)}
+
+
+class ConfirmationWatcher:
+    """
+    Moves `submitted` receipts to `anchored`/`failed` by polling receipts of all
+    outstanding anchor txs in batches. One watcher per worker process; updates are
+    conditional on status='submitted', so concurrent watchers never double-notify.
+    """
+    def __init__(self, poll_seconds: float = CONFIRM_POLL_SECONDS, batch_size: int = CONFIRM_BATCH_SIZE) -> None:
+        self.poll_seconds = poll_seconds
+        self.batch_size = max(1, batch_size)
+        self._offset = 0  # next page of outstanding txs; wraps, so every tx is polled in turn
+        self._thread: Optional[threading.Thread] = None
+
+    def _outstanding(self, session) -> List[str]:
+        """One page of outstanding tx hashes, oldest submission first."""
+        submitted = func.min(func.coalesce(models.AnchorTx.sent_at, models.Receipt.created_at))
+        page = list(
+            session.scalars(
+                select(models.Receipt.flare_txid)
+                .outerjoin(models.AnchorTx, models.AnchorTx.tx_hash == models.Receipt.flare_txid)
+                .where(models.Receipt.status == "submitted", models.Receipt.flare_txid.is_not(None))
+                .group_by(models.Receipt.flare_txid)
+                .order_by(submitted, models.Receipt.flare_txid)
+                .offset(self._offset)
+                .limit(self.batch_size)
+            )
+        )
+        self._offset = 0 if len(page) < self.batch_size else self._offset + self.batch_size
+        return page
+
+    def _sent_for_nonce(self, session, tx_hashes: List[str]) -> Dict[str, List[str]]:
+        """Per tx hash, every hash sent for the same nonce (fee-bump replacements), itself first."""
+        out: Dict[str, List[str]] = {h: [h] for h in tx_hashes}
+        sent, other = aliased(models.AnchorTxHash), aliased(models.AnchorTxHash)
+        rows = session.execute(
+            select(sent.tx_hash, other.tx_hash)
+            .join(other, (other.from_address == sent.from_address) & (other.nonce == sent.nonce))
+            .where(sent.tx_hash.in_(tx_hashes), other.tx_hash != sent.tx_hash)
+            .order_by(other.sent_at)
+        ).all()
+        for tx_hash, alt in rows:
+            out[tx_hash].append(alt)
+        return out
+
+    def _resolve(self, session, tx_hash: str, status: str, mined_hash: Optional[str] = None) -> List[str]:
+        rids = list(
+            session.scalars(
+                select(models.Receipt.id).where(
+                    models.Receipt.flare_txid == tx_hash, models.Receipt.status == "submitted"
+                )
+            )
+        )
+        done: List[str] = []
+        now = datetime.utcnow()
+        mined_hash = mined_hash or tx_hash
+        for rid in rids:
+            values = {"status": status, "flare_txid": mined_hash}
+            if status == "anchored":
+                values["anchored_at"] = now
+            res = session.execute(
+                update(models.Receipt)
+                .where(models.Receipt.id == rid, models.Receipt.status == "submitted")
+                .values(**values)
+            )
+            if res.rowcount == 1:
+                done.append(str(rid))
+        session.execute(
+            update(models.AnchorTx)
+            .where(models.AnchorTx.tx_hash.in_({tx_hash, mined_hash}))
+            .values(tx_hash=mined_hash, status="mined" if status == "anchored" else "failed", updated_at=now)
+        )
+        session.commit()
+        return done
+
+    def _expired(self, session, tx_hash: str) -> bool:
+        tracked = session.execute(
+            select(models.AnchorTx.status, models.AnchorTx.sent_at).where(models.AnchorTx.tx_hash == tx_hash)
+        ).first()
+        if tracked is not None and tracked.status == "pending":
+            return False  # the nonce sweeper is still managing it (may replace it)
+        cutoff = datetime.utcnow() - timedelta(seconds=CONFIRM_TIMEOUT_SECONDS)
+        sent_at = tracked.sent_at if tracked is not None else None
+        if sent_at is None:
+            # Untracked tx (e.g. sent by the Node fallback): the receipt is the closest timestamp
+            sent_at = session.scalars(
+                select(models.Receipt.created_at)
+                .where(models.Receipt.flare_txid == tx_hash, models.Receipt.status == "submitted")
+                .order_by(models.Receipt.created_at)
+            ).first()
+        return sent_at is not None and sent_at.replace(tzinfo=None) < cutoff
+
+    def poll_once(self) -> int:
+        """One batch: returns the number of receipts moved to a terminal state."""
+        session = db.SessionLocal()
+        try:
+            tx_hashes = self._outstanding(session)
+            if not tx_hashes:
+                return 0
+            candidates = self._sent_for_nonce(session, tx_hashes)
+            receipts = _get_receipts(sorted({h for hs in candidates.values() for h in hs}))
+            finished: List[str] = []
+            for tx_hash in tx_hashes:
+                # The receipt may be of the original tx or of any replacement
+                mined = next((h for h in candidates[tx_hash] if receipts.get(h) is not None), None)
+                if mined is None:
+                    if self._expired(session, tx_hash):
+                        finished += self._resolve(session, tx_hash, "failed")
+                    continue
+                ok = int(str(receipts[mined].get("status", "0x1")), 16) == 1
+                if not ok:
+                    fees.gas_cache.failed()  # re-estimate gas with a wider margin
+                finished += self._resolve(session, tx_hash, "anchored" if ok else "failed", mined)
+        finally:
+            session.close()
+        for rid in finished:
+            _notify(rid)
+        return len(finished)
+
+    async def run(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                await asyncio.to_thread(self.poll_once)
+            except Exception:
+                logger.exception("confirmation poll failed")
+            await asyncio.to_thread(stop.wait, self.poll_seconds)
+
+    def start_in_thread(self, stop: threading.Event) -> None:
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run(stop)), name="confirm-watcher", daemon=True)
+        self._thread.start()
+
+
+def _notify(receipt_id: str) -> None:
+    from .processing import notify
+
+    session = db.SessionLocal()
+    try:
+        rec = session.get(models.Receipt, receipt_id)
+        if rec is None:
+            return
+        job = session.scalars(
+            select(models.Job).where(models.Job.receipt_id == rec.id).order_by(models.Job.created_at.desc())
+        ).first()
+        notify(rec, job.callback_url if job else None)
+    except Exception:
+        logger.exception("notify for %s failed", receipt_id)
+    finally:
+        session.close()
@@ -1,8 +1,15 @@
 from __future__ import annotations
 
 import os
+import threading
+import time
+from typing import Any, Dict, Optional, Type
+
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
 
 
 def _db_url() -> str:
@@ -17,14 +24,153 @@ def _db_url() -> str:
 DATABASE_URL = _db_url()
 ECHO = os.getenv("SQL_ECHO", "0") in {"1", "true", "TRUE", "yes", "on"}
 
+# Connection pool (Postgres; each engine below has its own pool of this size)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Connections older than this are replaced (stay below server / proxy idle timeouts)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test each connection on checkout, so a restarted database costs a reconnect, not an error
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") in {"1", "true", "TRUE", "yes", "on"}
+# Compiled SQL statements cached by SQLAlchemy per engine
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+# Server-side prepared statements cached per connection by asyncpg (0 disables, e.g. behind
+# pgbouncer in transaction mode)
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "256"))
+# psycopg 3 only: executions before a query is prepared server-side (empty disables)
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "5").strip()
+
+
+class PoolStats:
+    """Checkout wait times of one pool, cumulative since start."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self.wait_total / attempts, 3) if attempts else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max, 3),
+            }
+
+
+def _timed_pool(base: Type[QueuePool]) -> Type[QueuePool]:
+    """Pool class that records how long each checkout waited for a connection."""
+    class _TimedPool(base):  # type: ignore[valid-type, misc]
+        # On the class, so pool.recreate() (after invalidation) keeps the same counters
+        stats = PoolStats()
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except PoolTimeout:
+                self.stats.observe(time.perf_counter() - started, timed_out=True)
+                raise
+            self.stats.observe(time.perf_counter() - started)
+            return conn
+
+    _TimedPool.__name__ = "Timed" + base.__name__
+    return _TimedPool
+
+
+def _pool_kwargs(poolclass: Type[QueuePool]) -> Dict[str, Any]:
+    return {
+        "poolclass": _timed_pool(poolclass),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "query_cache_size": DB_QUERY_CACHE_SIZE,
+    }
+
+
 engine_kwargs = {"echo": ECHO, "future": True}
 
 if DATABASE_URL.startswith("sqlite"):
     # Needed for SQLite in multithreaded FastAPI dev
     engine_kwargs["connect_args"] = {"check_same_thread": False}
+else:
+    engine_kwargs.update(_pool_kwargs(QueuePool))
+    if DATABASE_URL.startswith("postgresql+psycopg://") and DB_PREPARE_THRESHOLD:
+        engine_kwargs["connect_args"] = {"prepare_threshold": int(DB_PREPARE_THRESHOLD)}
 
 engine = create_engine(DATABASE_URL, **engine_kwargs)
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 Base = declarative_base()
+
+
+# ---------- Async engine (API request path) ----------
+# Same database through an asyncio driver: asyncpg for Postgres, aiosqlite for SQLite
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgresql+psycopg": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def _async_db_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return _ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_db_url(DATABASE_URL)
+
+async_engine_kwargs: Dict[str, Any] = {"echo": ECHO}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine_kwargs.update(_pool_kwargs(AsyncAdaptedQueuePool))
+    if ASYNC_DATABASE_URL.startswith("postgresql+asyncpg://"):
+        async_engine_kwargs["connect_args"] = {"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE}
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_kwargs)
+
+# Objects stay usable after commit (responses are built from them outside the transaction)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+
+def _pool_status(pool: Pool) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        out.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                # Connections open beyond pool_size (negative: pool not yet filled)
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "timeout_seconds": pool.timeout(),
+            }
+        )
+    stats: Optional[PoolStats] = getattr(pool, "stats", None)
+    if stats is not None:
+        out.update(stats.snapshot())
+    return out
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Live state of both connection pools (sync: worker and sync routes; async: API routes)."""
+    return {"sync": _pool_status(engine.pool), "async": _pool_status(async_engine.sync_engine.pool)}
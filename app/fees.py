@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import rpc
+
+
+# The oracle polls eth_blockNumber this often and fetches fees only when a new block arrives
+FEE_POLL_SECONDS = float(os.getenv("FEE_POLL_SECONDS", "2"))
+# Fees older than this are refreshed inline before use (oracle thread stalled / RPC down)
+FEE_MAX_AGE_SECONDS = float(os.getenv("FEE_MAX_AGE_SECONDS", "30"))
+# Gas limit = cached estimate * margin; the margin grows after a failed tx, up to the max
+GAS_SAFETY_MARGIN = float(os.getenv("GAS_SAFETY_MARGIN", "1.2"))
+GAS_SAFETY_MARGIN_MAX = float(os.getenv("GAS_SAFETY_MARGIN_MAX", "2.0"))
+# Used when no estimate is available at all
+GAS_FALLBACK = int(os.getenv("GAS_FALLBACK", "200000"))
+
+# Conservative minimum tip (2 gwei)
+_MIN_TIP = int(2e9)
+
+logger = logging.getLogger("fees")
+
+
+def _int(value: Any) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+def fees_from_history(history: Dict[str, Any]) -> Tuple[int, int]:
+    """(maxFeePerGas, maxPriorityFeePerGas) from an eth_feeHistory result."""
+    base = _int(history["baseFeePerGas"][-1])
+    # Pick a conservative tip or max priority from history
+    tip = _MIN_TIP
+    try:
+        prio = history.get("reward", [])
+        if prio and prio[-1]:
+            # Use median (50th percentile)
+            tip = max(tip, _int(prio[-1][1]))
+    except Exception:
+        pass
+    # Max fee = base * 2 + tip (simple rule)
+    return base * 2 + tip, tip
+
+
+class FeesUnavailable(RuntimeError):
+    """No fee data has been fetched yet and the RPC endpoint cannot be reached."""
+
+
+class FeeOracle:
+    """
+    Keeps current fee fields in memory. A background thread polls the block number
+    alone and, only when a new block arrives, refreshes fee history and gas price in
+    one batched request, so building a tx reads fees without an RPC call.
+    """
+    def __init__(self, poll_seconds: float = FEE_POLL_SECONDS, max_age: float = FEE_MAX_AGE_SECONDS) -> None:
+        self.poll_seconds = poll_seconds
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._fees: Dict[str, Any] = {}
+        self._block: Optional[int] = None
+        self._updated = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> bool:
+        """Fetch fees if the chain moved on; returns True when fees were updated."""
+        client = rpc.get_client()
+        number = _int(client.call("eth_blockNumber"))
+        with self._lock:
+            if number == self._block and self._fees:
+                self._updated = time.monotonic()
+                return False
+        history, gas_price = client.batch(
+            [
+                ("eth_feeHistory", [hex(5), "latest", [10, 50, 90]]),
+                ("eth_gasPrice", []),
+            ]
+        )
+        fees: Dict[str, Any] = {}
+        try:
+            max_fee, max_priority = fees_from_history(history)
+            fees = {"type": 2, "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority}
+        except Exception:
+            # Fallback to legacy
+            if not isinstance(gas_price, Exception) and gas_price is not None:
+                fees = {"gasPrice": _int(gas_price)}
+        if not fees:
+            return False
+        with self._lock:
+            self._fees = fees
+            self._block = number
+            self._updated = time.monotonic()
+        return True
+
+    def current(self) -> Dict[str, Any]:
+        """
+        Fee fields for a new tx. Before the first successful poll (or when fees are older
+        than max_age) this refreshes inline, blocking the caller. If that fails, the last
+        fees are returned; with none at all FeesUnavailable is raised, so a tx is never
+        built with fees left for web3 to fetch.
+        """
+        self._ensure_thread()
+        with self._lock:
+            fresh = self._fees and time.monotonic() - self._updated <= self.max_age
+            if fresh:
+                return dict(self._fees)
+        try:
+            self.refresh()
+        except Exception:
+            logger.warning("fee refresh failed", exc_info=True)
+        with self._lock:
+            if not self._fees:
+                raise FeesUnavailable("no fee data: RPC unreachable")
+            return dict(self._fees)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            def _loop() -> None:
+                while True:
+                    try:
+                        self.refresh()
+                    except Exception:
+                        logger.debug("fee poll failed", exc_info=True)
+                    time.sleep(self.poll_seconds)
+
+            self._thread = threading.Thread(target=_loop, name="fee-oracle", daemon=True)
+            self._thread.start()
+
+
+class GasCache:
+    """
+    Gas estimates per function selector (the cost of anchorEvidence(bytes32) barely
+    changes). A tx that fails invalidates the entry and widens the margin for the
+    next estimate, bounded by GAS_SAFETY_MARGIN_MAX.
+    """
+    def __init__(self, margin: float = GAS_SAFETY_MARGIN, max_margin: float = GAS_SAFETY_MARGIN_MAX) -> None:
+        self.base_margin = margin
+        self.max_margin = max(margin, max_margin)
+        self._lock = threading.Lock()
+        self._estimates: Dict[str, int] = {}
+        self._margins: Dict[str, float] = {}
+
+    def gas_limit(self, selector: str, estimate: Callable[[], int]) -> int:
+        with self._lock:
+            cached = self._estimates.get(selector)
+            margin = self._margins.get(selector, self.base_margin)
+        if cached is None:
+            try:
+                cached = int(estimate())
+            except Exception:
+                logger.warning("gas estimate for %s failed; using fallback", selector, exc_info=True)
+                return GAS_FALLBACK
+            with self._lock:
+                self._estimates[selector] = cached
+        return int(cached * margin)
+
+    def failed(self, selector: Optional[str] = None) -> None:
+        """Re-estimate next time, with a wider margin (all selectors if none is given)."""
+        with self._lock:
+            selectors = [selector] if selector is not None else list(self._estimates)
+            for sel in selectors:
+                self._estimates.pop(sel, None)
+                margin = self._margins.get(sel, self.base_margin)
+                self._margins[sel] = min(self.max_margin, margin * 1.25)
+
+
+oracle = FeeOracle()
+gas_cache = GasCache()
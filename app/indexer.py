@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import db, models
+from .schemas import ChainMatch
+
+
+# Tail EvidenceAnchored logs into `anchor_events` so verify is a local lookup
+ANCHOR_INDEX_ENABLED = os.getenv("ANCHOR_INDEX_ENABLED", "1") in {"1", "true", "TRUE", "yes", "on"}
+ANCHOR_INDEX_POLL_SECONDS = float(os.getenv("ANCHOR_INDEX_POLL_SECONDS", "5"))
+# Blocks re-scanned when the checkpoint block is no longer canonical
+ANCHOR_INDEX_REORG_DEPTH = int(os.getenv("ANCHOR_INDEX_REORG_DEPTH", "64"))
+# First block to index on a fresh database (default: latest - ANCHOR_LOOKBACK_BLOCKS)
+ANCHOR_INDEX_START_BLOCK = os.getenv("ANCHOR_INDEX_START_BLOCK", "").strip()
+
+CONTRACT_ADDR = os.getenv("ANCHOR_CONTRACT_ADDR")
+
+logger = logging.getLogger("indexer")
+
+
+def enabled() -> bool:
+    return ANCHOR_INDEX_ENABLED and bool(CONTRACT_ADDR)
+
+
+def _contract_key() -> str:
+    return (CONTRACT_ADDR or "").lower()
+
+
+def lookup(anchored_hash_hex: str) -> Optional[ChainMatch]:
+    """Earliest indexed EvidenceAnchored event of the configured contract for this hash, or None."""
+    if not isinstance(anchored_hash_hex, str) or not CONTRACT_ADDR:
+        return None
+    session = db.SessionLocal()
+    try:
+        row = session.scalars(
+            select(models.AnchorEvent)
+            .where(
+                models.AnchorEvent.contract == _contract_key(),
+                models.AnchorEvent.bundle_hash == anchored_hash_hex.lower(),
+            )
+            .order_by(models.AnchorEvent.block_number, models.AnchorEvent.log_index)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+        anchored_at = row.anchored_at
+        if anchored_at is not None and anchored_at.tzinfo is None:
+            anchored_at = anchored_at.replace(tzinfo=timezone.utc)
+        return ChainMatch(matches=True, txid=row.tx_hash, anchored_at=anchored_at)
+    finally:
+        session.close()
+
+
+def coverage() -> Optional[Tuple[int, int]]:
+    """(first, last) block fully indexed for the configured contract, or None."""
+    if not CONTRACT_ADDR:
+        return None
+    session = db.SessionLocal()
+    try:
+        cp = session.get(models.IndexCheckpoint, _contract_key())
+        if cp is None:
+            return None
+        return cp.start_block, cp.block_number
+    finally:
+        session.close()
+
+
+def _hex(value: Any) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    text = str(value)
+    return (text if text.startswith("0x") else "0x" + text).lower()
+
+
+class AnchorIndexer:
+    """
+    Tails EvidenceAnchored logs of the anchor contract into `anchor_events`
+    (ranges come from the shared adaptive scanner, see app/logscan.py).
+
+    The checkpoint stores the last indexed block together with its hash. If that hash
+    is no longer on the canonical chain, events from the last `reorg_depth` blocks are
+    dropped and re-scanned. Several indexers may run at once: the checkpoint only
+    advances from the value it was read at, and duplicate logs hit the unique key.
+    """
+    def __init__(
+        self,
+        reorg_depth: int = ANCHOR_INDEX_REORG_DEPTH,
+        poll_seconds: float = ANCHOR_INDEX_POLL_SECONDS,
+    ) -> None:
+        self.reorg_depth = max(1, reorg_depth)
+        self.poll_seconds = poll_seconds
+        self._thread: Optional[threading.Thread] = None
+
+    def _checkpoint(self, session: Session, w3) -> models.IndexCheckpoint:
+        cp = session.get(models.IndexCheckpoint, _contract_key())
+        if cp is not None:
+            return cp
+        from .anchor import LOOKBACK_BLOCKS
+
+        if ANCHOR_INDEX_START_BLOCK:
+            start = int(ANCHOR_INDEX_START_BLOCK)
+        else:
+            start = max(0, w3.eth.block_number - LOOKBACK_BLOCKS)
+        before = max(0, start - 1)
+        cp = models.IndexCheckpoint(
+            contract=_contract_key(),
+            start_block=start,
+            block_number=before,
+            block_hash=_hex(w3.eth.get_block(before)["hash"]),
+            updated_at=datetime.utcnow(),
+        )
+        session.add(cp)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            cp = session.get(models.IndexCheckpoint, _contract_key())
+        return cp
+
+    def _rewind_if_reorged(self, session: Session, w3, cp: models.IndexCheckpoint) -> None:
+        canonical = _hex(w3.eth.get_block(cp.block_number)["hash"])
+        if canonical == cp.block_hash:
+            return
+        target = max(cp.start_block - 1, cp.block_number - self.reorg_depth, 0)
+        logger.warning("reorg detected at block %s; rewinding index to %s", cp.block_number, target)
+        session.execute(
+            delete(models.AnchorEvent).where(
+                models.AnchorEvent.contract == cp.contract, models.AnchorEvent.block_number > target
+            )
+        )
+        cp.block_number = target
+        cp.block_hash = _hex(w3.eth.get_block(target)["hash"])
+        cp.updated_at = datetime.utcnow()
+        session.commit()
+
+    def _events(self, w3, contract, logs: List[Any]) -> List[Dict[str, Any]]:
+        event = contract.events.EvidenceAnchored()
+        timestamps: Dict[int, Optional[datetime]] = {}
+        out: List[Dict[str, Any]] = []
+        for log in logs:
+            try:
+                args = event.process_log(log)["args"]
+            except Exception:
+                continue
+            number = int(log["blockNumber"])
+            if number not in timestamps:
+                ts = w3.eth.get_block(number).get("timestamp")
+                timestamps[number] = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, int) else None
+            out.append(
+                {
+                    "contract": _contract_key(),
+                    "bundle_hash": _hex(args.get("bundleHash", b"")),
+                    "tx_hash": _hex(log["transactionHash"]),
+                    "log_index": int(log["logIndex"]),
+                    "block_number": number,
+                    "block_hash": _hex(log["blockHash"]),
+                    "sender": args.get("sender"),
+                    "anchored_at": timestamps[number],
+                }
+            )
+        return out
+
+    def _store(self, session: Session, cp: models.IndexCheckpoint, events: List[Dict[str, Any]], to_block: int, to_hash: str) -> bool:
+        expected = cp.block_number
+        for ev in events:
+            session.add(models.AnchorEvent(**ev))
+        res = session.execute(
+            update(models.IndexCheckpoint)
+            .where(
+                models.IndexCheckpoint.contract == cp.contract,
+                models.IndexCheckpoint.block_number == expected,
+            )
+            .values(block_number=to_block, block_hash=to_hash, updated_at=datetime.utcnow())
+        )
+        if res.rowcount != 1:
+            session.rollback()  # another indexer advanced the checkpoint first
+            return False
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return False
+        return True
+
+    def sync_once(self) -> int:
+        """Index up to the current head; returns the number of events stored."""
+        from .anchor import _load_contract, log_scanner
+
+        w3, contract = _load_contract()
+        session = db.SessionLocal()
+        stored = 0
+        try:
+            cp = self._checkpoint(session, w3)
+            self._rewind_if_reorged(session, w3, cp)
+            latest = w3.eth.block_number
+            if cp.block_number >= latest:
+                return 0
+            # Oldest-first so the checkpoint can advance after every range
+            ranges = log_scanner(w3, contract).scan_ranges(cp.block_number + 1, latest, newest_first=False)
+            try:
+                for _, hi, logs in ranges:
+                    events = self._events(w3, contract, logs)
+                    hi_hash = _hex(w3.eth.get_block(hi)["hash"])
+                    if not self._store(session, cp, events, hi, hi_hash):
+                        break
+                    stored += len(events)
+                    session.refresh(cp)
+            finally:
+                ranges.close()
+        finally:
+            session.close()
+        return stored
+
+    async def run(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception:
+                logger.exception("anchor index sync failed")
+            await asyncio.to_thread(stop.wait, self.poll_seconds)
+
+    def start_in_thread(self, stop: threading.Event) -> None:
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run(stop)), name="anchor-indexer", daemon=True)
+        self._thread.start()
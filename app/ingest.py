@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import jobs, models, schemas
+
+
+# Upper bound on tips accepted by one batch request
+INGEST_MAX_ITEMS = int(os.getenv("INGEST_MAX_ITEMS", "50000"))
+# Tips per dedupe query / per NDJSON flush (keeps bind parameters under driver limits)
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "500"))
+
+TipKey = Tuple[str, str]  # (chain, tip_tx_hash)
+
+
+class ReferenceConflict(ValueError):
+    """The tip is new but its `reference` is already used by another receipt."""
+
+
+@dataclass
+class IngestItem:
+    index: int
+    receipt_id: Optional[str] = None
+    status: Optional[str] = None
+    created: bool = False
+    error: Optional[str] = None
+
+
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), max(1, size)):
+        yield items[i : i + size]
+
+
+def _dialect_insert(session: Session):
+    """Dialect insert() supporting ON CONFLICT, or None if the database has no such clause."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _insert_ignoring_conflicts(session: Session, rows: List[Dict[str, Any]]) -> List[Any]:
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING id for many rows; returns the ids actually
+    inserted. Executed as executemany, which SQLAlchemy turns into multi-row VALUES batches
+    ("insertmanyvalues") with a cached compiled statement.
+    """
+    table = models.Receipt.__table__
+    dialect_insert = _dialect_insert(session)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).on_conflict_do_nothing().returning(table.c.id)
+        return list(session.connection().execute(stmt, rows).scalars())
+
+    # Other databases: row by row, each in a savepoint
+    inserted = []
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(insert(table).values(**row))
+            inserted.append(row["id"])
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def _existing(session: Session, keys: List[TipKey]) -> Dict[TipKey, Tuple[Any, str]]:
+    found: Dict[TipKey, Tuple[Any, str]] = {}
+    for chunk in _chunks(keys, INGEST_CHUNK_ROWS):
+        rows = session.execute(
+            select(models.Receipt.chain, models.Receipt.tip_tx_hash, models.Receipt.id, models.Receipt.status).where(
+                tuple_(models.Receipt.chain, models.Receipt.tip_tx_hash).in_(chunk)
+            )
+        )
+        for chain, tip, rid, status in rows:
+            found[(chain, tip)] = (rid, status)
+    return found
+
+
+def ingest_tips(session: Session, tips: List[Tuple[int, schemas.TipRecordRequest]]) -> List[IngestItem]:
+    """
+    Stores a batch of validated tips with set-based dedupe on (chain, tip_tx_hash):
+    one lookup for already-known tips, multi-row inserts that skip conflicts, and one
+    bulk job insert, all committed together. Returns one item per input tip.
+    """
+    results: Dict[int, IngestItem] = {}
+    first_by_key: Dict[TipKey, Tuple[int, schemas.TipRecordRequest]] = {}
+    repeats: List[Tuple[int, TipKey]] = []
+    for index, tip in tips:
+        key = (tip.chain.value, tip.tip_tx_hash)
+        if key in first_by_key:
+            repeats.append((index, key))  # same tip twice in one batch: same answer
+        else:
+            first_by_key[key] = (index, tip)
+
+    existing = _existing(session, list(first_by_key))
+    now = datetime.utcnow()
+    rows: List[Dict[str, Any]] = []
+    callbacks: Dict[Any, Optional[str]] = {}
+    new_keys: Dict[Any, TipKey] = {}
+    for key, (index, tip) in first_by_key.items():
+        if key in existing:
+            rid, status = existing[key]
+            results[index] = IngestItem(index=index, receipt_id=str(rid), status=status)
+            continue
+        rid = uuid.uuid4()
+        rows.append(_receipt_row(tip, rid, now))
+        callbacks[rid] = tip.callback_url
+        new_keys[rid] = key
+
+    inserted = _insert_ignoring_conflicts(session, rows) if rows else []
+    inserted_set = {uuid.UUID(str(rid)) for rid in inserted}
+
+    # Durable jobs for everything that was actually inserted, in the same transaction
+    job_rows = [
+        {
+            "id": uuid.uuid4(),
+            "receipt_id": rid,
+            "callback_url": callbacks[rid],
+            "status": "queued",
+            "attempts": 0,
+            "run_after": now,
+            "created_at": now,
+        }
+        for rid in callbacks
+        if rid in inserted_set
+    ]
+    if job_rows:
+        session.connection().execute(insert(models.Job.__table__), job_rows)
+    session.commit()
+
+    # Rows skipped by ON CONFLICT: a concurrent insert of the same tip, or a reused reference
+    skipped = [key for rid, key in new_keys.items() if rid not in inserted_set]
+    raced = _existing(session, skipped) if skipped else {}
+    for rid, key in new_keys.items():
+        index = first_by_key[key][0]
+        if rid in inserted_set:
+            results[index] = IngestItem(index=index, receipt_id=str(rid), status="pending", created=True)
+        elif key in raced:
+            other, status = raced[key]
+            results[index] = IngestItem(index=index, receipt_id=str(other), status=status)
+        else:
+            results[index] = IngestItem(index=index, error="reference already used by another tip")
+
+    for index, key in repeats:
+        first = results[first_by_key[key][0]]
+        results[index] = IngestItem(index=index, receipt_id=first.receipt_id, status=first.status, error=first.error)
+    return [results[i] for i, _ in tips]
+
+
+def _receipt_row(tip: schemas.TipRecordRequest, rid: uuid.UUID, now: datetime) -> Dict[str, Any]:
+    return {
+        "id": rid,
+        "reference": tip.reference,
+        "tip_tx_hash": tip.tip_tx_hash,
+        "chain": tip.chain.value,
+        "amount": tip.amount,
+        "currency": tip.currency,
+        "sender_wallet": tip.sender_wallet,
+        "receiver_wallet": tip.receiver_wallet,
+        "status": "pending",
+        "created_at": now,
+        "anchored_at": None,
+    }
+
+
+def record_tip(session: Session, tip: schemas.TipRecordRequest) -> Tuple[str, str, bool]:
+    """
+    Idempotent single-tip ingest: one INSERT ... ON CONFLICT (chain, tip_tx_hash) DO NOTHING
+    RETURNING id plus its job, committed together. Only a conflict costs a follow-up SELECT.
+    Returns (receipt_id, status, created); raises ReferenceConflict for a reused reference.
+    """
+    table = models.Receipt.__table__
+    rid = uuid.uuid4()
+    row = _receipt_row(tip, rid, datetime.utcnow())
+    dialect_insert = _dialect_insert(session)
+    try:
+        if dialect_insert is not None:
+            stmt = (
+                dialect_insert(table)
+                .values(**row)
+                .on_conflict_do_nothing(index_elements=["chain", "tip_tx_hash"])
+                .returning(table.c.id)
+            )
+            inserted = session.execute(stmt).scalar_one_or_none() is not None
+        else:
+            with session.begin_nested():
+                session.execute(insert(table).values(**row))
+            inserted = True
+        if inserted:
+            # Durable job in the same transaction: XML -> bundle -> sign -> anchor -> update DB
+            jobs.enqueue(session, rid, tip.callback_url)
+            session.commit()
+            return str(rid), "pending", True
+    except IntegrityError:
+        # Unique violation outside the ON CONFLICT target (reference), or no ON CONFLICT support
+        pass
+    session.rollback()
+
+    key = (tip.chain.value, tip.tip_tx_hash)
+    existing = _existing(session, [key]).get(key)
+    if existing is None:
+        raise ReferenceConflict(tip.reference)
+    return str(existing[0]), existing[1], False
+
+
+def parse_item(index: int, raw: Any) -> Tuple[Optional[schemas.TipRecordRequest], Optional[IngestItem]]:
+    """Validates one element of a batch; invalid elements become per-item errors."""
+    try:
+        return schemas.TipRecordRequest.model_validate(raw), None
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+        return None, IngestItem(index=index, error=errors or "invalid item")
+
+
+def iter_ndjson(lines: Iterable[str]) -> Iterator[Any]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None  # reported as an invalid item
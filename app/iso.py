@@ -1,9 +1,19 @@
 from __future__ import annotations
 
+import hashlib
+import itertools
+import logging
+import operator
+import os
+import pickle
+import re
+import sys
+import threading
+import time
 from datetime import datetime, timezone
 from decimal import Decimal
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from lxml import etree
 
@@ -20,32 +30,201 @@ NSMAP = {None: NS_PAIN001}
 # XSD path (must be vendored into the repo under schemas/)
 SCHEMA_PATH = Path("schemas/pain.001.001.09.xsd")
 
+# "template": splice fields into the pre-rendered document (falls back to lxml for unusual values);
+# "lxml": build the tree per document; "check": render both, log and use lxml on any difference
+PAIN001_RENDERER = os.getenv("PAIN001_RENDERER", "template").strip().lower()
+
+# XSD validation of generated documents (when the XSD is present):
+#   "full"    - xmlschema (pure Python, strictest error reports) on every document
+#   "sampled" - full validation for 1 in PAIN001_VALIDATION_SAMPLE documents, and for every
+#               document whose field values have a shape (length, character classes) not seen before
+#   "fast"    - lxml's compiled (libxml2) XMLSchema on every document; "full" if it cannot compile
+PAIN001_VALIDATION = os.getenv("PAIN001_VALIDATION", "fast").strip().lower()
+PAIN001_VALIDATION_SAMPLE = int(os.getenv("PAIN001_VALIDATION_SAMPLE", "100"))
+# Field shapes remembered by the sampled tier (forgotten all at once beyond this)
+PAIN001_VALIDATION_SHAPES = int(os.getenv("PAIN001_VALIDATION_SHAPES", "10000"))
+
+# Compiled xmlschema objects are pickled here, keyed by the sha256 of the XSD files
+# (empty disables the cache); cold starts and new workers then skip compilation
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", ".cache/schemas")
+
 _schema: Optional["xmlschema.XMLSchema"] = None  # type: ignore
+_fast_schema: Optional[etree.XMLSchema] = None
+_fast_unavailable = False
+_schema_source: Optional[str] = None  # "cache" or "compiled"
+# Held while compiling, so startup loading and a first document never compile twice
+_load_lock = threading.RLock()
+# Reported by /v1/health: pending | loading | ready | absent | error
+_status: Dict[str, Any] = {"state": "pending"}
+
+logger = logging.getLogger("iso")
+
+
+def _schema_digest() -> str:
+    """sha256 over every XSD next to SCHEMA_PATH (imports included) and the xmlschema/Python versions."""
+    h = hashlib.sha256()
+    for path in sorted(SCHEMA_PATH.parent.glob("*.xsd")):
+        h.update(path.name.encode("utf-8") + b"\0" + path.read_bytes() + b"\0")
+    h.update(f"{getattr(xmlschema, '__version__', '')}|{sys.version_info[:2]}".encode("ascii"))
+    return h.hexdigest()
+
+
+def _compile_schema() -> Tuple["xmlschema.XMLSchema", str]:  # type: ignore
+    """xmlschema.XMLSchema for SCHEMA_PATH from the on-disk cache, or compiled (and cached)."""
+    if not SCHEMA_CACHE_DIR:
+        return xmlschema.XMLSchema(str(SCHEMA_PATH)), "compiled"
+    cache_file = Path(SCHEMA_CACHE_DIR) / f"{SCHEMA_PATH.stem}-{_schema_digest()}.pickle"
+    try:
+        with cache_file.open("rb") as f:
+            return pickle.load(f), "cache"
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.warning("ignoring unreadable schema cache %s", cache_file, exc_info=True)
+    schema = xmlschema.XMLSchema(str(SCHEMA_PATH))
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(schema, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)  # concurrent workers: last complete file wins
+    except Exception:
+        logger.warning("could not write schema cache %s", cache_file, exc_info=True)
+    return schema, "compiled"
 
 
 def _get_schema() -> Optional["xmlschema.XMLSchema"]:  # type: ignore
-    global _schema
+    global _schema, _schema_source
     if _schema is not None:
         return _schema
-    if xmlschema is None:
+    if xmlschema is None or _status["state"] == "absent":
         return None
-    if SCHEMA_PATH.exists():
-        try:
-            _schema = xmlschema.XMLSchema(str(SCHEMA_PATH))
-            return _schema
-        except Exception:
-            return None
-    return None
+    with _load_lock:
+        if _schema is None and SCHEMA_PATH.exists():
+            try:
+                _schema, _schema_source = _compile_schema()
+            except Exception:
+                logger.warning("cannot load %s with xmlschema", SCHEMA_PATH, exc_info=True)
+    return _schema
+
+
+def _get_fast_schema() -> Optional[etree.XMLSchema]:
+    """The XSD compiled by libxml2, once per process (None if absent or not compilable)."""
+    global _fast_schema, _fast_unavailable
+    if _fast_schema is not None or _fast_unavailable or _status["state"] == "absent":
+        return _fast_schema
+    with _load_lock:
+        if _fast_schema is None and not _fast_unavailable and SCHEMA_PATH.exists():
+            try:
+                _fast_schema = etree.XMLSchema(etree.parse(str(SCHEMA_PATH)))
+            except (etree.XMLSchemaParseError, etree.XMLSyntaxError, OSError):
+                logger.warning("lxml cannot compile %s; validating with xmlschema instead", SCHEMA_PATH, exc_info=True)
+                _fast_unavailable = True
+    return _fast_schema
+
+
+def load_schemas() -> Dict[str, Any]:
+    """
+    Prepares the validators PAIN001_VALIDATION needs, so the first receipt does not pay
+    for compilation. Call at startup and in each worker process; idempotent and thread-safe.
+    Returns schema_status().
+    """
+    with _load_lock:
+        if _status["state"] in ("ready", "absent"):
+            return schema_status()
+        started = time.monotonic()
+        _status.clear()
+        _status["state"] = "loading"
+        if not SCHEMA_PATH.exists():
+            # Validation is skipped; also spares a stat() per document from now on
+            _status["state"] = "absent"
+            return schema_status()
+        if PAIN001_VALIDATION == "fast" and _get_fast_schema() is not None:
+            _status.update(state="ready", validator="lxml")
+        elif _get_schema() is not None:
+            _status.update(state="ready", validator="xmlschema", source=_schema_source)
+        else:
+            _status.update(state="error", error=f"cannot load {SCHEMA_PATH}")
+        _status["seconds"] = round(time.monotonic() - started, 3)
+        logger.info("pain.001 schema: %s", _status)
+        return schema_status()
+
+
+def schema_status() -> Dict[str, Any]:
+    """Validator readiness: `ready` is true once documents can be validated (or no XSD is vendored)."""
+    out = dict(_status)
+    out["ready"] = out["state"] in ("ready", "absent")
+    out["validation"] = PAIN001_VALIDATION
+    return out
+
+
+class _ShapeSampler:
+    """Decides which documents the sampled tier validates: 1 in N, plus any unseen field shape."""
+    def __init__(self, every: int, max_shapes: int) -> None:
+        self.every = max(1, every)
+        self.max_shapes = max(1, max_shapes)
+        self._counter = itertools.count()
+        self._shapes: Set[Tuple[Tuple[int, str], ...]] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shape(fields: Dict[str, str]) -> Tuple[Tuple[int, str], ...]:
+        # Length plus character classes: facets (maxLength, patterns) depend on nothing else
+        return tuple((len(v), "".join(sorted({_char_class(c) for c in v}))) for v in fields.values())
+
+    def should_validate(self, fields: Dict[str, str]) -> bool:
+        shape = self.shape(fields)
+        with self._lock:
+            if shape not in self._shapes:
+                if len(self._shapes) >= self.max_shapes:
+                    self._shapes.clear()
+                self._shapes.add(shape)
+                return True
+        return next(self._counter) % self.every == 0
+
+
+def _char_class(c: str) -> str:
+    if c.isdigit():
+        return "9"
+    if c.isalpha():
+        return "A" if c.isupper() else "a"
+    return c
+
+
+_sampler = _ShapeSampler(PAIN001_VALIDATION_SAMPLE, PAIN001_VALIDATION_SHAPES)
+
+
+def validate_pain001(xml_bytes: bytes, level: str = "full") -> None:
+    """
+    Validates a pain.001 document against the vendored XSD with the "full" (xmlschema)
+    or "fast" (lxml) validator; raises ValueError listing the errors. No-op without an XSD.
+    """
+    if level == "fast":
+        fast = _get_fast_schema()
+        if fast is not None:
+            try:
+                doc = etree.fromstring(xml_bytes)
+            except etree.XMLSyntaxError as e:
+                raise ValueError(f"ISO20022 schema validation failed:\n{e}") from e
+            if not fast.validate(doc):
+                msgs = [f"line {err.line}: {err.message}" for err in fast.error_log]
+                raise ValueError("ISO20022 schema validation failed:\n" + "\n".join(msgs))
+            return
+    schema = _get_schema()
+    if schema is None:
+        return
+    # One pass collects every error (no separate validate() then iter_errors())
+    msgs: List[str] = [str(err) for err in schema.iter_errors(xml_bytes)]
+    if msgs:
+        raise ValueError("ISO20022 schema validation failed:\n" + "\n".join(msgs))
 
 
 def _iso_dt(dt: datetime) -> str:
-    # Ensure UTC Z-format
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    else:
+    # Ensure UTC Z-format (naive datetimes are already UTC)
+    if dt.tzinfo is not None:
         dt = dt.astimezone(timezone.utc)
     # Use ISO 8601 with Z
-    return dt.strftime("%Y-%m-%dT%H:%M:%S%z").replace("+0000", "Z")
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 def _iso_date(dt: datetime) -> str:
@@ -90,6 +269,18 @@ def _agent_not_provided(parent):
     _elm(othr, "Id", "NOTPROVIDED")
 
 
+# Leaf values that vary per document, in the order generate_pain001 computes them
+_FIELDS = ("reference", "cre_dt_tm", "rid", "amount", "exctn_dt", "sender_wallet", "currency", "receiver_wallet")
+_FIELD_RE = re.compile(r"\{\{(" + "|".join(_FIELDS) + r")\}\}")
+# Values lxml rejects or serializes specially (control characters, CR, surrogates): use lxml itself
+_UNUSUAL_RE = re.compile("[\x00-\x1f\ud800-\udfff\ufffe\uffff]")
+# Serializer escapes: text nodes escape & < >, attribute values also "
+_SPECIAL_RE = re.compile('[&<>"]')
+_ATTR_FIELDS = frozenset({"currency"})
+
+_template: Optional[Tuple[str, Callable[[Dict[str, str]], Tuple[str, ...]]]] = None
+
+
 def generate_pain001(receipt: Dict[str, Any]) -> bytes:
     """
     Build a minimal schema-valid pain.001.001.09 for a single credit transfer.
@@ -113,18 +304,53 @@ def generate_pain001(receipt: Dict[str, Any]) -> bytes:
       - Cdtr (+ WALLET id mapping)
       - CdtrAcct (Othr/Id = receiver wallet)
       - RmtInf.Ustrd = receipt['reference']
+
+    The document is byte-identical whichever PAIN001_RENDERER is used (bundle_hash
+    depends on it); the template renderer only skips building the tree.
     """
     created_at: datetime = receipt["created_at"]
-    reference: str = receipt["reference"]
-    rid: str = receipt["id"]
-    sender_wallet: str = receipt["sender_wallet"]
-    receiver_wallet: str = receipt["receiver_wallet"]
-    currency: str = str(receipt["currency"])
     amount = receipt["amount"]
     if isinstance(amount, Decimal):
         amt_str = format(amount, "f")
     else:
         amt_str = str(amount)
+    fields = {
+        "reference": receipt["reference"],
+        "cre_dt_tm": _iso_dt(created_at),
+        "rid": receipt["id"],
+        "amount": amt_str,
+        "exctn_dt": _iso_date(created_at),
+        "sender_wallet": receipt["sender_wallet"],
+        "currency": str(receipt["currency"]),
+        "receiver_wallet": receipt["receiver_wallet"],
+    }
+
+    if PAIN001_RENDERER == "lxml":
+        xml_bytes = _render_lxml(fields)
+    else:
+        xml_bytes = _render_template(fields)
+        if PAIN001_RENDERER == "check" and xml_bytes is not None:
+            expected = _render_lxml(fields)
+            if xml_bytes != expected:
+                logger.error("pain.001 template output differs from lxml for receipt %s; using lxml", fields["rid"])
+                xml_bytes = expected
+        if xml_bytes is None:
+            xml_bytes = _render_lxml(fields)
+
+    # Validate if schema available, per PAIN001_VALIDATION
+    if PAIN001_VALIDATION == "fast":
+        validate_pain001(xml_bytes, "fast")
+    elif PAIN001_VALIDATION != "sampled" or _sampler.should_validate(fields):
+        validate_pain001(xml_bytes, "full")
+
+    return xml_bytes
+
+
+def _render_lxml(fields: Dict[str, str]) -> bytes:
+    """Reference renderer: builds the element tree and pretty-prints it."""
+    reference = fields["reference"]
+    rid = fields["rid"]
+    amt_str = fields["amount"]
 
     root = etree.Element("Document", nsmap=NSMAP)
     cst = _elm(root, "CstmrCdtTrfInitn")
@@ -132,7 +358,7 @@ def generate_pain001(receipt: Dict[str, Any]) -> bytes:
     # Group Header
     grp = _elm(cst, "GrpHdr")
     _elm(grp, "MsgId", reference)
-    _elm(grp, "CreDtTm", _iso_dt(created_at))
+    _elm(grp, "CreDtTm", fields["cre_dt_tm"])
     _elm(grp, "NbOfTxs", "1")
     initg = _elm(grp, "InitgPty")
     _elm(initg, "Nm", "Capella")
@@ -143,14 +369,14 @@ def generate_pain001(receipt: Dict[str, Any]) -> bytes:
     _elm(pmt, "PmtMtd", "TRF")
     _elm(pmt, "NbOfTxs", "1")
     _elm(pmt, "CtrlSum", amt_str)
-    _elm(pmt, "ReqdExctnDt", _iso_date(created_at))
+    _elm(pmt, "ReqdExctnDt", fields["exctn_dt"])
 
     # Debtor
     dbtr = _elm(pmt, "Dbtr")
-    _wallet_party(dbtr, role_nm=None, wallet_addr=sender_wallet, scheme="WALLET")
+    _wallet_party(dbtr, role_nm=None, wallet_addr=fields["sender_wallet"], scheme="WALLET")
 
     dbtr_acct = _elm(pmt, "DbtrAcct")
-    _wallet_acct(dbtr_acct, wallet_addr=sender_wallet, scheme="WALLET_ACCOUNT")
+    _wallet_acct(dbtr_acct, wallet_addr=fields["sender_wallet"], scheme="WALLET_ACCOUNT")
 
     dbtr_agt = _elm(pmt, "DbtrAgt")
     _agent_not_provided(dbtr_agt)
@@ -163,21 +389,21 @@ def generate_pain001(receipt: Dict[str, Any]) -> bytes:
     _elm(pmt_id, "EndToEndId", rid)
 
     amt = _elm(cdt, "Amt")
-    _elm(amt, "InstdAmt", amt_str, attrib={"Ccy": currency})
+    _elm(amt, "InstdAmt", amt_str, attrib={"Ccy": fields["currency"]})
 
     cdtr_agt = _elm(cdt, "CdtrAgt")
     _agent_not_provided(cdtr_agt)
 
     cdtr = _elm(cdt, "Cdtr")
-    _wallet_party(cdtr, role_nm=None, wallet_addr=receiver_wallet, scheme="WALLET")
+    _wallet_party(cdtr, role_nm=None, wallet_addr=fields["receiver_wallet"], scheme="WALLET")
 
     cdtr_acct = _elm(cdt, "CdtrAcct")
-    _wallet_acct(cdtr_acct, wallet_addr=receiver_wallet, scheme="WALLET_ACCOUNT")
+    _wallet_acct(cdtr_acct, wallet_addr=fields["receiver_wallet"], scheme="WALLET_ACCOUNT")
 
     rmt = _elm(cdt, "RmtInf")
     _elm(rmt, "Ustrd", reference)
 
-    xml_bytes = etree.tostring(
+    return etree.tostring(
         root,
         pretty_print=True,
         xml_declaration=True,
@@ -185,19 +411,44 @@ def generate_pain001(receipt: Dict[str, Any]) -> bytes:
         standalone="yes",
     )
 
-    # Validate if schema available
-    schema = _get_schema()
-    if schema is not None:
-        try:
-            # xmlschema can validate bytes directly
-            schema.validate(xml_bytes)
-        except Exception as e:
-            # Re-raise with readable error list if possible
-            if hasattr(schema, "iter_errors"):
-                msgs = []
-                for err in schema.iter_errors(xml_bytes):
-                    msgs.append(str(err))
-                raise ValueError("ISO20022 schema validation failed:\n" + "\n".join(msgs)) from e
-            raise
 
-    return xml_bytes
+def _get_template() -> Tuple[str, Callable[[Dict[str, str]], Tuple[str, ...]]]:
+    """
+    (format, slots): the lxml output for placeholder values turned into a %-format
+    string, and a getter returning the field values in placeholder order. Derived
+    from _render_lxml once, so the two renderers cannot drift apart.
+    """
+    global _template
+    if _template is None:
+        rendered = _render_lxml({name: "{{%s}}" % name for name in _FIELDS}).decode("utf-8")
+        parts = _FIELD_RE.split(rendered)
+        fmt = "%s".join(part.replace("%", "%%") for part in parts[0::2])
+        _template = (fmt, operator.itemgetter(*parts[1::2]))
+    return _template
+
+
+def _render_template(fields: Dict[str, str]) -> Optional[bytes]:
+    """Template renderer; None if a value needs lxml's own handling (non-str, control chars)."""
+    fmt, slots = _get_template()
+    try:
+        joined = "".join(fields.values())
+    except TypeError:
+        return None
+    if _UNUSUAL_RE.search(joined):
+        return None
+    if _SPECIAL_RE.search(joined):
+        fields = {name: _escape(value, name in _ATTR_FIELDS) for name, value in fields.items()}
+    return (fmt % slots(fields)).encode("utf-8")
+
+
+def _escape(value: str, attribute: bool) -> str:
+    # Almost every value is plain: only pay for replace() when there is something to escape
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    if attribute and '"' in value:
+        value = value.replace('"', "&quot;")
+    return value
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import copy
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from xml.etree import ElementTree
+
+from lxml import etree
+
+from . import iso
+
+
+# Errors collected before validation stops (a broken header would otherwise repeat per transaction)
+STREAM_MAX_ERRORS = int(os.getenv("STREAM_MAX_ERRORS", "100"))
+
+# Repeated subtrees validated one at a time and then dropped (local names, outermost first)
+PAIN001_UNITS = ("PmtInf", "CdtTrfTxInf")
+
+# progress(bytes_read, units_validated) -> False to cancel; called once per chunk the parser reads
+ProgressFn = Callable[[int, int], Optional[bool]]
+Source = Union[str, Path, IO[bytes]]
+
+
+@dataclass
+class ValidationIssue:
+    line: Optional[int]
+    path: str  # e.g. /Document/CstmrCdtTrfInitn/PmtInf[3]/CdtTrfTxInf[57]/Amt/InstdAmt
+    message: str
+
+    def __str__(self) -> str:
+        return f"line {self.line} {self.path}: {self.message}"
+
+
+@dataclass
+class StreamValidation:
+    validator: Optional[str] = None  # "lxml" | "xmlschema"; None when no XSD is vendored
+    errors: List[ValidationIssue] = field(default_factory=list)
+    units: int = 0  # PmtInf/CdtTrfTxInf subtrees validated so far (lxml validator only)
+    bytes_read: int = 0
+    cancelled: bool = False
+    truncated: bool = False  # stopped after STREAM_MAX_ERRORS
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors and not self.cancelled
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _ProgressReader:
+    """File wrapper: tracks the bytes consumed and lets the progress callback cancel between reads."""
+    def __init__(self, f: IO[bytes], result: StreamValidation, progress: Optional[ProgressFn]) -> None:
+        self._f = f
+        self._result = result
+        self._progress = progress
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._pos += len(data)
+        # Furthest position, so a rewind (xmlschema reads the head twice) is not counted again
+        self._result.bytes_read = max(self._result.bytes_read, self._pos)
+        if self._progress is not None and self._progress(self._result.bytes_read, self._result.units) is False:
+            raise _Cancelled()
+        return data
+
+    def seekable(self) -> bool:
+        return bool(getattr(self._f, "seekable", lambda: False)())
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._pos = self._f.seek(offset, whence)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def validate_stream(
+    source: Source,
+    progress: Optional[ProgressFn] = None,
+    units: Sequence[str] = PAIN001_UNITS,
+    max_errors: int = STREAM_MAX_ERRORS,
+) -> StreamValidation:
+    """
+    Validates a pain.001 file of any size against the vendored XSD in bounded memory.
+
+    The file is parsed with iterparse. Each repeated subtree (`units`) is validated on
+    its own when it ends, inside a copy of its context (ancestors and their other
+    children, e.g. GrpHdr and the PmtInf header), and then dropped; only the first
+    unit under each parent is kept, so the finished tree is a small valid-shaped
+    sample that is validated once more for the document-level structure.
+    Errors carry the source line and the element path in the original document.
+
+    Uses lxml's compiled schema; when libxml2 cannot compile the XSD, falls back to
+    xmlschema's lazy (subtree-by-subtree) validation.
+    """
+    result = StreamValidation()
+    f: IO[bytes]
+    if isinstance(source, (str, Path)):
+        f = open(source, "rb")
+        owned = True
+    else:
+        f, owned = source, False
+    reader = _ProgressReader(f, result, progress)
+    try:
+        schema = iso._get_fast_schema()
+        if schema is not None:
+            result.validator = "lxml"
+            _validate_lxml(reader, schema, set(units), max(1, max_errors), result)
+        elif iso._get_schema() is not None:
+            result.validator = "xmlschema"
+            _validate_xmlschema(reader, iso._get_schema(), max(1, max_errors), result)
+    except _Cancelled:
+        result.cancelled = True
+    finally:
+        if owned:
+            f.close()
+    return result
+
+
+@lru_cache(maxsize=1024)
+def _local(tag) -> str:
+    # Comments and processing instructions have a non-str tag
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+# Where a node of a validated (copied) tree is in the original document: (path, original element)
+_Anchor = Tuple[str, etree._Element]
+
+
+class _Issues:
+    """Collects schema errors, located in the original document, up to max_errors."""
+    def __init__(self, result: StreamValidation, max_errors: int) -> None:
+        self.result = result
+        self.max_errors = max_errors
+        self._seen: Set[Tuple[Optional[int], str]] = set()
+
+    @property
+    def full(self) -> bool:
+        return len(self.result.errors) >= self.max_errors
+
+    def add(self, line: Optional[int], path: str, message: str) -> None:
+        if self.full:
+            self.result.truncated = True
+            return
+        self.result.errors.append(ValidationIssue(line=line, path=path, message=message))
+
+    def from_log(self, schema: etree.XMLSchema, tree_root: etree._Element, anchors: Dict[etree._Element, _Anchor]) -> None:
+        for entry in schema.error_log:
+            path, line = _locate(tree_root, entry.path, anchors)
+            line = entry.line if line is None else line
+            # Samples and context copies are validated again with later units: report once
+            if (line, entry.message) not in self._seen:
+                self._seen.add((line, entry.message))
+                self.add(line, path, entry.message)
+
+
+def _locate(tree_root: etree._Element, xpath: Optional[str], anchors: Dict[etree._Element, _Anchor]) -> Tuple[str, Optional[int]]:
+    """
+    (path, line) in the original document of the node an error log entry points at.
+    The line is read from the original element: copies keep only 16 bits of it.
+    """
+    node = None
+    if xpath:
+        try:
+            found = tree_root.getroottree().xpath(xpath)
+            node = found[0] if found and isinstance(found[0], etree._Element) else None
+        except etree.XPathError:
+            node = None
+    if node is None:
+        return anchors[tree_root][0], None
+    steps: List[etree._Element] = []
+    while node not in anchors:
+        steps.append(node)
+        node = node.getparent()
+    path, original = anchors[node]
+    for step in reversed(steps):
+        path += _step(step)
+        original = original[step.getparent().index(step)]
+    return path, original.sourceline
+
+
+def _step(node: etree._Element) -> str:
+    # /Name, or /Name[n] for the n-th (n > 1) sibling of that name
+    n = 1 + sum(1 for sib in node.itersiblings(preceding=True) if sib.tag == node.tag)
+    return f"/{_local(node.tag)}" + (f"[{n}]" if n > 1 else "")
+
+
+def _path(stack: List[Tuple[str, int]], units: Set[str]) -> str:
+    # Units always carry their index, so paths of repeated subtrees read the same way
+    return "".join(f"/{name}[{n}]" if n > 1 or name in units else f"/{name}" for name, n in stack)
+
+
+def _validate_lxml(
+    reader: _ProgressReader, schema: etree.XMLSchema, units: Set[str], max_errors: int, result: StreamValidation
+) -> None:
+    issues = _Issues(result, max_errors)
+    # Open elements as (local name, index among same-named siblings), and per open element
+    # the count of children seen per name
+    stack: List[Tuple[str, int]] = []
+    counts: List[Dict[str, int]] = []
+    # Context copy for the current parent of units: (parent, context children, copy root, copy parent, anchors)
+    context: Optional[Tuple[etree._Element, int, etree._Element, etree._Element, Dict[etree._Element, _Anchor]]] = None
+    root: Optional[etree._Element] = None
+    # Units left in the tree as samples (the first under each parent), for the final document-level pass
+    kept: Dict[etree._Element, _Anchor] = {}
+    # A validated unit waiting to be detached: libxml2 still appends its tail text after the end
+    # event, so an element is only removed from the tree at the next end event
+    dropped: Optional[etree._Element] = None
+    try:
+        for event, elem in etree.iterparse(reader, events=("start", "end"), resolve_entities=False, no_network=True):
+            if event == "start":
+                name = _local(elem.tag)
+                if root is None:
+                    root = elem
+                    n = 1
+                else:
+                    seen = counts[-1]
+                    n = seen[name] = seen.get(name, 0) + 1
+                stack.append((name, n))
+                counts.append({})
+                continue
+
+            counts.pop()
+            if dropped is not None:
+                dropped.getparent().remove(dropped)
+                dropped = None
+            name = stack[-1][0]
+            parent = elem.getparent()
+            if parent is None or name not in units:
+                stack.pop()
+                continue
+            path = _path(stack, units)
+            stack.pop()
+            result.units += 1
+            first = not any(sib.tag == elem.tag for sib in elem.itersiblings(preceding=True))
+            if first:
+                kept[elem] = (path, elem)
+            if issues.full:
+                result.truncated = True  # later units are no longer checked
+            else:
+                # Context copy, rebuilt only when the parent (or its non-unit children) changed
+                n_context = sum(1 for child in parent if _local(child.tag) not in units)
+                if context is None or context[0] is not parent or context[1] != n_context:
+                    copy_root, copy_parent, anchors = _context_copy(parent, units, stack)
+                    context = (parent, n_context, copy_root, copy_parent, anchors)
+                _, _, copy_root, copy_parent, anchors = context
+                unit = copy.deepcopy(elem)
+                copy_parent.append(unit)
+                anchors[unit] = (path, elem)
+                if not schema.validate(copy_root):
+                    issues.from_log(schema, copy_root, anchors)
+                copy_parent.remove(unit)
+                del anchors[unit]
+            if not first:
+                for sample in elem.iterdescendants():
+                    kept.pop(sample, None)
+                elem.clear()
+                dropped = elem
+    except etree.XMLSyntaxError as e:
+        issues.add(e.lineno, _path(stack, units) if stack else "/", f"not well-formed: {e.msg}")
+        return
+
+    # Document-level structure, on what is left: everything but the dropped units
+    if root is not None and not issues.full and not schema.validate(root):
+        kept[root] = (f"/{_local(root.tag)}", root)
+        issues.from_log(schema, root, kept)
+
+
+def _context_copy(
+    parent: etree._Element, units: Set[str], stack: List[Tuple[str, int]]
+) -> Tuple[etree._Element, etree._Element, Dict[etree._Element, _Anchor]]:
+    """
+    Copy of the chain root..parent where each ancestor keeps its already-parsed
+    non-unit children (GrpHdr, PmtInf header, ...). Returns (root, parent copy, anchors).
+    """
+    chain = [parent] + list(parent.iterancestors())
+    chain.reverse()
+    anchors: Dict[etree._Element, _Anchor] = {}
+    copy_parent: Optional[etree._Element] = None
+    copy_root: Optional[etree._Element] = None
+    for depth, node in enumerate(chain):
+        if copy_parent is None:
+            clone = etree.Element(node.tag, attrib=dict(node.attrib), nsmap=node.nsmap)
+            copy_root = clone
+        else:
+            clone = etree.SubElement(copy_parent, node.tag, attrib=dict(node.attrib))
+        path = _path(stack[: depth + 1], units)
+        anchors[clone] = (path, node)
+        following = chain[depth + 1] if depth + 1 < len(chain) else None
+        for child in node:
+            if child is following:
+                break
+            if isinstance(child.tag, str) and _local(child.tag) not in units:
+                child_copy = copy.deepcopy(child)
+                clone.append(child_copy)
+                anchors[child_copy] = (path + _step(child), child)
+        copy_parent = clone
+    assert copy_root is not None and copy_parent is not None
+    return copy_root, copy_parent, anchors
+
+
+def _validate_xmlschema(reader: _ProgressReader, schema, max_errors: int, result: StreamValidation) -> None:
+    """Lazy xmlschema validation: subtrees are parsed, checked and pruned one at a time (needs a seekable source)."""
+    import xmlschema  # type: ignore
+
+    issues = _Issues(result, max_errors)
+    try:
+        resource = xmlschema.XMLResource(reader, lazy=True)
+        for err in schema.iter_errors(resource):
+            if issues.full:
+                result.truncated = True
+                break
+            issues.add(getattr(err, "sourceline", None), err.path or "/", err.reason or str(err))
+    except ElementTree.ParseError as e:
+        line = e.position[0] if getattr(e, "position", None) else None
+        issues.add(line, "/", f"not well-formed: {e}")
+    except xmlschema.XMLResourceError as e:
+        issues.add(None, "/", f"unreadable: {e}")
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import os
+import traceback
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, exists, select, update
+from sqlalchemy.orm import Session
+
+from . import db, models
+
+
+# Retry/lease policy for receipt jobs
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def enqueue(session: Session, receipt_id, callback_url: Optional[str] = None) -> models.Job:
+    """
+    Adds a queued job for the receipt. Does not commit: callers commit it in the
+    same transaction as the receipt so a tip is never stored without its job.
+    """
+    job = models.Job(
+        receipt_id=receipt_id,
+        callback_url=callback_url,
+        status="queued",
+        attempts=0,
+        run_after=datetime.utcnow(),
+    )
+    session.add(job)
+    return job
+
+
+def _claim_ids(session: Session, ids: List, worker_id: str) -> List[models.Job]:
+    # Compare-and-swap from queued -> running; rowcount tells us whether we won the race
+    claimed: List[models.Job] = []
+    now = datetime.utcnow()
+    for job_id in ids:
+        res = session.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == "queued")
+            .values(
+                status="running",
+                locked_by=worker_id,
+                locked_at=now,
+                attempts=models.Job.attempts + 1,
+            )
+        )
+        if res.rowcount == 1:
+            claimed.append(job_id)
+    session.commit()
+    if not claimed:
+        return []
+    return list(session.scalars(select(models.Job).where(models.Job.id.in_(claimed))))
+
+
+def claim(session: Session, worker_id: str, limit: int = 1) -> List[models.Job]:
+    """
+    Claims up to `limit` runnable jobs for this worker.
+    Postgres: SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers never block each other.
+    Others (SQLite): pick candidates, then claim each with a conditional UPDATE.
+    """
+    if limit <= 0:
+        return []
+    now = datetime.utcnow()
+    stmt = (
+        select(models.Job.id)
+        .where(models.Job.status == "queued", models.Job.run_after <= now)
+        .order_by(models.Job.run_after)
+        .limit(limit)
+    )
+    if session.get_bind().dialect.name == "postgresql":
+        ids = list(session.scalars(stmt.with_for_update(skip_locked=True)))
+    else:
+        ids = list(session.scalars(stmt))
+        session.rollback()  # release the read snapshot before writing
+    return _claim_ids(session, ids, worker_id)
+
+
+def claim_one(session: Session, job_id, worker_id: str) -> Optional[models.Job]:
+    """Claims a specific job (used when the enqueuing process runs it right away)."""
+    jobs = _claim_ids(session, [job_id], worker_id)
+    return jobs[0] if jobs else None
+
+
+def complete(session: Session, job: models.Job) -> None:
+    job.status = "done"
+    job.locked_by = None
+    job.locked_at = None
+    job.last_error = None
+    session.commit()
+
+
+def fail(session: Session, job: models.Job, error: str) -> None:
+    """Requeue with exponential backoff while attempts remain, else mark failed."""
+    job.last_error = error[-4000:]
+    job.locked_by = None
+    job.locked_at = None
+    if job.attempts < JOB_MAX_ATTEMPTS:
+        delay = JOB_RETRY_BASE_SECONDS * (2 ** max(0, job.attempts - 1))
+        job.status = "queued"
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+    else:
+        job.status = "failed"
+    session.commit()
+
+
+def heartbeat(session: Session, worker_id: str) -> None:
+    """Extends the lease of every job this worker is still running."""
+    session.execute(
+        update(models.Job)
+        .where(models.Job.locked_by == worker_id, models.Job.status == "running")
+        .values(locked_at=datetime.utcnow())
+    )
+    session.commit()
+
+
+def requeue_stale(session: Session, lease_seconds: int = JOB_LEASE_SECONDS) -> int:
+    """Jobs whose worker stopped heartbeating (crash/kill) go back to the queue."""
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    res = session.execute(
+        update(models.Job)
+        .where(models.Job.status == "running", models.Job.locked_at < cutoff)
+        .values(status="queued", locked_by=None, locked_at=None, run_after=datetime.utcnow())
+    )
+    session.commit()
+    return res.rowcount or 0
+
+
+def recover_pending(session: Session) -> int:
+    """
+    Enqueues a job for every pending receipt that has no active job, e.g. receipts
+    recorded before the job table existed or whose job exhausted its retries mid-crash.
+    """
+    has_active_job = exists().where(
+        and_(models.Job.receipt_id == models.Receipt.id, models.Job.status.in_(ACTIVE_STATUSES))
+    )
+    rids = list(
+        session.scalars(select(models.Receipt.id).where(models.Receipt.status == "pending", ~has_active_job))
+    )
+    for rid in rids:
+        enqueue(session, rid)
+    session.commit()
+    return len(rids)
+
+
+def run(job_id, worker_id: str) -> None:
+    """Executes one claimed job: process the receipt, then complete or schedule a retry."""
+    from .processing import process_receipt
+
+    session = db.SessionLocal()
+    try:
+        job = session.get(models.Job, job_id)
+        if job is None:
+            return
+        try:
+            process_receipt(str(job.receipt_id), job.callback_url)
+        except Exception:
+            fail(session, job, traceback.format_exc())
+        else:
+            complete(session, job)
+    finally:
+        session.close()
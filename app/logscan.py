@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterator, List, Optional, Tuple
+
+
+# Starting eth_getLogs block span; adapts to the provider's limit as ranges succeed or fail
+LOGSCAN_INITIAL_CHUNK = int(os.getenv("LOGSCAN_INITIAL_CHUNK", "2000"))
+LOGSCAN_MIN_CHUNK = int(os.getenv("LOGSCAN_MIN_CHUNK", "1"))
+LOGSCAN_MAX_CHUNK = int(os.getenv("LOGSCAN_MAX_CHUNK", "50000"))
+# Concurrent eth_getLogs requests per scan
+LOGSCAN_MAX_IN_FLIGHT = int(os.getenv("LOGSCAN_MAX_IN_FLIGHT", "4"))
+
+# get_logs(from_block, to_block) -> raw logs in that inclusive range
+GetLogsFn = Callable[[int, int], List[Any]]
+
+_RANGE_ERROR_MARKERS = (
+    "range",
+    "too many",
+    "limit",
+    "exceed",
+    "query returned more than",
+    "response size",
+    "timeout",
+    "timed out",
+)
+
+
+def is_range_error(exc: BaseException) -> bool:
+    """Provider refused or choked on the span (block range or result size limit)."""
+    text = str(exc).lower()
+    return any(marker in text for marker in _RANGE_ERROR_MARKERS)
+
+
+def _log_key(log: Any) -> Tuple[int, int]:
+    return int(log["blockNumber"]), int(log["logIndex"])
+
+
+class LogScanner:
+    """
+    Splits a block range into eth_getLogs calls whose span adapts to the provider:
+    a range error halves the span (and splits the failed range), a success doubles it,
+    or, once a span has failed, moves it halfway towards the smallest failing span. Up to `max_in_flight` ranges are
+    fetched concurrently, results are yielded in block order (newest-first by default),
+    and abandoning the iterator cancels whatever has not started yet.
+
+    The learned span is kept on the instance, so reuse one scanner per provider.
+    """
+    def __init__(
+        self,
+        get_logs: GetLogsFn,
+        initial_chunk: int = LOGSCAN_INITIAL_CHUNK,
+        min_chunk: int = LOGSCAN_MIN_CHUNK,
+        max_chunk: int = LOGSCAN_MAX_CHUNK,
+        max_in_flight: int = LOGSCAN_MAX_IN_FLIGHT,
+    ) -> None:
+        self._get_logs = get_logs
+        self.min_chunk = max(1, min_chunk)
+        self.max_chunk = max(self.min_chunk, max_chunk)
+        self.chunk = min(self.max_chunk, max(self.min_chunk, initial_chunk))
+        self.max_in_flight = max(1, max_in_flight)
+        self._ceiling = self.max_chunk
+        self._lock = threading.Lock()
+
+    # ---- span adaptation ----
+    def _shrink(self, failed_span: int) -> None:
+        with self._lock:
+            self._ceiling = max(self.min_chunk, min(self._ceiling, failed_span - 1))
+            self.chunk = max(self.min_chunk, min(self.chunk, failed_span // 2))
+
+    def _grow(self, span: int) -> None:
+        with self._lock:
+            if span < self.chunk:
+                return
+            if self._ceiling < self.max_chunk:
+                # A span has failed before: close in on it instead of doubling into it again
+                self.chunk += (self._ceiling - self.chunk + 1) // 2
+            else:
+                self.chunk = min(self._ceiling, self.chunk * 2)
+
+    def _fetch(self, lo: int, hi: int) -> List[Any]:
+        span = hi - lo + 1
+        try:
+            logs = self._get_logs(lo, hi)
+        except Exception as e:
+            if span <= self.min_chunk or not is_range_error(e):
+                raise
+            self._shrink(span)
+            # Re-split with the learned span (shrinks further if pieces still fail)
+            out: List[Any] = []
+            cursor = lo
+            while cursor <= hi:
+                piece_hi = min(hi, cursor + min(self.chunk, span // 2) - 1)
+                out += self._fetch(cursor, piece_hi)
+                cursor = piece_hi + 1
+            return out
+        self._grow(span)
+        return list(logs)
+
+    # ---- scanning ----
+    def scan_ranges(
+        self, from_block: int, to_block: int, newest_first: bool = True
+    ) -> Iterator[Tuple[int, int, List[Any]]]:
+        """
+        Yields (lo, hi, logs) for consecutive ranges covering [from_block, to_block].
+        Logs within a range are sorted in the same direction as the ranges.
+        """
+        if to_block < from_block:
+            return
+        cursor = to_block if newest_first else from_block
+
+        def next_range() -> Optional[Tuple[int, int]]:
+            nonlocal cursor
+            span = self.chunk
+            if newest_first:
+                if cursor < from_block:
+                    return None
+                lo, hi = max(from_block, cursor - span + 1), cursor
+                cursor = lo - 1
+            else:
+                if cursor > to_block:
+                    return None
+                lo, hi = cursor, min(to_block, cursor + span - 1)
+                cursor = hi + 1
+            return lo, hi
+
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="logscan")
+        pending: Deque[Tuple[int, int, "Future[List[Any]]"]] = deque()
+        try:
+            while True:
+                while len(pending) < self.max_in_flight:
+                    rng = next_range()
+                    if rng is None:
+                        break
+                    pending.append((rng[0], rng[1], pool.submit(self._fetch, rng[0], rng[1])))
+                if not pending:
+                    return
+                lo, hi, fut = pending.popleft()
+                logs = sorted(fut.result(), key=_log_key, reverse=newest_first)
+                yield lo, hi, logs
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def scan(
+        self,
+        from_block: int,
+        to_block: int,
+        decode: Optional[Callable[[Any], Any]] = None,
+        newest_first: bool = True,
+    ) -> Iterator[Any]:
+        """
+        Streams logs (or `decode(log)` results; None and decode errors are skipped).
+        Stop iterating at the first match to skip the remaining ranges.
+        """
+        for _, _, logs in self.scan_ranges(from_block, to_block, newest_first=newest_first):
+            for log in logs:
+                if decode is None:
+                    yield log
+                    continue
+                try:
+                    item = decode(log)
+                except Exception:
+                    continue
+                if item is not None:
+                    yield item
@@ -1,17 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+import codecs
 import os
-from uuid import uuid4
+import threading
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, date
-from typing import Optional
+from typing import Dict, List, Optional
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
 from starlette.staticfiles import StaticFiles
-import requests
-from starlette.responses import StreamingResponse, RedirectResponse
-import anyio
-from .sse import stream_events, hub
+from starlette.responses import StreamingResponse, RedirectResponse, Response
+from .sse import EventFilter, hub, parse_last_event_id, stream_events, stream_many
 
 # These local modules will be added in subsequent steps
 # - app/schemas.py: Pydantic models for requests/responses
@@ -21,12 +24,42 @@ from .sse import stream_events, hub
 # - app/bundle.py: Deterministic ZIP bundle + signing
 # - app/anchor.py: Flare (Coston2) anchoring + log queries
 from . import schemas, db, models, iso, bundle  # type: ignore
+from . import export, ingest, jobs, processing, receipt_cache, static
+from .processing import ARTIFACTS_DIR
+from .worker import Worker
+
+
+# "embedded": this process also runs a job worker (dev default)
+# "external": only enqueue; run `python -m app.worker` separately
+WORKER_MODE = os.getenv("WORKER_MODE", "embedded").strip().lower()
+# Browser/CDN max-age (s) for anchored receipts; other states are always revalidated
+RECEIPT_HTTP_MAX_AGE = int(os.getenv("RECEIPT_HTTP_MAX_AGE", "300"))
+# Receipts one multiplexed SSE stream may list
+SSE_MAX_RIDS = int(os.getenv("SSE_MAX_RIDS", "500"))
+
+_worker: Optional[Worker] = None
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global _worker
+    hub.bind_loop(asyncio.get_running_loop())
+    await hub.start()
+    # Compile (or load the cached) XSD validators off the loop; /v1/health reports readiness
+    threading.Thread(target=iso.load_schemas, name="schema-load", daemon=True).start()
+    if WORKER_MODE == "embedded":
+        _worker = Worker()
+        _worker.start_in_thread()
+    try:
+        yield
+    finally:
+        if _worker is not None:
+            _worker.stop()
+        await hub.stop()
+        await db.async_engine.dispose()
 
 
-ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "artifacts")
-os.makedirs(ARTIFACTS_DIR, exist_ok=True)
-
-app = FastAPI(title="ISO 20022 Payments Middleware", version="0.1.0")
+app = FastAPI(title="ISO 20022 Payments Middleware", version="0.1.0", lifespan=lifespan)
 
 # CORS: Allow Streamlit localhost by default
 streamlit_origin = os.getenv("STREAMLIT_ORIGIN", "http://localhost:8501")
@@ -39,14 +72,15 @@ app.add_middleware(
 
 # Static serving of artifacts
 # Files will live under artifacts/{receipt_id}/...
-app.mount("/files", StaticFiles(directory=ARTIFACTS_DIR), name="files")
+# Retries and batch re-runs rewrite artifacts in place: clients revalidate with the ETag
+app.mount("/files", static.RevalidatedStaticFiles(directory=ARTIFACTS_DIR), name="files")
 # Static UI (HTML/JS) for optional receipt pages/widgets
 app.mount("/ui", StaticFiles(directory="ui"), name="ui")
 app.mount("/embed", StaticFiles(directory="embed"), name="embed")
 
 
 # Database setup
-models.Base.metadata.create_all(bind=db.engine)
+models.create_schema(db.engine)
 
 
 def get_session():
@@ -57,14 +91,64 @@ def get_session():
         session.close()
 
 
+async def get_async_session():
+    async with db.AsyncSessionLocal() as session:
+        yield session
+
+
 @app.get("/v1/health")
 def health() -> dict:
-    return {"status": "ok", "ts": datetime.utcnow().isoformat()}
+    return {"status": "ok", "ts": datetime.utcnow().isoformat(), "schema": iso.schema_status()}
+
+@app.get("/v1/metrics/worker")
+def worker_metrics() -> dict:
+    # Stage throughput / queue depth for the embedded worker (standalone workers: WORKER_METRICS_PORT)
+    if _worker is None:
+        raise HTTPException(status_code=404, detail="No embedded worker in this process")
+    return _worker.metrics()
+
+@app.get("/v1/metrics/db")
+def db_metrics() -> dict:
+    # Connection pool occupancy and checkout wait times (pool exhaustion shows up here first)
+    return {**db.pool_stats(), "receipt_cache": receipt_cache.cache.stats()}
+
+@app.get("/v1/iso/events")
+async def sse_events_many(
+    request: Request,
+    rid: List[str] = Query(default=[]),
+    reference_prefix: Optional[str] = None,
+    receiver_wallet: Optional[str] = None,
+):
+    # One stream for many receipts (?rid=a&rid=b...) and/or every receipt matching a filter
+    if len(rid) > SSE_MAX_RIDS:
+        raise HTTPException(status_code=400, detail=f"at most {SSE_MAX_RIDS} rid values per stream")
+    try:
+        rids = [str(uuid.UUID(r)) for r in rid]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="rid must be a receipt id (UUID)")
+    match = None
+    if reference_prefix or receiver_wallet:
+        match = EventFilter(reference_prefix=reference_prefix, receiver_wallet=receiver_wallet)
+    elif not rids:
+        raise HTTPException(status_code=400, detail="give rid values, reference_prefix or receiver_wallet")
+
+    async def snapshots(stale: List[str]) -> Dict[str, bytes]:
+        return {r: entry.body for r, entry in (await _receipt_entries(stale)).items()}
+
+    last_event_id = parse_last_event_id(request.headers.get("last-event-id"))
+    return StreamingResponse(stream_many(rids, match, last_event_id, snapshots), media_type="text/event-stream")
+
 
 @app.get("/v1/iso/events/{rid}")
-async def sse_events(rid: str):
-    # Server-Sent Events stream for live receipt updates (zero polling)
-    return StreamingResponse(stream_events(rid), media_type="text/event-stream")
+async def sse_events(rid: str, request: Request):
+    # Server-Sent Events stream for live receipt updates (zero polling).
+    # EventSource sends Last-Event-ID when it reconnects: replay what it missed.
+    async def snapshot() -> Optional[bytes]:
+        entry = await _receipt_entry(rid)
+        return entry.body if entry is not None else None
+
+    last_event_id = parse_last_event_id(request.headers.get("last-event-id"))
+    return StreamingResponse(stream_events(rid, last_event_id, snapshot), media_type="text/event-stream")
 
 @app.get("/receipt/{rid}")
 def receipt_redirect(rid: str):
@@ -83,159 +167,151 @@ def embed_receipt_redirect(rid: Optional[str] = None, theme: Optional[str] = Non
 
 
 @app.post("/v1/iso/record-tip", response_model=schemas.RecordTipResponse)
-def record_tip(
+async def record_tip(
     payload: schemas.TipRecordRequest,
-    background_tasks: BackgroundTasks,
-    session=Depends(get_session),
+    session=Depends(get_async_session),
 ):
-    # Idempotency: dedupe by (chain, tip_tx_hash)
-    existing = (
-        session.query(models.Receipt)
-        .filter(
-            models.Receipt.chain == payload.chain,
-            models.Receipt.tip_tx_hash == payload.tip_tx_hash,
-        )
-        .one_or_none()
-    )
-    if existing:
-        return schemas.RecordTipResponse(receipt_id=str(existing.id), status=existing.status)
-
-    rid = uuid4()
-    created_at = datetime.utcnow()
-
-    receipt = models.Receipt(
-        id=rid,
-        reference=payload.reference,
-        tip_tx_hash=payload.tip_tx_hash,
-        chain=payload.chain,
-        amount=payload.amount,
-        currency=payload.currency,
-        sender_wallet=payload.sender_wallet,
-        receiver_wallet=payload.receiver_wallet,
-        status="pending",
-        created_at=created_at,
-        anchored_at=None,
+    # Idempotency: one INSERT ... ON CONFLICT (chain, tip_tx_hash) DO NOTHING RETURNING id
+    try:
+        rid, status, created = await session.run_sync(ingest.record_tip, payload)
+    except ingest.ReferenceConflict:
+        raise HTTPException(status_code=409, detail="reference already used by another tip")
+
+    if created and _worker is not None:
+        _worker.wake()
+
+    return schemas.RecordTipResponse(receipt_id=rid, status=status)
+
+
+@app.post("/v1/iso/record-tips:batch", response_model=schemas.BatchRecordTipResponse)
+async def record_tips_batch(request: Request, session=Depends(get_async_session)):
+    # Bulk ingest: JSON array body, or NDJSON (one tip per line) streamed and stored in chunks
+    items: list = []
+    pending: list = []
+    count = 0
+    truncated = False
+
+    async def flush() -> None:
+        if pending:
+            items.extend(await session.run_sync(ingest.ingest_tips, list(pending)))
+            pending.clear()
+
+    def accept(raw) -> None:
+        nonlocal count
+        tip, error = ingest.parse_item(count, raw)
+        if error is not None:
+            items.append(error)
+        else:
+            pending.append((count, tip))
+        count += 1
+
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        # Earlier chunks are already committed when the limit is hit, so the stream is cut
+        # there and the response says so instead of failing with 413
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        buf = ""
+        async for chunk in request.stream():
+            buf += decoder.decode(chunk)
+            *lines, buf = buf.split("\n")
+            for raw in ingest.iter_ndjson(lines):
+                if count >= ingest.INGEST_MAX_ITEMS:
+                    truncated = True
+                    break
+                accept(raw)
+            if truncated:
+                break
+            if len(pending) >= ingest.INGEST_CHUNK_ROWS:
+                await flush()
+        if not truncated:
+            for raw in ingest.iter_ndjson([buf]):
+                if count >= ingest.INGEST_MAX_ITEMS:
+                    truncated = True
+                    break
+                accept(raw)
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of tips")
+        if len(body) > ingest.INGEST_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {ingest.INGEST_MAX_ITEMS} tips per request")
+        for raw in body:
+            accept(raw)
+    await flush()
+
+    items.sort(key=lambda it: it.index)
+    created = sum(1 for it in items if it.created)
+    failed = sum(1 for it in items if it.error)
+    if created and _worker is not None:
+        _worker.wake()
+    return schemas.BatchRecordTipResponse(
+        created=created,
+        existing=len(items) - created - failed,
+        failed=failed,
+        items=[schemas.BatchRecordTipItem(**vars(it)) for it in items],
+        truncated=truncated,
     )
-    session.add(receipt)
-    session.commit()
-
-    # Background processing: XML -> bundle -> sign -> anchor -> update DB
-    background_tasks.add_task(_process_receipt, str(rid), payload.callback_url)
-
-    return schemas.RecordTipResponse(receipt_id=str(rid), status="pending")
 
 
-def _process_receipt(receipt_id: str, callback_url: Optional[str] = None):
-    # New session in background task
-    session = db.SessionLocal()
-    try:
-        rec: Optional[models.Receipt] = session.get(models.Receipt, receipt_id)
-        if not rec:
-            return
-
-        # Build a dict view for ISO and bundle metadata
-        receipt_dict = {
-            "id": str(rec.id),
-            "reference": rec.reference,
-            "tip_tx_hash": rec.tip_tx_hash,
-            "chain": rec.chain,
-            "amount": rec.amount,
-            "currency": rec.currency,
-            "sender_wallet": rec.sender_wallet,
-            "receiver_wallet": rec.receiver_wallet,
-            "status": rec.status,
-            "created_at": rec.created_at,
-        }
-
-        # 1) Generate ISO XML (validate when XSD is present)
-        xml_bytes = iso.generate_pain001(receipt_dict)
-
-        # 2) Create deterministic bundle and sign
-        zip_path, bundle_hash = bundle.create_bundle(receipt_dict, xml_bytes)
-
-        # 3) Anchor on Flare (Coston2) if available
-        rec.bundle_hash = bundle_hash
-        anchored = False
-        # Try Python web3 first, then Node fallback
-        try:
-            from . import anchor  # type: ignore
-            txid, block_number = anchor.anchor_bundle(bundle_hash)
-            rec.flare_txid = txid
-            rec.status = "anchored"
-            rec.anchored_at = datetime.utcnow()
-            anchored = True
-        except Exception:
-            try:
-                from . import anchor_node  # type: ignore
-                txid, block_number = anchor_node.anchor_bundle(bundle_hash)
-                rec.flare_txid = txid
-                rec.status = "anchored"
-                rec.anchored_at = datetime.utcnow()
-                anchored = True
-            except Exception:
-                # Anchoring unavailable/failed; keep artifacts and mark failed
-                rec.status = "failed"
-
-        # 4) Persist artifact paths
-        rec.xml_path = f"{ARTIFACTS_DIR}/{rec.id}/pain001.xml"
-        rec.bundle_path = f"{ARTIFACTS_DIR}/{rec.id}/evidence.zip"
-        session.commit()
-
-        # 4b) Publish SSE event (best-effort)
+async def _receipt_entry(rid: str) -> Optional[receipt_cache.CachedReceipt]:
+    # Served from memory when possible; status changes published on the hub drop the entry
+    entry = receipt_cache.cache.get(rid)
+    if entry is None:
         try:
-            evt_payload = {
-                "receipt_id": str(rec.id),
-                "status": rec.status,
-                "bundle_hash": rec.bundle_hash,
-                "flare_txid": rec.flare_txid,
-                "xml_url": f"/files/{rec.id}/pain001.xml",
-                "bundle_url": f"/files/{rec.id}/evidence.zip",
-                "created_at": rec.created_at.isoformat() if rec.created_at else None,
-                "anchored_at": rec.anchored_at.isoformat() if rec.anchored_at else None,
-            }
-            anyio.from_thread.run(hub.publish, str(rec.id), evt_payload)  # type: ignore
-        except Exception:
-            pass
-
-        # 5) Optional callback to Capella
-        if callback_url:
-            try:
-                cb_payload = {
-                    "receipt_id": str(rec.id),
-                    "status": rec.status,
-                    "bundle_hash": rec.bundle_hash,
-                    "flare_txid": rec.flare_txid,
-                    "xml_url": f"/files/{rec.id}/pain001.xml",
-                    "bundle_url": f"/files/{rec.id}/evidence.zip",
-                    "created_at": rec.created_at.isoformat() if rec.created_at else None,
-                    "anchored_at": rec.anchored_at.isoformat() if rec.anchored_at else None,
-                }
-                # If PUBLIC_BASE_URL is set, prefix artifact URLs for external consumers
-                base_url = os.getenv("PUBLIC_BASE_URL")
-                if base_url:
-                    cb_payload["xml_url"] = f"{base_url}{cb_payload['xml_url']}"
-                    cb_payload["bundle_url"] = f"{base_url}{cb_payload['bundle_url']}"
-                # Fire-and-forget callback
-                requests.post(callback_url, json=cb_payload, timeout=15)
-            except Exception:
-                # Do not fail background task on callback errors
-                pass
-    except Exception:
-        # Best-effort error handling; upgrade to structured logging in future
-        if rec:
-            rec.status = "failed"
-            session.commit()
-        raise
-    finally:
-        session.close()
+            uuid.UUID(rid)
+        except ValueError:
+            return None  # not a receipt id: nothing to look up
+        async with db.AsyncSessionLocal() as session:
+            rec: Optional[models.Receipt] = await session.get(models.Receipt, rid)
+        if not rec:
+            return None
+        entry = receipt_cache.make_entry(rec.status, _receipt_response(rec).model_dump_json().encode("utf-8"))
+        receipt_cache.cache.put(str(rec.id), entry)
+    return entry
+
+
+async def _receipt_entries(rids: List[str]) -> Dict[str, receipt_cache.CachedReceipt]:
+    # Many receipts (canonical ids): cache hits, then one query for the rest
+    found: Dict[str, receipt_cache.CachedReceipt] = {}
+    missing = []
+    for rid in rids:
+        entry = receipt_cache.cache.get(rid)
+        if entry is None:
+            missing.append(rid)
+        else:
+            found[rid] = entry
+    if missing:
+        async with db.AsyncSessionLocal() as session:
+            recs = (await session.scalars(select(models.Receipt).where(models.Receipt.id.in_(missing)))).all()
+        for rec in recs:
+            entry = receipt_cache.make_entry(rec.status, _receipt_response(rec).model_dump_json().encode("utf-8"))
+            receipt_cache.cache.put(str(rec.id), entry)
+            found[str(rec.id)] = entry
+    return found
 
 
 @app.get("/v1/iso/receipts/{rid}", response_model=schemas.ReceiptResponse)
-def get_receipt(rid: str, session=Depends(get_session)):
-    rec: Optional[models.Receipt] = session.get(models.Receipt, rid)
-    if not rec:
+async def get_receipt(rid: str, request: Request):
+    entry = await _receipt_entry(rid)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Receipt not found")
 
+    # Anchored receipts never change; anything else must be revalidated (cheap: 304 via ETag)
+    if entry.status == "anchored" and RECEIPT_HTTP_MAX_AGE > 0:
+        cache_control = f"public, max-age={RECEIPT_HTTP_MAX_AGE}"
+    else:
+        cache_control = "no-cache"
+    headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+    if static.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def _receipt_response(rec: models.Receipt) -> schemas.ReceiptResponse:
+    rid = str(rec.id)
     xml_url = f"/files/{rid}/pain001.xml"
     bundle_url = f"/files/{rid}/evidence.zip"
 
@@ -243,14 +319,38 @@ def get_receipt(rid: str, session=Depends(get_session)):
         id=str(rec.id),
         status=rec.status,
         bundle_hash=rec.bundle_hash,
+        merkle_root=rec.merkle_root,
         flare_txid=rec.flare_txid,
         xml_url=xml_url,
         bundle_url=bundle_url,
+        proof_url=processing.proof_url(rec),
         created_at=rec.created_at,
         anchored_at=rec.anchored_at,
     )
 
 
+@app.get("/v1/iso/exports/pain001")
+def export_pain001(
+    start: datetime = Query(alias="from"),
+    end: datetime = Query(alias="to"),
+    status: str = "anchored",
+):
+    # One pain.001 for all receipts created in [from, to), one PmtInf per debtor, streamed
+    try:
+        start, end = export.check_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    chunks = export.pain001_batch(db.SessionLocal(), start, end, status)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="No receipts in range")
+    filename = f"{export.batch_msg_id(start, end)}.xml"
+    return StreamingResponse(
+        chunks,
+        media_type="application/xml",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.post("/v1/iso/verify", response_model=schemas.VerifyResponse)
 def verify(req: schemas.VerifyRequest):
     # Delegate to bundle.verify + anchor lookup
@@ -260,18 +360,20 @@ def verify(req: schemas.VerifyRequest):
     txid = None
     anchored_at = None
     errors = list(verification.errors)
+    # Batch-anchored bundles are matched via the Merkle root recomputed from their proof
+    anchored_hash = verification.merkle_root or verification.bundle_hash
 
     # Attempt on-chain match via Python web3, then Node fallback
     try:
         from . import anchor  # type: ignore
-        chain_info = anchor.find_anchor(verification.bundle_hash)
+        chain_info = anchor.find_anchor(anchored_hash)
         matches = chain_info.matches
         txid = chain_info.txid
         anchored_at = chain_info.anchored_at
     except Exception:
         try:
             from . import anchor_node  # type: ignore
-            chain_info = anchor_node.find_anchor(verification.bundle_hash)
+            chain_info = anchor_node.find_anchor(anchored_hash)
             matches = chain_info.matches
             txid = chain_info.txid
             anchored_at = chain_info.anchored_at
@@ -281,6 +383,7 @@ def verify(req: schemas.VerifyRequest):
     return schemas.VerifyResponse(
         matches_onchain=matches,
         bundle_hash=verification.bundle_hash,
+        merkle_root=verification.merkle_root,
         flare_txid=txid,
         anchored_at=anchored_at,
         errors=errors,
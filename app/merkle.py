@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import hashlib
+from typing import List
+
+
+def _hash_pair(a: bytes, b: bytes) -> bytes:
+    # Sorted-pair hashing: proofs do not need left/right position flags
+    if b < a:
+        a, b = b, a
+    return hashlib.sha256(a + b).digest()
+
+
+def build_tree(leaves: List[bytes]) -> List[List[bytes]]:
+    """
+    Build all levels of a sorted-pair sha256 Merkle tree.
+    levels[0] are the leaves, levels[-1] == [root].
+    An odd node at the end of a level is promoted unchanged, so a
+    single-leaf tree has root == leaf (same on-chain value as unbatched anchoring).
+    """
+    if not leaves:
+        raise ValueError("cannot build a Merkle tree without leaves")
+    for leaf in leaves:
+        if len(leaf) != 32:
+            raise ValueError("Merkle leaves must be 32 bytes")
+
+    levels: List[List[bytes]] = [list(leaves)]
+    while len(levels[-1]) > 1:
+        cur = levels[-1]
+        nxt: List[bytes] = []
+        for i in range(0, len(cur) - 1, 2):
+            nxt.append(_hash_pair(cur[i], cur[i + 1]))
+        if len(cur) % 2 == 1:
+            nxt.append(cur[-1])
+        levels.append(nxt)
+    return levels
+
+
+def root_of(levels: List[List[bytes]]) -> bytes:
+    return levels[-1][0]
+
+
+def inclusion_proof(levels: List[List[bytes]], index: int) -> List[bytes]:
+    """Sibling hashes from leaf to root for the leaf at `index`."""
+    if index < 0 or index >= len(levels[0]):
+        raise IndexError("leaf index out of range")
+    proof: List[bytes] = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        # promoted odd node contributes no sibling at this level
+        index //= 2
+    return proof
+
+
+def compute_root(leaf: bytes, proof: List[bytes]) -> bytes:
+    node = leaf
+    for sibling in proof:
+        node = _hash_pair(node, sibling)
+    return node
+
+
+def verify_proof(leaf: bytes, proof: List[bytes], root: bytes) -> bool:
+    return compute_root(leaf, proof) == root
@@ -6,12 +6,17 @@ from decimal import Decimal
 from sqlalchemy import (
     Column,
     String,
+    Text,
+    Integer,
     DateTime,
     Numeric,
     Index,
     UniqueConstraint,
     func,
+    inspect,
+    text,
 )
+from sqlalchemy.engine import Engine
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.types import TypeDecorator, CHAR
 
@@ -67,9 +72,10 @@ class Receipt(Base):
     sender_wallet = Column(String, nullable=False)
     receiver_wallet = Column(String, nullable=False)
 
-    status = Column(String, nullable=False, index=True)  # pending/anchored/failed
+    status = Column(String, nullable=False)  # pending/batched/submitted/anchored/failed (indexed below)
 
     bundle_hash = Column(String, nullable=True)  # 0x-prefixed sha256 of zip
+    merkle_root = Column(String, nullable=True)  # anchored root when batch-anchored
     flare_txid = Column(String, nullable=True)
 
     xml_path = Column(String, nullable=True)
@@ -77,11 +83,193 @@ class Receipt(Base):
 
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     anchored_at = Column(DateTime(timezone=True), nullable=True)
+    # Batch mode: when the receipt was queued for a batch, then when its batch was claimed
+    batched_at = Column(DateTime(timezone=True), nullable=True)
 
     __table_args__ = (
         UniqueConstraint("chain", "tip_tx_hash", name="uq_chain_tip"),
         Index("ix_receipts_status", "status"),
+        Index("ix_receipts_merkle_root", "merkle_root"),
+        Index("ix_receipts_bundle_hash", "bundle_hash"),
     )
 
     def __repr__(self) -> str:  # pragma: no cover
         return f"<Receipt id={self.id} status={self.status} tip={self.tip_tx_hash}>"
+
+
+class Job(Base):
+    """
+    Durable processing job for a receipt (see app/jobs.py).
+    status: queued -> running -> done | failed (queued again while retries remain)
+    """
+    __tablename__ = "jobs"
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4, nullable=False)
+    receipt_id = Column(GUID, nullable=False)
+    callback_url = Column(String, nullable=True)
+
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+        Index("ix_jobs_receipt_id", "receipt_id"),
+    )
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<Job id={self.id} receipt={self.receipt_id} status={self.status} attempts={self.attempts}>"
+
+
+class NonceState(Base):
+    """Next nonce to hand out per sending address (see app/nonce.py)."""
+    __tablename__ = "anchor_nonces"
+
+    address = Column(String, primary_key=True)
+    next_nonce = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class AnchorTx(Base):
+    """
+    One broadcast anchor transaction per (address, nonce).
+    Replacements (fee bumps) overwrite tx_hash and increment `replacements`; every
+    hash ever sent for the nonce is kept in `anchor_tx_hashes`, since any of them may be mined.
+    """
+    __tablename__ = "anchor_txs"
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4, nullable=False)
+    from_address = Column(String, nullable=False)
+    nonce = Column(Integer, nullable=False)
+    tx_hash = Column(String, nullable=False)
+    anchored_hash = Column(String, nullable=True)  # bundle hash or Merkle root; NULL for gap fillers
+
+    max_fee_per_gas = Column(Numeric(38, 0), nullable=True)
+    max_priority_fee_per_gas = Column(Numeric(38, 0), nullable=True)
+    gas_price = Column(Numeric(38, 0), nullable=True)
+
+    status = Column(String, nullable=False, default="pending")  # pending/mined/failed
+    replacements = Column(Integer, nullable=False, default=0)
+
+    sent_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("from_address", "nonce", name="uq_anchor_tx_nonce"),
+        Index("ix_anchor_txs_status", "status"),
+        Index("ix_anchor_txs_tx_hash", "tx_hash"),
+    )
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<AnchorTx nonce={self.nonce} tx={self.tx_hash} status={self.status}>"
+
+
+class AnchorTxHash(Base):
+    """One row per tx hash broadcast for an (address, nonce): the original and each replacement."""
+    __tablename__ = "anchor_tx_hashes"
+
+    tx_hash = Column(String, primary_key=True)
+    from_address = Column(String, nullable=False)
+    nonce = Column(Integer, nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (Index("ix_anchor_tx_hashes_nonce", "from_address", "nonce"),)
+
+
+class AnchorEvent(Base):
+    """
+    Local copy of EvidenceAnchored logs, filled by app/indexer.py.
+    `bundle_hash` is the anchored value (bundle hash or Merkle root), lowercase 0x-hex.
+    """
+    __tablename__ = "anchor_events"
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4, nullable=False)
+    contract = Column(String, nullable=False)  # lowercase address that emitted the log
+    bundle_hash = Column(String, nullable=False)
+    tx_hash = Column(String, nullable=False)
+    log_index = Column(Integer, nullable=False)
+    block_number = Column(Integer, nullable=False)
+    block_hash = Column(String, nullable=False)
+    sender = Column(String, nullable=True)
+    anchored_at = Column(DateTime(timezone=True), nullable=True)  # block timestamp
+
+    __table_args__ = (
+        UniqueConstraint("contract", "tx_hash", "log_index", name="uq_anchor_event_log"),
+        Index("ix_anchor_events_bundle_hash", "contract", "bundle_hash"),
+        Index("ix_anchor_events_block_number", "contract", "block_number"),
+        {"info": {"rebuild_group": "anchor_index"}},
+    )
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<AnchorEvent hash={self.bundle_hash} block={self.block_number} tx={self.tx_hash}>"
+
+
+class IndexCheckpoint(Base):
+    """Last block (number + hash) fully indexed per contract address."""
+    __tablename__ = "anchor_index_checkpoints"
+
+    __table_args__ = ({"info": {"rebuild_group": "anchor_index"}},)
+
+    contract = Column(String, primary_key=True)
+    start_block = Column(Integer, nullable=False)  # first block covered by the index
+    block_number = Column(Integer, nullable=False)
+    block_hash = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+def create_schema(engine: Engine) -> None:
+    """
+    Creates missing tables, then brings tables created by an earlier version up to date:
+    missing nullable columns and missing indexes are added (create_all never alters an
+    existing table). Idempotent and safe to run from several processes at startup.
+
+    Tables tagged with a `rebuild_group` hold data derived from the chain (the event
+    index and its checkpoints): an outdated copy is dropped with its group and filled
+    again by the indexer instead of being migrated.
+    """
+    _rebuild_outdated_groups(engine)
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {c["name"] for c in inspect(engine).get_columns(table.name)}
+        for col in table.columns:
+            if col.name in columns:
+                continue
+            if not col.nullable and col.server_default is None:
+                raise RuntimeError(f"cannot add NOT NULL column {table.name}.{col.name} to an existing table")
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+            except Exception:
+                # Another process added it first
+                if col.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+                    raise
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception:
+                if index.name not in {i["name"] for i in inspect(engine).get_indexes(table.name)}:
+                    raise
+
+
+def _rebuild_outdated_groups(engine: Engine) -> None:
+    groups: dict = {}
+    for table in Base.metadata.sorted_tables:
+        group = table.info.get("rebuild_group")
+        if group:
+            groups.setdefault(group, []).append(table)
+    insp = inspect(engine)
+    existing = set(insp.get_table_names())
+    for tables in groups.values():
+        outdated = any(
+            t.name in existing and {c.name for c in t.columns} - {c["name"] for c in insp.get_columns(t.name)}
+            for t in tables
+        )
+        if outdated:
+            Base.metadata.drop_all(bind=engine, tables=tables, checkfirst=True)
@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import requests
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import db, models, rpc
+
+
+# A pending tx that has been the next-to-mine nonce for this long is re-sent with higher fees
+NONCE_STUCK_SECONDS = int(os.getenv("NONCE_STUCK_SECONDS", "90"))
+# Fee multiplier for replacements (nodes require >= +10%)
+NONCE_FEE_BUMP = float(os.getenv("NONCE_FEE_BUMP", "1.15"))
+NONCE_MAX_REPLACEMENTS = int(os.getenv("NONCE_MAX_REPLACEMENTS", "5"))
+NONCE_SWEEP_SECONDS = float(os.getenv("NONCE_SWEEP_SECONDS", "30"))
+
+FEE_FIELDS = ("maxFeePerGas", "maxPriorityFeePerGas", "gasPrice")
+
+logger = logging.getLogger("nonce")
+
+
+def _err_text(exc: BaseException) -> str:
+    return str(exc).lower()
+
+
+def is_underpriced(exc: BaseException) -> bool:
+    """Same nonce already in the mempool with equal/higher fees."""
+    text = _err_text(exc)
+    return "underpriced" in text or "fee too low" in text
+
+
+def is_nonce_too_low(exc: BaseException) -> bool:
+    text = _err_text(exc)
+    return "nonce too low" in text or "nonce has already been used" in text
+
+
+def is_already_known(exc: BaseException) -> bool:
+    """This exact signed tx is already in the node's pool (an earlier send got through)."""
+    text = _err_text(exc)
+    return "already known" in text or "known transaction" in text
+
+
+def is_ambiguous_send(exc: BaseException) -> bool:
+    """The send failed in transit (timeout, reset, bad response): the node may have the tx."""
+    if isinstance(exc, rpc.AmbiguousSendError):
+        return True
+    if isinstance(exc, requests.RequestException):
+        return not rpc.never_sent(exc)
+    return False
+
+
+class AmbiguousSend(Exception):
+    """
+    A signed tx whose broadcast may or may not have reached a node. Its hash is known
+    locally, so it is recorded as sent and left to the sweeper and confirmation watcher;
+    its nonce must never be handed out again.
+    """
+    def __init__(self, tx_hash: str, fees: Dict[str, int]) -> None:
+        self.tx_hash = tx_hash
+        self.fees = fees
+        super().__init__(f"broadcast of {tx_hash} may have reached the node")
+
+
+class BroadcastUnconfirmed(Exception):
+    """
+    The anchor tx went out (and is tracked by the sweeper) but was not mined while the
+    caller waited. It must be confirmed later, never anchored again under a new nonce.
+    """
+    def __init__(self, tx_hash: str) -> None:
+        self.tx_hash = tx_hash
+        super().__init__(f"{tx_hash} was broadcast but not mined in time")
+
+
+def bump_fees(fees: Dict[str, int], factor: float = NONCE_FEE_BUMP) -> Dict[str, int]:
+    return {k: int(v * factor) + 1 for k, v in fees.items() if k in FEE_FIELDS and v is not None}
+
+
+# resend(nonce, anchored_hash_or_None, fees) -> (tx_hash, fees_used); None hash means "fill the gap".
+# Raises AmbiguousSend when the tx may have been broadcast anyway
+ResendFn = Callable[[int, Optional[str], Dict[str, int]], Tuple[str, Dict[str, int]]]
+
+
+class NonceManager:
+    """
+    Hands out consecutive nonces for one hot wallet without an RPC call per transaction.
+
+    - The next nonce lives in `anchor_nonces` and is advanced under a row lock
+      (SELECT ... FOR UPDATE on Postgres; the process lock + SQLite's single writer otherwise),
+      so several workers/processes sharing the key never collide.
+    - Nonces whose tx provably never reached a node are released and handed out again
+      first; a send that may have arrived (AmbiguousSend) is recorded as sent instead.
+    - A periodic sweep marks mined txs, re-sends stuck ones with bumped fees, and fills
+      a gap that blocks the account's queue.
+    """
+    def __init__(self, address: str, chain_count: Callable[[str], int]) -> None:
+        self.address = address
+        self._chain_count = chain_count  # block_identifier ("latest"/"pending") -> tx count
+        self._lock = threading.Lock()
+        self._released: List[int] = []
+        self._outstanding: Set[int] = set()  # allocated here, not yet broadcast
+        self._synced = False
+        self._suspect_gap: Optional[int] = None
+        self._sweeper: Optional[threading.Thread] = None
+
+    # ---- allocation ----
+    def _locked_state(self, session: Session) -> Optional[models.NonceState]:
+        stmt = select(models.NonceState).where(models.NonceState.address == self.address)
+        if session.get_bind().dialect.name == "postgresql":
+            stmt = stmt.with_for_update()
+        return session.scalars(stmt).one_or_none()
+
+    def _state(self, session: Session) -> models.NonceState:
+        state = self._locked_state(session)
+        if state is None:
+            state = models.NonceState(address=self.address, next_nonce=self._chain_count("pending"))
+            session.add(state)
+            try:
+                session.flush()
+            except IntegrityError:
+                # Another process created it first
+                session.rollback()
+                state = self._locked_state(session)
+            self._synced = True
+        if not self._synced:
+            # First use in this process: never hand out a nonce the chain has already seen
+            state.next_nonce = max(state.next_nonce, self._chain_count("pending"))
+            self._synced = True
+        return state
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._released:
+                nonce = heapq.heappop(self._released)
+            else:
+                session = db.SessionLocal()
+                try:
+                    state = self._state(session)
+                    nonce = state.next_nonce
+                    state.next_nonce = nonce + 1
+                    state.updated_at = datetime.utcnow()
+                    session.commit()
+                finally:
+                    session.close()
+            self._outstanding.add(nonce)
+            return nonce
+
+    def release(self, nonce: int) -> None:
+        """The tx for this nonce was never broadcast; hand the nonce out again."""
+        with self._lock:
+            self._outstanding.discard(nonce)
+            session = db.SessionLocal()
+            try:
+                state = self._state(session)
+                if state.next_nonce == nonce + 1:
+                    state.next_nonce = nonce
+                    state.updated_at = datetime.utcnow()
+                    session.commit()
+                    return
+                session.commit()
+            finally:
+                session.close()
+            if nonce not in self._released:
+                heapq.heappush(self._released, nonce)
+
+    def forget(self, nonce: int) -> None:
+        """
+        The tx for this nonce may or may not have been broadcast and its hash is unknown:
+        never hand the nonce out again; the sweeper fills it if it turns out to be a gap.
+        """
+        with self._lock:
+            self._outstanding.discard(nonce)
+
+    def resync(self) -> None:
+        """Chain is ahead of us (nonce too low): jump to the chain's pending count."""
+        with self._lock:
+            session = db.SessionLocal()
+            try:
+                state = self._state(session)
+                pending = self._chain_count("pending")
+                state.next_nonce = max(state.next_nonce, pending)
+                state.updated_at = datetime.utcnow()
+                session.commit()
+                self._released = [n for n in self._released if n >= pending]
+                heapq.heapify(self._released)
+            finally:
+                session.close()
+
+    # ---- tracking ----
+    def record_sent(self, nonce: int, tx_hash: str, anchored_hash: Optional[str], fees: Dict[str, int]) -> None:
+        with self._lock:
+            self._outstanding.discard(nonce)
+        session = db.SessionLocal()
+        try:
+            row = session.scalars(
+                select(models.AnchorTx).where(
+                    models.AnchorTx.from_address == self.address, models.AnchorTx.nonce == nonce
+                )
+            ).one_or_none()
+            now = datetime.utcnow()
+            if row is None:
+                row = models.AnchorTx(from_address=self.address, nonce=nonce, replacements=0, sent_at=now)
+                session.add(row)
+            elif row.tx_hash and row.tx_hash != tx_hash and row.status == "pending":
+                row.replacements = (row.replacements or 0) + 1
+            row.tx_hash = tx_hash
+            self._keep_hash(session, nonce, tx_hash, now)
+            row.anchored_hash = anchored_hash
+            row.max_fee_per_gas = fees.get("maxFeePerGas")
+            row.max_priority_fee_per_gas = fees.get("maxPriorityFeePerGas")
+            row.gas_price = fees.get("gasPrice")
+            row.status = "pending"
+            row.updated_at = now
+            session.commit()
+        finally:
+            session.close()
+
+    def record_replacement(self, nonce: int, old_hash: str, new_hash: str, fees: Dict[str, int]) -> None:
+        session = db.SessionLocal()
+        try:
+            row = session.scalars(
+                select(models.AnchorTx).where(
+                    models.AnchorTx.from_address == self.address, models.AnchorTx.nonce == nonce
+                )
+            ).one_or_none()
+            if row is None:
+                return
+            row.tx_hash = new_hash
+            self._keep_hash(session, nonce, new_hash, datetime.utcnow())
+            row.replacements = (row.replacements or 0) + 1
+            row.max_fee_per_gas = fees.get("maxFeePerGas")
+            row.max_priority_fee_per_gas = fees.get("maxPriorityFeePerGas")
+            row.gas_price = fees.get("gasPrice")
+            row.updated_at = datetime.utcnow()
+            # Receipts point at the tx that will actually be mined
+            session.execute(
+                update(models.Receipt).where(models.Receipt.flare_txid == old_hash).values(flare_txid=new_hash)
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    def _keep_hash(self, session: Session, nonce: int, tx_hash: str, now: datetime) -> None:
+        if session.get(models.AnchorTxHash, tx_hash) is None:
+            session.add(models.AnchorTxHash(tx_hash=tx_hash, from_address=self.address, nonce=nonce, sent_at=now))
+
+    def tx_hashes(self, nonce: int) -> List[str]:
+        """Every hash sent for this nonce, newest first (any one of them may be the one mined)."""
+        session = db.SessionLocal()
+        try:
+            return list(
+                session.scalars(
+                    select(models.AnchorTxHash.tx_hash)
+                    .where(models.AnchorTxHash.from_address == self.address, models.AnchorTxHash.nonce == nonce)
+                    .order_by(models.AnchorTxHash.sent_at.desc())
+                )
+            )
+        finally:
+            session.close()
+
+    def current_tx_hash(self, nonce: int) -> Optional[str]:
+        session = db.SessionLocal()
+        try:
+            return session.scalars(
+                select(models.AnchorTx.tx_hash).where(
+                    models.AnchorTx.from_address == self.address, models.AnchorTx.nonce == nonce
+                )
+            ).one_or_none()
+        finally:
+            session.close()
+
+    def mark(self, nonce: int, status: str) -> None:
+        session = db.SessionLocal()
+        try:
+            session.execute(
+                update(models.AnchorTx)
+                .where(models.AnchorTx.from_address == self.address, models.AnchorTx.nonce == nonce)
+                .values(status=status, updated_at=datetime.utcnow())
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    @staticmethod
+    def _fees_of(row: models.AnchorTx) -> Dict[str, int]:
+        fees: Dict[str, int] = {}
+        if row.max_fee_per_gas is not None:
+            fees["maxFeePerGas"] = int(row.max_fee_per_gas)
+        if row.max_priority_fee_per_gas is not None:
+            fees["maxPriorityFeePerGas"] = int(row.max_priority_fee_per_gas)
+        if row.gas_price is not None:
+            fees["gasPrice"] = int(row.gas_price)
+        return fees
+
+    # ---- maintenance ----
+    def sweep(self, resend: ResendFn) -> None:
+        """
+        - pending txs below the confirmed count are mined (or were replaced by one that was)
+        - the tx holding the next-to-mine nonce for too long is re-sent with bumped fees
+        - a nonce below our counter with no tx at all (seen on two sweeps) is filled
+        """
+        latest = self._chain_count("latest")
+        pending_count = self._chain_count("pending")
+        session = db.SessionLocal()
+        try:
+            session.execute(
+                update(models.AnchorTx)
+                .where(
+                    models.AnchorTx.from_address == self.address,
+                    models.AnchorTx.status == "pending",
+                    models.AnchorTx.nonce < latest,
+                )
+                .values(status="mined", updated_at=datetime.utcnow())
+            )
+            session.commit()
+
+            head = session.scalars(
+                select(models.AnchorTx).where(
+                    models.AnchorTx.from_address == self.address, models.AnchorTx.nonce == latest
+                )
+            ).one_or_none()
+            state = session.get(models.NonceState, self.address)
+            next_nonce = state.next_nonce if state else latest
+        finally:
+            session.close()
+
+        if head is not None and head.status == "pending":
+            age = datetime.utcnow() - (head.updated_at or head.sent_at).replace(tzinfo=None)
+            if age > timedelta(seconds=NONCE_STUCK_SECONDS) and (head.replacements or 0) < NONCE_MAX_REPLACEMENTS:
+                self._replace(head.nonce, head.tx_hash, head.anchored_hash, self._fees_of(head), resend)
+            self._suspect_gap = None
+            return
+
+        # No tx recorded for the next-to-mine nonce but we have handed out higher ones
+        with self._lock:
+            in_use = latest in self._outstanding or latest in self._released
+        if head is None and latest < next_nonce and pending_count <= latest and not in_use:
+            if self._suspect_gap == latest:
+                logger.warning("nonce gap at %s for %s; filling", latest, self.address)
+                try:
+                    tx_hash, fees = resend(latest, None, {})
+                    self.record_sent(latest, tx_hash, None, fees)
+                except AmbiguousSend as e:
+                    self.record_sent(latest, e.tx_hash, None, e.fees)
+                except Exception:
+                    logger.exception("gap fill for nonce %s failed", latest)
+                self._suspect_gap = None
+            else:
+                self._suspect_gap = latest
+        else:
+            self._suspect_gap = None
+
+    def _replace(self, nonce: int, old_hash: str, anchored_hash: Optional[str], fees: Dict[str, int], resend: ResendFn) -> None:
+        bumped = bump_fees(fees)
+        try:
+            new_hash, used = resend(nonce, anchored_hash, bumped)
+        except AmbiguousSend as e:
+            new_hash, used = e.tx_hash, e.fees
+        except Exception as e:
+            if is_nonce_too_low(e):
+                self.mark(nonce, "mined")  # original got mined meanwhile
+            else:
+                logger.warning("replacement of nonce %s failed: %s", nonce, e)
+            return
+        logger.info("replaced stuck tx nonce=%s %s -> %s", nonce, old_hash, new_hash)
+        self.record_replacement(nonce, old_hash, new_hash, used)
+
+    def start_sweeper(self, resend: ResendFn, interval: float = NONCE_SWEEP_SECONDS) -> None:
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        def _loop() -> None:
+            stop = threading.Event()
+            while not stop.wait(interval):
+                try:
+                    self.sweep(resend)
+                except Exception:
+                    logger.exception("nonce sweep failed")
+
+        self._sweeper = threading.Thread(target=_loop, name="nonce-sweeper", daemon=True)
+        self._sweeper.start()
+
+
+_managers: Dict[str, NonceManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(address: str, chain_count: Callable[[str], int]) -> NonceManager:
+    with _managers_lock:
+        mgr = _managers.get(address)
+        if mgr is None:
+            mgr = NonceManager(address, chain_count)
+            _managers[address] = mgr
+        return mgr
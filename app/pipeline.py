@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+from . import bundle, db, iso, jobs, models, processing
+
+
+PIPELINE_CPU_WORKERS = int(os.getenv("PIPELINE_CPU_WORKERS", str(os.cpu_count() or 2)))
+PIPELINE_ANCHOR_IN_FLIGHT = int(os.getenv("PIPELINE_ANCHOR_IN_FLIGHT", "64"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "256"))
+# "spawn" is safe in a process that already runs threads (the API, the worker loop)
+PIPELINE_MP_START = os.getenv("PIPELINE_MP_START", "spawn")
+
+# Completions counted towards the rolling throughput figure
+_RATE_WINDOW_SECONDS = 60.0
+
+logger = logging.getLogger("pipeline")
+
+
+@dataclass
+class _Item:
+    job_id: Any
+    receipt_id: str
+    callback_url: Optional[str]
+    receipt: Optional[Dict[str, Any]] = None
+    zip_path: Optional[str] = None
+    bundle_hash: Optional[str] = None
+    outcome: Optional[processing.AnchorOutcome] = None
+
+
+class StageMetrics:
+    def __init__(self, name: str, queue: "asyncio.Queue[_Item]") -> None:
+        self.name = name
+        self.queue = queue
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.busy_seconds = 0.0
+        self._done: Deque[float] = deque(maxlen=100_000)
+
+    def record(self, started: float, ok: bool) -> None:
+        now = time.monotonic()
+        self.busy_seconds += now - started
+        if ok:
+            self.processed += 1
+        else:
+            self.failed += 1
+        self._done.append(now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        cutoff = time.monotonic() - _RATE_WINDOW_SECONDS
+        while self._done and self._done[0] < cutoff:
+            self._done.popleft()
+        total = self.processed + self.failed
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "throughput_per_s": round(len(self._done) / _RATE_WINDOW_SECONDS, 3),
+            "avg_seconds": round(self.busy_seconds / total, 4) if total else None,
+        }
+
+
+class ReceiptPipeline:
+    """
+    Staged receipt processing:
+      prepare  - load receipt, build XML + signed bundle in a process pool (CPU-bound)
+      anchor   - up to `anchor_in_flight` concurrent anchor calls (network-bound)
+      finalize - DB update, SSE publish, callback, job completion
+    Stages are connected by bounded queues, so a slow anchor stage backs up into
+    `submit()` and the worker stops claiming jobs instead of buffering without limit.
+    """
+    def __init__(
+        self,
+        cpu_workers: int = PIPELINE_CPU_WORKERS,
+        anchor_in_flight: int = PIPELINE_ANCHOR_IN_FLIGHT,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+    ) -> None:
+        self.cpu_workers = max(1, cpu_workers)
+        self.anchor_in_flight = max(1, anchor_in_flight)
+        self._q_prepare: asyncio.Queue[_Item] = asyncio.Queue(maxsize=max(1, queue_size))
+        self._q_anchor: asyncio.Queue[_Item] = asyncio.Queue(maxsize=max(1, queue_size))
+        self._q_finalize: asyncio.Queue[_Item] = asyncio.Queue(maxsize=max(1, queue_size))
+        self.metrics: Dict[str, StageMetrics] = {
+            "prepare": StageMetrics("prepare", self._q_prepare),
+            "anchor": StageMetrics("anchor", self._q_anchor),
+            "finalize": StageMetrics("finalize", self._q_finalize),
+        }
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._started_at = time.monotonic()
+
+    async def start(self) -> None:
+        # Create dev signing keys once here; concurrent children would race to generate them
+        bundle._ensure_keys()
+        # Each child loads the XSD validators before its first receipt (from the schema cache)
+        self._cpu_pool = ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=multiprocessing.get_context(PIPELINE_MP_START),
+            initializer=iso.load_schemas,
+        )
+        # Anchor calls plus finalize/DB work block on I/O; give them their own threads
+        self._io_pool = ThreadPoolExecutor(max_workers=self.anchor_in_flight + 4, thread_name_prefix="pipeline-io")
+        self._started_at = time.monotonic()
+        stages = [(self._prepare, self.cpu_workers), (self._anchor, self.anchor_in_flight), (self._finalize, 2)]
+        for fn, count in stages:
+            for _ in range(count):
+                self._tasks.append(asyncio.create_task(fn()))
+
+    async def stop(self) -> None:
+        # Unfinished items keep their job lease and are requeued once it expires
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._cpu_pool:
+            self._cpu_pool.shutdown(wait=True, cancel_futures=True)
+        if self._io_pool:
+            self._io_pool.shutdown(wait=True, cancel_futures=True)
+
+    def free_slots(self) -> int:
+        return self._q_prepare.maxsize - self._q_prepare.qsize()
+
+    def in_progress(self) -> int:
+        return sum(q.qsize() for q in (self._q_prepare, self._q_anchor, self._q_finalize)) + sum(
+            m.in_flight for m in self.metrics.values()
+        )
+
+    async def submit(self, job_id, receipt_id: str, callback_url: Optional[str]) -> None:
+        await self._q_prepare.put(_Item(job_id=job_id, receipt_id=receipt_id, callback_url=callback_url))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.monotonic() - self._started_at, 1),
+            "cpu_workers": self.cpu_workers,
+            "anchor_in_flight_limit": self.anchor_in_flight,
+            "stages": {name: m.snapshot() for name, m in self.metrics.items()},
+        }
+
+    async def _io(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io_pool, fn, *args)
+
+    async def _run_stage(self, name: str, queue: "asyncio.Queue[_Item]", work) -> None:
+        m = self.metrics[name]
+        while True:
+            item = await queue.get()
+            m.in_flight += 1
+            started = time.monotonic()
+            ok = False
+            try:
+                await work(item)
+                ok = True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self._fail(item, traceback.format_exc())
+            finally:
+                m.in_flight -= 1
+                m.record(started, ok)
+                queue.task_done()
+
+    async def _prepare(self) -> None:
+        async def work(item: _Item) -> None:
+            item.receipt = await self._io(processing.load_receipt, item.receipt_id)
+            if item.receipt is None:
+                await self._io(self._complete_job, item.job_id)
+                return
+            loop = asyncio.get_running_loop()
+            item.zip_path, item.bundle_hash = await loop.run_in_executor(
+                self._cpu_pool, processing.build_artifacts, item.receipt
+            )
+            await self._q_anchor.put(item)
+
+        await self._run_stage("prepare", self._q_prepare, work)
+
+    async def _anchor(self) -> None:
+        async def work(item: _Item) -> None:
+            item.outcome = await self._io(processing.anchor_artifacts, item.bundle_hash, item.zip_path)
+            await self._q_finalize.put(item)
+
+        await self._run_stage("anchor", self._q_anchor, work)
+
+    async def _finalize(self) -> None:
+        async def work(item: _Item) -> None:
+            await self._io(processing.finalize, item.receipt_id, item.bundle_hash, item.outcome, item.callback_url)
+            await self._io(self._complete_job, item.job_id)
+
+        await self._run_stage("finalize", self._q_finalize, work)
+
+    async def _fail(self, item: _Item, error: str) -> None:
+        logger.warning("receipt %s failed in pipeline", item.receipt_id)
+        try:
+            await self._io(processing.mark_failed, item.receipt_id)
+            await self._io(self._fail_job, item.job_id, error)
+        except Exception:
+            logger.exception("could not record failure for job %s", item.job_id)
+
+    @staticmethod
+    def _complete_job(job_id) -> None:
+        session = db.SessionLocal()
+        try:
+            job = session.get(models.Job, job_id)
+            if job is not None:
+                jobs.complete(session, job)
+        finally:
+            session.close()
+
+    @staticmethod
+    def _fail_job(job_id, error: str) -> None:
+        session = db.SessionLocal()
+        try:
+            job = session.get(models.Job, job_id)
+            if job is not None:
+                jobs.fail(session, job, error)
+        finally:
+            session.close()
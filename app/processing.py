@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from . import db, models, iso, bundle, anchor_batch, confirm, nonce
+from .sse import hub
+
+
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "artifacts")
+os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+
+
+def proof_url(rec: models.Receipt) -> Optional[str]:
+    # Inclusion proofs only exist for batch-anchored receipts
+    if not rec.merkle_root:
+        return None
+    return f"/files/{rec.id}/{anchor_batch.PROOF_FILENAME}"
+
+
+@dataclass
+class AnchorOutcome:
+    status: str  # anchored | submitted | batched | failed
+    txid: Optional[str] = None
+    merkle_root: Optional[str] = None
+    anchored_at: Optional[datetime] = None
+
+
+def load_receipt(receipt_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Dict view of the receipt for ISO and bundle metadata.
+    None if it does not exist or its anchor tx already went out (job re-run after
+    a crash; never anchor twice).
+    """
+    session = db.SessionLocal()
+    try:
+        rec: Optional[models.Receipt] = session.get(models.Receipt, receipt_id)
+        if not rec or rec.status in ("anchored", "submitted", "batched"):
+            return None
+        return {
+            "id": str(rec.id),
+            "reference": rec.reference,
+            "tip_tx_hash": rec.tip_tx_hash,
+            "chain": rec.chain,
+            "amount": rec.amount,
+            "currency": rec.currency,
+            "sender_wallet": rec.sender_wallet,
+            "receiver_wallet": rec.receiver_wallet,
+            "status": rec.status,
+            "created_at": rec.created_at,
+        }
+    finally:
+        session.close()
+
+
+def build_artifacts(receipt: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    CPU-bound stage: ISO XML (validated when the XSD is present), then the
+    deterministic signed bundle. Top-level and DB-free so it can run in a process pool.
+    Returns (zip_path, bundle_hash).
+    """
+    xml_bytes = iso.generate_pain001(receipt)
+    return bundle.create_bundle(receipt, xml_bytes)
+
+
+def anchor_artifacts(bundle_hash: str, zip_path: str) -> AnchorOutcome:
+    """
+    Network-bound stage: anchor on Flare (Coston2) if available. Never raises.
+    In watch mode (ANCHOR_CONFIRM_MODE=watch) the web3 path only broadcasts and
+    returns `submitted`; app.confirm moves the receipt on once the tx is mined.
+    A tx that went out but was not mined while waiting is also `submitted`.
+    In batch mode nothing is sent here: the receipt is `batched` and
+    anchor_batch.BatchFlusher anchors it with the rest of its batch.
+    """
+    if anchor_batch.batch_enabled():
+        return AnchorOutcome("batched")
+
+    # Try Python web3 first, then Node fallback (only when web3 sent nothing)
+    try:
+        from . import anchor  # type: ignore
+        if confirm.watch_enabled():
+            return AnchorOutcome("submitted", anchor.submit_bundle(bundle_hash))
+        txid, block_number = anchor.anchor_bundle(bundle_hash)
+        return AnchorOutcome("anchored", txid, None, datetime.utcnow())
+    except nonce.BroadcastUnconfirmed as e:
+        # Sent but not mined yet: app.confirm finishes it
+        return AnchorOutcome("submitted", e.tx_hash)
+    except Exception:
+        pass
+    try:
+        from . import anchor_node  # type: ignore
+        txid, block_number = anchor_node.anchor_bundle(bundle_hash)
+        return AnchorOutcome("anchored", txid, None, datetime.utcnow())
+    except Exception as e:
+        txid = getattr(e, "txid", None)  # anchor_node.SidecarError: signed and possibly sent
+        if txid:
+            return AnchorOutcome("submitted", txid)
+        # Anchoring unavailable/failed; keep artifacts and mark failed
+        return AnchorOutcome("failed")
+
+
+def finalize(
+    receipt_id: str,
+    bundle_hash: str,
+    outcome: AnchorOutcome,
+    callback_url: Optional[str] = None,
+) -> None:
+    """Persist the outcome and artifact paths, then publish SSE and call back."""
+    session = db.SessionLocal()
+    try:
+        rec: Optional[models.Receipt] = session.get(models.Receipt, receipt_id)
+        if not rec:
+            return
+        rec.bundle_hash = bundle_hash
+        rec.status = outcome.status
+        if outcome.txid:
+            rec.flare_txid = outcome.txid
+        if outcome.merkle_root:
+            rec.merkle_root = outcome.merkle_root
+        if outcome.anchored_at:
+            rec.anchored_at = outcome.anchored_at
+        if outcome.status == "batched":
+            rec.batched_at = datetime.utcnow()
+        rec.xml_path = f"{ARTIFACTS_DIR}/{rec.id}/pain001.xml"
+        rec.bundle_path = f"{ARTIFACTS_DIR}/{rec.id}/evidence.zip"
+        session.commit()
+        if outcome.status == "batched":
+            anchor_batch.wake()
+        notify(rec, callback_url)
+    finally:
+        session.close()
+
+
+def mark_failed(receipt_id: str) -> None:
+    session = db.SessionLocal()
+    try:
+        rec: Optional[models.Receipt] = session.get(models.Receipt, receipt_id)
+        if rec and rec.status not in ("anchored", "submitted", "batched"):
+            rec.status = "failed"
+            session.commit()
+    finally:
+        session.close()
+
+
+def notify(rec: models.Receipt, callback_url: Optional[str] = None) -> None:
+    # Publish SSE event (best-effort)
+    try:
+        evt_payload = {
+            "receipt_id": str(rec.id),
+            "reference": rec.reference,
+            "receiver_wallet": rec.receiver_wallet,
+            "status": rec.status,
+            "bundle_hash": rec.bundle_hash,
+            "merkle_root": rec.merkle_root,
+            "flare_txid": rec.flare_txid,
+            "xml_url": f"/files/{rec.id}/pain001.xml",
+            "bundle_url": f"/files/{rec.id}/evidence.zip",
+            "proof_url": proof_url(rec),
+            "created_at": rec.created_at.isoformat() if rec.created_at else None,
+            "anchored_at": rec.anchored_at.isoformat() if rec.anchored_at else None,
+        }
+        hub.publish_threadsafe(str(rec.id), evt_payload)
+    except Exception:
+        pass
+
+    # Optional callback to Capella
+    if callback_url:
+        try:
+            cb_payload = {
+                "receipt_id": str(rec.id),
+                "status": rec.status,
+                "bundle_hash": rec.bundle_hash,
+                "merkle_root": rec.merkle_root,
+                "flare_txid": rec.flare_txid,
+                "xml_url": f"/files/{rec.id}/pain001.xml",
+                "bundle_url": f"/files/{rec.id}/evidence.zip",
+                "proof_url": proof_url(rec),
+                "created_at": rec.created_at.isoformat() if rec.created_at else None,
+                "anchored_at": rec.anchored_at.isoformat() if rec.anchored_at else None,
+            }
+            # If PUBLIC_BASE_URL is set, prefix artifact URLs for external consumers
+            base_url = os.getenv("PUBLIC_BASE_URL")
+            if base_url:
+                cb_payload["xml_url"] = f"{base_url}{cb_payload['xml_url']}"
+                cb_payload["bundle_url"] = f"{base_url}{cb_payload['bundle_url']}"
+                if cb_payload["proof_url"]:
+                    cb_payload["proof_url"] = f"{base_url}{cb_payload['proof_url']}"
+            # Fire-and-forget callback
+            requests.post(callback_url, json=cb_payload, timeout=15)
+        except Exception:
+            # Do not fail the job on callback errors
+            pass
+
+
+def process_receipt(receipt_id: str, callback_url: Optional[str] = None):
+    """
+    XML -> bundle -> sign -> anchor -> update DB -> SSE/callback for one receipt,
+    run sequentially in the calling thread (see app.pipeline for the staged variant).
+    Safe to re-run after a crash.
+    """
+    receipt = load_receipt(receipt_id)
+    if receipt is None:
+        return
+    try:
+        zip_path, bundle_hash = build_artifacts(receipt)
+        outcome = anchor_artifacts(bundle_hash, zip_path)
+        finalize(receipt_id, bundle_hash, outcome, callback_url)
+    except Exception:
+        # Best-effort error handling; upgrade to structured logging in future
+        mark_failed(receipt_id)
+        raise
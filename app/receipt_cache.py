@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from .sse import hub
+
+
+# Max cached receipts (least recently used are evicted first)
+RECEIPT_CACHE_SIZE = int(os.getenv("RECEIPT_CACHE_SIZE", "10000"))
+# Anchored receipts no longer change (failed ones may be retried, so they use the short TTL)
+RECEIPT_CACHE_TERMINAL_TTL_SECONDS = float(os.getenv("RECEIPT_CACHE_TERMINAL_TTL_SECONDS", "3600"))
+# In-flight receipts: bounds staleness when the update comes from another process
+RECEIPT_CACHE_TTL_SECONDS = float(os.getenv("RECEIPT_CACHE_TTL_SECONDS", "2"))
+
+TERMINAL_STATUSES = frozenset({"anchored"})
+
+
+class CachedReceipt(NamedTuple):
+    body: bytes  # serialized ReceiptResponse
+    etag: str
+    status: str
+
+
+def make_entry(status: str, body: bytes) -> CachedReceipt:
+    # Digest of the body: changes with status, bundle_hash, txid (replacements) and anchored_at
+    return CachedReceipt(body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest(), status)
+
+
+class ReceiptCache:
+    """
+    Bounded LRU of serialized ReceiptResponse bodies (with their ETag) keyed by receipt id. Entries
+    expire after a TTL that depends on the status, and are dropped as soon as a status
+    change for the receipt is published on the SSE hub.
+    """
+    def __init__(
+        self,
+        max_entries: int = RECEIPT_CACHE_SIZE,
+        ttl: float = RECEIPT_CACHE_TTL_SECONDS,
+        terminal_ttl: float = RECEIPT_CACHE_TERMINAL_TTL_SECONDS,
+    ) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[float, CachedReceipt]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rid: str) -> Optional[CachedReceipt]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(rid)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[rid]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(rid)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, rid: str, entry: CachedReceipt) -> None:
+        ttl = self.terminal_ttl if entry.status in TERMINAL_STATUSES else self.ttl
+        if self.max_entries == 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[rid] = (time.monotonic() + ttl, entry)
+            self._entries.move_to_end(rid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, rid: str) -> None:
+        with self._lock:
+            self._entries.pop(rid, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+cache = ReceiptCache()
+
+# Every status change goes through hub.publish (processing.notify)
+hub.add_publish_hook(lambda rid, _payload: cache.invalidate(rid))
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+# Comma-separated RPC endpoints; requests go to the one with the lowest observed latency
+FLARE_RPC_URLS = [
+    u.strip()
+    for u in (os.getenv("FLARE_RPC_URLS") or os.getenv("FLARE_RPC_URL", "https://coston2-api.flare.network/ext/C/rpc")).split(",")
+    if u.strip()
+]
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+RPC_TIMEOUT_SECONDS = float(os.getenv("RPC_TIMEOUT_SECONDS", "30"))
+# An endpoint that failed at the transport level is skipped for this long
+RPC_COOLDOWN_SECONDS = float(os.getenv("RPC_COOLDOWN_SECONDS", "30"))
+
+# Weight of the newest sample in the per-endpoint latency average
+_EWMA_ALPHA = 0.3
+
+# Methods that must reach at most one endpoint: re-posting may broadcast the same tx twice
+# (or, with a replaced nonce, anchor twice)
+_WRITE_METHODS = frozenset({"eth_sendRawTransaction", "eth_sendTransaction"})
+
+logger = logging.getLogger("rpc")
+
+
+class RpcError(RuntimeError):
+    """JSON-RPC error object returned by the node (not a transport failure)."""
+    def __init__(self, error: Dict[str, Any]) -> None:
+        self.code = error.get("code")
+        self.data = error.get("data")
+        super().__init__(error.get("message") or str(error))
+
+
+class AmbiguousSendError(RuntimeError):
+    """A write request failed after it may have been delivered; it was not re-posted elsewhere."""
+    def __init__(self, method: str, url: str, cause: BaseException) -> None:
+        self.method = method
+        self.url = url
+        super().__init__(f"{method} to {url} may have been delivered: {cause}")
+
+
+def _write_method(payload: Any) -> Optional[str]:
+    items = payload if isinstance(payload, list) else [payload]
+    for item in items:
+        if isinstance(item, dict) and item.get("method") in _WRITE_METHODS:
+            return item["method"]
+    return None
+
+
+def never_sent(exc: BaseException) -> bool:
+    """
+    True when a transport error provably happened before the request left this process
+    (connect timeout, connection refused / DNS failure). Any other failure (read timeout,
+    reset, bad response) may come after the node received the request.
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.ConnectionError) and exc.args:
+        cause = exc.args[0]
+        return isinstance(cause, NewConnectionError) or isinstance(getattr(cause, "reason", None), NewConnectionError)
+    return False
+
+
+class _Endpoint:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.latency: Optional[float] = None  # EWMA seconds; None until first success
+        self.down_until = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.latency = seconds if self.latency is None else (1 - _EWMA_ALPHA) * self.latency + _EWMA_ALPHA * seconds
+
+
+class RpcClient:
+    """
+    JSON-RPC over one pooled keep-alive session.
+
+    - `batch()` sends independent calls in a single HTTP request (one call per
+      request if the provider does not accept batches).
+    - With several endpoints, each request goes to the one with the lowest average
+      latency; untried endpoints are tried first, and a transport failure moves the
+      request to the next endpoint and puts the failed one on a short cooldown.
+      A tx broadcast only moves on when the failure provably came before the request
+      left the process; otherwise AmbiguousSendError is raised.
+    - Values that never change for a chain (chain id) are cached.
+    """
+    def __init__(
+        self,
+        urls: Sequence[str] = tuple(FLARE_RPC_URLS),
+        pool_size: int = RPC_POOL_SIZE,
+        timeout: float = RPC_TIMEOUT_SECONDS,
+    ) -> None:
+        if not urls:
+            raise ValueError("at least one RPC endpoint is required")
+        self.endpoints = [_Endpoint(u) for u in urls]
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._chain_id: Optional[int] = None
+
+    # ---- endpoint selection ----
+    def _ranked(self) -> List[_Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            up = [e for e in self.endpoints if e.down_until <= now]
+            down = [e for e in self.endpoints if e.down_until > now]
+        up.sort(key=lambda e: -1.0 if e.latency is None else e.latency)
+        return up + down  # endpoints on cooldown are the last resort
+
+    def _post(self, payload: Any) -> Tuple[_Endpoint, Any]:
+        write = _write_method(payload)
+        last_err: Optional[Exception] = None
+        for ep in self._ranked():
+            started = time.monotonic()
+            try:
+                resp = self.session.post(ep.url, json=payload, timeout=self.timeout)
+                resp.raise_for_status()
+                data = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                last_err = e
+                with self._lock:
+                    ep.down_until = time.monotonic() + RPC_COOLDOWN_SECONDS
+                logger.warning("rpc endpoint %s failed: %s", ep.url, e)
+                if write and not never_sent(e):
+                    raise AmbiguousSendError(write, ep.url, e) from e
+                continue
+            with self._lock:
+                ep.observe(time.monotonic() - started)
+            return ep, data
+        raise last_err or RuntimeError("no RPC endpoint available")
+
+    def latencies(self) -> Dict[str, Optional[float]]:
+        return {e.url: e.latency for e in self.endpoints}
+
+    # ---- calls ----
+    def _payload(self, method: str, params: Sequence[Any]) -> Dict[str, Any]:
+        return {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": list(params)}
+
+    def request(self, method: str, params: Sequence[Any] = ()) -> Dict[str, Any]:
+        """Raw JSON-RPC response object ({"result": ...} or {"error": ...})."""
+        _, data = self._post(self._payload(method, params))
+        return data
+
+    def call(self, method: str, params: Sequence[Any] = ()) -> Any:
+        data = self.request(method, params)
+        if data.get("error"):
+            raise RpcError(data["error"])
+        return data.get("result")
+
+    def batch(self, calls: Sequence[Tuple[str, Sequence[Any]]]) -> List[Any]:
+        """
+        Runs independent calls in one HTTP round trip. Returns results in call order;
+        a call that failed is returned as its RpcError instance instead of raising.
+        """
+        if not calls:
+            return []
+        payload = [self._payload(m, p) for m, p in calls]
+        _, data = self._post(payload)
+        if not isinstance(data, list):
+            # Provider rejected the batch: one request per call
+            data = [self._post(item)[1] for item in payload]
+        by_id = {entry.get("id"): entry for entry in data if isinstance(entry, dict)}
+        out: List[Any] = []
+        for item in payload:
+            entry = by_id.get(item["id"])
+            if entry is None:
+                out.append(RpcError({"message": f"no response for {item['method']}"}))
+            elif entry.get("error"):
+                out.append(RpcError(entry["error"]))
+            else:
+                out.append(entry.get("result"))
+        return out
+
+    def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = int(self.call("eth_chainId"), 16)
+        return self._chain_id
+
+
+_client: Optional[RpcClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> RpcClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RpcClient()
+        return _client
+
+
+def web3_provider():
+    """web3.py provider that sends through the shared pooled client."""
+    from web3.providers.base import JSONBaseProvider  # type: ignore
+
+    client = get_client()
+
+    class _PooledProvider(JSONBaseProvider):
+        def make_request(self, method, params):
+            if method == "eth_chainId":
+                return {"jsonrpc": "2.0", "id": 0, "result": hex(client.chain_id())}
+            return client.request(method, params)
+
+        def is_connected(self, show_traceback: bool = False) -> bool:
+            try:
+                client.chain_id()
+                return True
+            except Exception:
+                if show_traceback:
+                    raise
+                return False
+
+    return _PooledProvider()
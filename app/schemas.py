@@ -16,6 +16,8 @@ class Chain(str, Enum):
 
 class Status(str, Enum):
     pending = "pending"
+    batched = "batched"  # waiting for its batch's Merkle root to be anchored
+    submitted = "submitted"  # anchor tx broadcast, awaiting confirmation
     anchored = "anchored"
     failed = "failed"
 
@@ -38,13 +40,32 @@ class RecordTipResponse(BaseModel):
     status: Status
 
 
+class BatchRecordTipItem(BaseModel):
+    index: int
+    receipt_id: Optional[str] = None
+    status: Optional[Status] = None
+    created: bool = False
+    error: Optional[str] = None
+
+
+class BatchRecordTipResponse(BaseModel):
+    created: int
+    existing: int
+    failed: int
+    items: List[BatchRecordTipItem]
+    # NDJSON only: lines past INGEST_MAX_ITEMS were not read (resend them from index len(items))
+    truncated: bool = False
+
+
 class ReceiptResponse(BaseModel):
     id: str
     status: Status
     bundle_hash: Optional[str] = None
+    merkle_root: Optional[str] = None
     flare_txid: Optional[str] = None
     xml_url: Optional[str] = None
     bundle_url: Optional[str] = None
+    proof_url: Optional[str] = None
     created_at: datetime
     anchored_at: Optional[datetime] = None
 
@@ -56,6 +77,7 @@ class VerifyRequest(BaseModel):
 class VerifyResponse(BaseModel):
     matches_onchain: bool
     bundle_hash: Optional[str] = None
+    merkle_root: Optional[str] = None
     flare_txid: Optional[str] = None
     anchored_at: Optional[datetime] = None
     errors: List[str] = []
@@ -66,6 +88,7 @@ class VerifyResponse(BaseModel):
 class VerificationResult:
     bundle_hash: str
     errors: list[str]
+    merkle_root: Optional[str] = None  # set when an inclusion proof accompanies the bundle
 
 
 @dataclass
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == bare:
+            return True
+    return False
+
+
+class RevalidatedStaticFiles(StaticFiles):
+    """
+    StaticFiles for artifacts (pain001.xml, evidence.zip, proofs). Paths are keyed by
+    receipt id and a retry or batch re-run rewrites the files in place, so caches must
+    revalidate on every use: Cache-Control is no-cache, and the ETag / Last-Modified and
+    304 handling from StaticFiles keep an unchanged file to a bodiless round trip.
+    """
+    cache_control = "no-cache"
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = self.cache_control
+        return response
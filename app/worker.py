@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import anchor_batch, confirm, db, indexer, iso, jobs, models
+from .pipeline import ReceiptPipeline
+
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "1.0"))
+# Run jobs through the staged pipeline (app/pipeline.py) instead of one thread per job
+WORKER_PIPELINE = os.getenv("WORKER_PIPELINE", "0") in {"1", "true", "TRUE", "yes", "on"}
+# Standalone worker: serve metrics JSON on this port (0 disables)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+# Seconds between lease heartbeats / stale-job sweeps
+WORKER_MAINTENANCE_SECONDS = float(os.getenv("WORKER_MAINTENANCE_SECONDS", str(max(1, jobs.JOB_LEASE_SECONDS // 3))))
+
+logger = logging.getLogger("worker")
+
+
+class Worker:
+    """
+    Claims receipt jobs from the DB and runs them on a bounded thread pool.
+    Runs standalone (`python -m app.worker`) or embedded in the API process.
+    """
+    def __init__(
+        self,
+        concurrency: int = WORKER_CONCURRENCY,
+        poll_seconds: float = WORKER_POLL_SECONDS,
+        use_pipeline: bool = WORKER_PIPELINE,
+    ) -> None:
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+        self._running: Dict[object, Future] = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.use_pipeline = use_pipeline
+        self._pipeline: Optional[ReceiptPipeline] = None
+
+    def wake(self) -> None:
+        """Skip the poll delay (called after enqueueing in the same process)."""
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def recover(self) -> None:
+        session = db.SessionLocal()
+        try:
+            stale = jobs.requeue_stale(session)
+            orphaned = jobs.recover_pending(session)
+            if stale or orphaned:
+                logger.info("recovered %s stale jobs, enqueued %s pending receipts", stale, orphaned)
+        finally:
+            session.close()
+
+    def _maintenance(self) -> None:
+        session = db.SessionLocal()
+        try:
+            jobs.heartbeat(session, self.worker_id)
+            jobs.requeue_stale(session)
+        finally:
+            session.close()
+
+    def _claim_rows(self, limit: int) -> List[Tuple[object, str, Optional[str]]]:
+        session = db.SessionLocal()
+        try:
+            claimed = jobs.claim(session, self.worker_id, limit=limit)
+            return [(j.id, str(j.receipt_id), j.callback_url) for j in claimed]
+        finally:
+            session.close()
+
+    def _claim(self) -> int:
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        job_ids = [row[0] for row in self._claim_rows(free)]
+        for job_id in job_ids:
+            fut = self._pool.submit(jobs.run, job_id, self.worker_id)
+            fut.add_done_callback(lambda _f: self._wake.set())  # a slot freed up
+            self._running[job_id] = fut
+        return len(job_ids)
+
+    def metrics(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "worker_id": self.worker_id,
+            "mode": "pipeline" if self.use_pipeline else "threads",
+        }
+        if self._pipeline is not None:
+            out["pipeline"] = self._pipeline.snapshot()
+        else:
+            out["concurrency"] = self.concurrency
+            out["running"] = len(self._running)
+        return out
+
+    def run_forever(self) -> None:
+        # Validators ready before the first job (and the on-disk cache warm for pool children)
+        iso.load_schemas()
+        if anchor_batch.batch_enabled():
+            # Jobs only queue their bundle hash; this process also anchors due batches
+            anchor_batch.BatchFlusher().start_in_thread(self._stop)
+        # Confirms `submitted` receipts: every tx in watch/batch mode, and in wait mode
+        # the ones that were broadcast but not mined while the job waited
+        confirm.ConfirmationWatcher().start_in_thread(self._stop)
+        if indexer.enabled():
+            indexer.AnchorIndexer().start_in_thread(self._stop)
+        if self.use_pipeline:
+            asyncio.run(self._run_pipeline())
+            return
+        logger.info("worker %s started (concurrency=%s)", self.worker_id, self.concurrency)
+        self.recover()
+        last_maintenance = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.clear()
+            for job_id, fut in list(self._running.items()):
+                if fut.done():
+                    del self._running[job_id]
+            try:
+                claimed = self._claim()
+                if time.monotonic() - last_maintenance >= WORKER_MAINTENANCE_SECONDS:
+                    self._maintenance()
+                    last_maintenance = time.monotonic()
+            except Exception:
+                logger.exception("worker loop error")
+                claimed = 0
+            if claimed == 0 or len(self._running) >= self.concurrency:
+                self._wake.wait(timeout=self.poll_seconds)
+        # Let in-flight jobs finish; anything cut short is requeued by lease expiry
+        self._pool.shutdown(wait=True)
+        logger.info("worker %s stopped", self.worker_id)
+
+    async def _run_pipeline(self) -> None:
+        pipeline = ReceiptPipeline()
+        await pipeline.start()
+        self._pipeline = pipeline
+        logger.info(
+            "worker %s started (pipeline: cpu_workers=%s, anchor_in_flight=%s)",
+            self.worker_id, pipeline.cpu_workers, pipeline.anchor_in_flight,
+        )
+        try:
+            await asyncio.to_thread(self.recover)
+            last_maintenance = time.monotonic()
+            while not self._stop.is_set():
+                self._wake.clear()
+                claimed: List[Tuple[object, str, Optional[str]]] = []
+                try:
+                    free = pipeline.free_slots()
+                    if free > 0:
+                        claimed = await asyncio.to_thread(self._claim_rows, free)
+                    if time.monotonic() - last_maintenance >= WORKER_MAINTENANCE_SECONDS:
+                        await asyncio.to_thread(self._maintenance)
+                        last_maintenance = time.monotonic()
+                except Exception:
+                    logger.exception("worker loop error")
+                for job_id, receipt_id, callback_url in claimed:
+                    # Blocks while the prepare queue is full (backpressure)
+                    await pipeline.submit(job_id, receipt_id, callback_url)
+                if not claimed:
+                    await asyncio.to_thread(self._wake.wait, self.poll_seconds)
+        finally:
+            await pipeline.stop()
+            logger.info("worker %s stopped", self.worker_id)
+
+    def start_in_thread(self) -> None:
+        self._thread = threading.Thread(target=self.run_forever, name="job-worker", daemon=True)
+        self._thread.start()
+
+
+def _serve_metrics(worker: Worker, port: int) -> None:
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            body = json.dumps({**worker.metrics(), "schema": iso.schema_status()}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # keep worker logs quiet
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="worker-metrics", daemon=True).start()
+
+
+def main() -> None:
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    models.create_schema(db.engine)
+
+    worker = Worker()
+    if WORKER_METRICS_PORT:
+        _serve_metrics(worker, WORKER_METRICS_PORT)
+
+    def _handle_signal(signum, frame):
+        logger.info("signal %s received, draining", signum)
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import fs from "fs";
+import path from "path";
+import readline from "readline";
+import { ethers } from "ethers";
+
+// Long-lived anchoring helper for app/anchor_node.py.
+// Protocol: one JSON object per line on stdin, one JSON reply per line on stdout.
+//   request:  {"id": 1, "op": "anchor" | "find" | "ping", "hash": "0x...", "nonce": 7}
+//   response: {"id": 1, "ok": true, "result": {...}}
+//          or {"id": 1, "ok": false, "error": "...", "sent": false | true | null, "txid": "0x..." | null}
+// "nonce" is optional: when given (allocated by app/nonce.py) the anchor is tried once with it,
+// otherwise the local counter below is used. On errors, "sent" is false only when the node
+// provably never got the tx, and "txid" is set once the tx was signed.
+// Requests are handled concurrently; replies may arrive out of order.
+
+const HASH_RE = /^0x[0-9a-fA-F]{64}$/;
+
+function env() {
+  let rpcUrl = (process.env.RPC_URL || process.env.FLARE_RPC_URL || "").trim();
+  let pk = (process.env.PRIVATE_KEY || process.env.ANCHOR_PRIVATE_KEY || "").trim();
+  let addr = (process.env.CONTRACT_ADDR || process.env.ANCHOR_CONTRACT_ADDR || "").trim();
+
+  if (!rpcUrl) throw new Error("Missing RPC_URL/FLARE_RPC_URL");
+  if (!addr) throw new Error("Missing CONTRACT_ADDR/ANCHOR_CONTRACT_ADDR");
+  if (!/^0x[0-9a-fA-F]{40}$/.test(addr)) throw new Error("CONTRACT_ADDR must be 0x address");
+  if (pk) {
+    if (!pk.startsWith("0x")) pk = "0x" + pk;
+    pk = pk.replace(/\s+/g, "");
+    if (!/^0x[0-9a-fA-F]{64}$/.test(pk)) throw new Error("PRIVATE_KEY must be 0x 32-byte hex");
+  }
+  return { rpcUrl, pk, addr };
+}
+
+// Provider, wallet, ABI and contract are created once and reused for every request
+const { rpcUrl, pk, addr } = env();
+const abiPath = path.resolve(process.cwd(), "contracts", "EvidenceAnchor.abi.json");
+const abi = JSON.parse(fs.readFileSync(abiPath, "utf8"));
+const provider = new ethers.JsonRpcProvider(rpcUrl, undefined, { staticNetwork: true });
+const wallet = pk ? new ethers.Wallet(pk, provider) : null;
+const contract = new ethers.Contract(addr, abi, wallet || provider);
+const iface = new ethers.Interface(abi);
+const topic0 = iface.getEvent("EvidenceAnchored").topicHash;
+const LOOKBACK = parseInt(process.env.ANCHOR_LOOKBACK_BLOCKS || "50000", 10);
+// Give up waiting for a receipt a little before app/anchor_node.py stops waiting for the reply
+const WAIT_MS = Math.max(10, parseFloat(process.env.ANCHOR_NODE_TIMEOUT_SECONDS || "300") - 10) * 1000;
+
+// Local nonce counter: concurrent anchors get consecutive nonces without racing the node.
+// Nonces the node provably rejected are handed out again first; a nonce whose tx may be in a
+// mempool is never reused, and the counter only ever moves forward.
+let nextNonce = null;
+let released = [];
+let nonceChain = Promise.resolve();
+
+function allocateNonce() {
+  const result = nonceChain.then(async () => {
+    if (released.length) return released.shift();
+    if (nextNonce === null) {
+      nextNonce = await provider.getTransactionCount(wallet.address, "pending");
+    }
+    return nextNonce++;
+  });
+  nonceChain = result.catch(() => {});
+  return result;
+}
+
+function releaseNonce(nonce) {
+  released.push(nonce);
+  released.sort((a, b) => a - b);
+}
+
+// The node has seen nonces we have not handed out: skip past them. Never step back below
+// nonces still in flight (their txs may not be pending on the node yet).
+function resyncNonce() {
+  const result = nonceChain.then(async () => {
+    const pending = await provider.getTransactionCount(wallet.address, "pending");
+    nextNonce = nextNonce === null ? pending : Math.max(nextNonce, pending);
+    released = released.filter((n) => n >= pending);
+  });
+  nonceChain = result.catch(() => {});
+  return nonceChain;
+}
+
+function errText(e) {
+  return String(e?.message || e).toLowerCase();
+}
+
+function isNonceError(e) {
+  const text = errText(e);
+  return e?.code === "NONCE_EXPIRED" || text.includes("nonce too low") || text.includes("nonce has already been used");
+}
+
+// This exact signed tx is already in the node's pool (an earlier delivery got through)
+function isAlreadyKnown(e) {
+  const text = errText(e);
+  return text.includes("already known") || text.includes("known transaction");
+}
+
+// The node answered with a JSON-RPC error: the tx was rejected, not lost in transit
+function isRejected(e) {
+  return (
+    ["NONCE_EXPIRED", "REPLACEMENT_UNDERPRICED", "INSUFFICIENT_FUNDS"].includes(e?.code) ||
+    e?.error?.code !== undefined ||
+    e?.info?.error?.code !== undefined
+  );
+}
+
+function anchorError(e, sent, txid) {
+  const err = new Error(e?.message || String(e));
+  err.sent = sent;
+  err.txid = txid;
+  err.nonceError = isNonceError(e);
+  return err;
+}
+
+async function sendAnchor(hashBytes, nonce) {
+  // Signed here so the tx hash is known even when the broadcast fails in transit
+  let signed;
+  try {
+    const req = await contract.anchorEvidence.populateTransaction(hashBytes, { nonce });
+    signed = await wallet.signTransaction(await wallet.populateTransaction(req));
+  } catch (e) {
+    throw anchorError(e, false, null);
+  }
+  const txid = ethers.keccak256(signed);
+  try {
+    await provider.broadcastTransaction(signed);
+  } catch (e) {
+    if (!isAlreadyKnown(e)) {
+      if (isRejected(e)) throw anchorError(e, false, null);
+      // Timeout, reset, bad response: the node may have it, so wait for it like a sent tx
+      console.error(`broadcast of ${txid} failed in transit: ${e?.message || e}`);
+    }
+  }
+  const receipt = await provider.waitForTransaction(txid, 1, WAIT_MS).catch(() => null);
+  if (!receipt) throw anchorError(new Error(`tx ${txid} not mined in time`), null, txid);
+  if (receipt.status === 0) throw anchorError(new Error("Transaction failed with status != 1"), true, txid);
+  return { txid, blockNumber: receipt.blockNumber ?? null };
+}
+
+async function anchor(bundleHash, nonce) {
+  if (!wallet) throw new Error("Missing PRIVATE_KEY/ANCHOR_PRIVATE_KEY");
+  const hashBytes = ethers.getBytes(bundleHash);
+  if (nonce !== undefined && nonce !== null) {
+    // Nonce owned by the caller, which also handles release/resync on failure
+    return sendAnchor(hashBytes, Number(nonce));
+  }
+  let lastErr = null;
+  for (let attempt = 0; attempt < 3; attempt++) {
+    const n = await allocateNonce();
+    try {
+      return await sendAnchor(hashBytes, n);
+    } catch (e) {
+      lastErr = e;
+      if (e.sent !== false) break; // may be in a mempool: keep the nonce used, do not re-send
+      if (e.nonceError) {
+        await resyncNonce();
+        continue;
+      }
+      releaseNonce(n);
+      break;
+    }
+  }
+  throw lastErr || new Error("anchor failed");
+}
+
+async function find(bundleHash) {
+  const latest = await provider.getBlockNumber();
+  const fromBlock = Math.max(0, latest - LOOKBACK);
+  // Filter by event signature only (bundleHash is not indexed)
+  const logs = await provider.getLogs({ address: addr, fromBlock, toBlock: latest, topics: [topic0] });
+  for (let i = logs.length - 1; i >= 0; i--) {
+    const log = logs[i];
+    try {
+      const parsed = iface.parseLog(log);
+      const evHex = ethers.hexlify(parsed.args?.bundleHash);
+      if (evHex.toLowerCase() === bundleHash.toLowerCase()) {
+        const blk = await provider.getBlock(log.blockNumber);
+        return {
+          matches: true,
+          txid: log.transactionHash,
+          anchored_at: blk?.timestamp ? new Date(blk.timestamp * 1000).toISOString() : null,
+        };
+      }
+    } catch {
+      // skip decode errors
+    }
+  }
+  return { matches: false };
+}
+
+async function handle(req) {
+  if (req.op === "ping") return { pong: true };
+  const bundleHash = String(req.hash || "").trim();
+  if (!HASH_RE.test(bundleHash)) throw new Error("bundleHash must be 0x-prefixed 32-byte hex");
+  if (req.op === "anchor") return anchor(bundleHash, req.nonce);
+  if (req.op === "find") return find(bundleHash);
+  throw new Error(`unknown op: ${req.op}`);
+}
+
+function reply(obj) {
+  process.stdout.write(JSON.stringify(obj) + "\n");
+}
+
+let inFlight = 0;
+let closing = false;
+
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+rl.on("line", (line) => {
+  if (!line.trim()) return;
+  let req;
+  try {
+    req = JSON.parse(line);
+  } catch {
+    reply({ id: null, ok: false, error: "invalid JSON request" });
+    return;
+  }
+  inFlight++;
+  handle(req)
+    .then((result) => reply({ id: req.id, ok: true, result }))
+    .catch((e) =>
+      reply({ id: req.id, ok: false, error: e?.message || String(e), sent: e?.sent ?? null, txid: e?.txid ?? null })
+    )
+    .finally(() => {
+      inFlight--;
+      if (closing && inFlight === 0) process.exit(0);
+    });
+});
+// Parent closed stdin: exit once in-flight requests are done
+rl.on("close", () => {
+  closing = true;
+  if (inFlight === 0) process.exit(0);
+});
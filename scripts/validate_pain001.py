@@ -0,0 +1,54 @@
+"""
+Validates a pain.001 file of any size (a settlement export, an inbound batch) against
+schemas/pain.001.001.09.xsd in bounded memory, printing progress and every error with
+its line and path. Exit status 0 = valid, 1 = invalid, 2 = cancelled or no schema.
+
+  python scripts/validate_pain001.py export.xml
+  python scripts/validate_pain001.py inbound.xml --max-seconds 60 --max-errors 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import iso_stream  # noqa: E402
+
+
+def main(args: argparse.Namespace) -> int:
+    total = os.path.getsize(args.path)
+    started = time.monotonic()
+    last = [0.0]
+
+    def progress(bytes_read: int, units: int) -> bool:
+        now = time.monotonic()
+        if now - last[0] >= 1.0:
+            last[0] = now
+            pct = 100.0 * bytes_read / total if total else 100.0
+            print(f"  {pct:5.1f}%  {bytes_read / 1e6:9.1f} MB  {units} PmtInf/CdtTrfTxInf", file=sys.stderr)
+        return not args.max_seconds or now - started < args.max_seconds
+
+    result = iso_stream.validate_stream(args.path, progress=progress, max_errors=args.max_errors)
+    elapsed = time.monotonic() - started
+    for issue in result.errors:
+        print(issue)
+    if result.validator is None:
+        print("no schema: schemas/pain.001.001.09.xsd is missing", file=sys.stderr)
+        return 2
+    state = "cancelled" if result.cancelled else "valid" if result.valid else "invalid"
+    more = " (stopped at --max-errors)" if result.truncated else ""
+    print(
+        f"{state}{more}: {len(result.errors)} errors, {result.units} units, "
+        f"{result.bytes_read / 1e6:.1f} MB in {elapsed:.1f}s ({result.validator})",
+        file=sys.stderr,
+    )
+    return 2 if result.cancelled else 0 if result.valid else 1
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("path")
+    p.add_argument("--max-seconds", type=float, default=0, help="cancel after this long (0 = no limit)")
+    p.add_argument("--max-errors", type=int, default=iso_stream.STREAM_MAX_ERRORS)
+    sys.exit(main(p.parse_args()))
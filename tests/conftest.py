@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+# Throwaway SQLite database and artifacts dir, set before any app module reads its settings
+_tmp = tempfile.mkdtemp(prefix="iso-middleware-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["ARTIFACTS_DIR"] = os.path.join(_tmp, "artifacts")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app import db, models  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    """Fresh schema per test; yields a session on it."""
+    models.Base.metadata.drop_all(bind=db.engine)
+    models.Base.metadata.create_all(bind=db.engine)
+    s = db.SessionLocal()
+    try:
+        yield s
+    finally:
+        s.close()
+
+
+@pytest.fixture
+def make_receipt(session):
+    """Inserts a receipt; keyword arguments override the defaults."""
+    counter = iter(range(1_000_000))
+
+    def _make(**fields):
+        n = next(counter)
+        values = dict(
+            reference=f"ref-{n}",
+            tip_tx_hash=f"0xtip{n}",
+            chain="coston2",
+            amount=1,
+            currency="FLR",
+            sender_wallet="0xsender",
+            receiver_wallet="0xreceiver",
+            status="pending",
+        )
+        values.update(fields)
+        rec = models.Receipt(**values)
+        session.add(rec)
+        session.commit()
+        return rec
+
+    return _make
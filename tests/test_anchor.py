@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("web3")
+
+from web3.exceptions import TimeExhausted  # noqa: E402
+
+from app import anchor, nonce  # noqa: E402
+
+
+class _Mgr:
+    def current_tx_hash(self, nonce_value):
+        return "0xreplacement"
+
+
+def test_wait_timeout_after_send_raises_broadcast_unconfirmed(monkeypatch):
+    w3 = SimpleNamespace(eth=SimpleNamespace(account=SimpleNamespace(from_key=lambda pk: SimpleNamespace(address="0xabc"))))
+    monkeypatch.setattr(anchor, "PRIVATE_KEY", "0x" + "01" * 32)
+    monkeypatch.setattr(anchor, "_load_contract", lambda: (w3, object()))
+    monkeypatch.setattr(anchor, "_nonce_manager", lambda w3, addr: _Mgr())
+    sent = []
+
+    def submit(w3, contract, acct, mgr, h):
+        sent.append(h)
+        return 5, "0xoriginal"
+
+    def wait(w3, mgr, nonce_value, tx_hash):
+        raise TimeExhausted("not mined")
+
+    monkeypatch.setattr(anchor, "_submit", submit)
+    monkeypatch.setattr(anchor, "_wait_for_nonce", wait)
+    with pytest.raises(nonce.BroadcastUnconfirmed) as exc:
+        anchor.anchor_bundle("0x" + "11" * 32)
+    assert exc.value.tx_hash == "0xreplacement"
+    assert len(sent) == 1  # never re-sent under another nonce
@@ -0,0 +1,91 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from app import anchor_batch, confirm, models
+
+
+def _hash(n):
+    return "0x" + hashlib.sha256(f"bundle-{n}".encode()).hexdigest()
+
+
+def _batched(make_receipt, tmp_path, n, age=60):
+    recs = []
+    for i in range(n):
+        out = tmp_path / f"r{i}"
+        out.mkdir()
+        recs.append(
+            make_receipt(
+                status="batched",
+                bundle_hash=_hash(i),
+                bundle_path=str(out / "evidence.zip"),
+                batched_at=datetime.utcnow() - timedelta(seconds=age),
+            )
+        )
+    return recs
+
+
+@pytest.fixture
+def flushed(monkeypatch, session, make_receipt, tmp_path):
+    """Five due receipts flushed in batches of two by a flusher whose root tx is 0xroot."""
+    monkeypatch.setattr(confirm, "_notify", lambda rid: None)
+    recs = _batched(make_receipt, tmp_path, 5)
+    flusher = anchor_batch.BatchFlusher(max_size=2, window_seconds=1, submit_workers=4, anchor_fn=lambda root: ("0xroot", None))
+    assert flusher.poll_once() == 3
+    flusher._pool.shutdown(wait=True)
+    session.expire_all()
+    return [session.get(models.Receipt, r.id) for r in recs]
+
+
+def test_flusher_submits_due_batches_and_writes_proofs(flushed):
+    assert {r.status for r in flushed} == {"submitted"}
+    assert {r.flare_txid for r in flushed} == {"0xroot"}
+    assert len({r.merkle_root for r in flushed}) == 3
+    for rec in flushed:
+        doc = json.loads((Path(rec.bundle_path).parent / anchor_batch.PROOF_FILENAME).read_text())
+        assert anchor_batch.root_from_proof(doc, rec.bundle_hash) == rec.merkle_root
+
+
+def test_flusher_waits_for_window_until_batch_is_full(monkeypatch, session, make_receipt, tmp_path):
+    _batched(make_receipt, tmp_path, 1, age=0)
+    sent = []
+    flusher = anchor_batch.BatchFlusher(max_size=2, window_seconds=60, anchor_fn=lambda root: sent.append(root))
+    assert flusher.poll_once() == 0
+    assert sent == []
+
+
+def test_failed_root_submission_fails_the_batch(monkeypatch, session, make_receipt, tmp_path):
+    monkeypatch.setattr(confirm, "_notify", lambda rid: None)
+    recs = _batched(make_receipt, tmp_path, 2)
+
+    def reject(root):
+        raise RuntimeError("rejected")
+
+    flusher = anchor_batch.BatchFlusher(max_size=2, window_seconds=1, anchor_fn=reject)
+    flusher.poll_once()
+    flusher._pool.shutdown(wait=True)
+    session.expire_all()
+    for rec in recs:
+        rec = session.get(models.Receipt, rec.id)
+        assert (rec.status, rec.merkle_root) == ("failed", None)
+
+
+def test_stored_proof_root(flushed):
+    rec = flushed[0]
+    assert anchor_batch.stored_proof_root(rec.bundle_hash) == rec.merkle_root
+
+
+def test_stored_proof_root_skips_unbatched_receipts(session, make_receipt):
+    make_receipt(status="anchored", bundle_hash=_hash(99), bundle_path="/nowhere/evidence.zip")
+    assert anchor_batch.stored_proof_root(_hash(99)) is None
+    assert anchor_batch.stored_proof_root(_hash(100)) is None
+
+
+def test_stored_proof_root_requires_the_proof_file(flushed):
+    rec = flushed[0]
+    (Path(rec.bundle_path).parent / anchor_batch.PROOF_FILENAME).unlink()
+    with pytest.raises(ValueError, match="missing"):
+        anchor_batch.stored_proof_root(rec.bundle_hash)
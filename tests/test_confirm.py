@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import confirm, models, nonce
+
+
+def _watch(monkeypatch, mined):
+    """Watcher whose RPC knows receipts only for the `mined` hashes."""
+    monkeypatch.setattr(confirm, "_get_receipts", lambda hashes: {h: mined[h] for h in hashes if h in mined})
+    monkeypatch.setattr(confirm, "_notify", lambda rid: None)
+    return confirm.ConfirmationWatcher(batch_size=10)
+
+
+def test_replaced_tx_resolves_to_the_original_when_it_is_mined(monkeypatch, session, make_receipt):
+    mgr = nonce.NonceManager("0xsender", lambda ident: 0)
+    mgr.record_sent(3, "0xoriginal", "0x" + "11" * 32, {"gasPrice": 10})
+    rec = make_receipt(status="submitted", flare_txid="0xoriginal")
+    mgr.record_replacement(3, "0xoriginal", "0xbumped", {"gasPrice": 12})
+    session.refresh(rec)
+    assert rec.flare_txid == "0xbumped"
+
+    watcher = _watch(monkeypatch, {"0xoriginal": {"status": "0x1"}})
+    assert watcher.poll_once() == 1
+
+    session.expire_all()
+    rec = session.get(models.Receipt, rec.id)
+    assert (rec.status, rec.flare_txid) == ("anchored", "0xoriginal")
+    tx = session.scalars(select(models.AnchorTx)).one()
+    assert (tx.status, tx.tx_hash) == ("mined", "0xoriginal")
+    assert set(mgr.tx_hashes(3)) == {"0xoriginal", "0xbumped"}
+
+
+def test_unmined_tx_stays_submitted_while_tracked_as_pending(monkeypatch, session, make_receipt):
+    mgr = nonce.NonceManager("0xsender", lambda ident: 0)
+    mgr.record_sent(4, "0xpending", None, {})
+    rec = make_receipt(status="submitted", flare_txid="0xpending")
+    assert _watch(monkeypatch, {}).poll_once() == 0
+    session.refresh(rec)
+    assert rec.status == "submitted"
+
+
+def _old(seconds=confirm.CONFIRM_TIMEOUT_SECONDS + 60):
+    return datetime.utcnow() - timedelta(seconds=seconds)
+
+
+def test_untracked_tx_expires_after_the_timeout(monkeypatch, session, make_receipt):
+    stale = make_receipt(status="submitted", flare_txid="0xnode1", created_at=_old())
+    fresh = make_receipt(status="submitted", flare_txid="0xnode2")
+    assert _watch(monkeypatch, {}).poll_once() == 1
+    session.expire_all()
+    assert session.get(models.Receipt, stale.id).status == "failed"
+    assert session.get(models.Receipt, fresh.id).status == "submitted"
+
+
+def test_expiry_counts_from_the_send_not_the_receipt(monkeypatch, session, make_receipt):
+    # A receipt retried long after it was created: its tx was only just sent
+    mgr = nonce.NonceManager("0xsender", lambda ident: 0)
+    mgr.record_sent(5, "0xlate", None, {})
+    mgr.mark(5, "failed")  # no longer pending with the sweeper
+    rec = make_receipt(status="submitted", flare_txid="0xlate", created_at=_old())
+    assert _watch(monkeypatch, {}).poll_once() == 0
+    session.refresh(rec)
+    assert rec.status == "submitted"
+
+
+def test_reverted_tx_fails_the_receipt(monkeypatch, session, make_receipt):
+    rec = make_receipt(status="submitted", flare_txid="0xreverted")
+    assert _watch(monkeypatch, {"0xreverted": {"status": "0x0"}}).poll_once() == 1
+    session.refresh(rec)
+    assert rec.status == "failed"
+
+
+def test_pages_rotate_through_all_outstanding_txs(monkeypatch, session, make_receipt):
+    for n in range(3):
+        make_receipt(status="submitted", flare_txid=f"0xtx{n}", created_at=_old(100 - n))
+    polled = []
+    monkeypatch.setattr(confirm, "_get_receipts", lambda hashes: polled.append(hashes) or {})
+    monkeypatch.setattr(confirm, "_notify", lambda rid: None)
+    watcher = confirm.ConfirmationWatcher(batch_size=2)
+    for _ in range(3):
+        watcher.poll_once()
+    assert polled == [["0xtx0", "0xtx1"], ["0xtx2"], ["0xtx0", "0xtx1"]]
@@ -0,0 +1,71 @@
+import pytest
+
+from app import fees, rpc
+
+
+class FakeClient:
+    def __init__(self, block=1):
+        self.block = block
+        self.calls = []
+        self.down = False
+
+    def call(self, method, params=None):
+        if self.down:
+            raise rpc.RpcError("unreachable")
+        self.calls.append(method)
+        return hex(self.block)
+
+    def batch(self, calls):
+        self.calls.extend(m for m, _ in calls)
+        history = {"baseFeePerGas": [hex(10 * 10**9)], "reward": [[hex(1), hex(3 * 10**9), hex(5)]]}
+        return [history if m == "eth_feeHistory" else hex(25 * 10**9) for m, _ in calls]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(rpc, "get_client", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def oracle(monkeypatch):
+    o = fees.FeeOracle(poll_seconds=3600, max_age=3600)
+    monkeypatch.setattr(o, "_ensure_thread", lambda: None)
+    return o
+
+
+def test_unchanged_block_polls_block_number_only(client, oracle):
+    assert oracle.refresh() is True
+    assert client.calls == ["eth_blockNumber", "eth_feeHistory", "eth_gasPrice"]
+
+    client.calls.clear()
+    assert oracle.refresh() is False
+    assert client.calls == ["eth_blockNumber"]
+
+    client.block = 2
+    client.calls.clear()
+    assert oracle.refresh() is True
+    assert client.calls == ["eth_blockNumber", "eth_feeHistory", "eth_gasPrice"]
+
+
+def test_first_current_blocks_on_refresh(client, oracle):
+    got = oracle.current()
+    assert got == {"type": 2, "maxFeePerGas": 23 * 10**9, "maxPriorityFeePerGas": 3 * 10**9}
+
+    client.calls.clear()
+    assert oracle.current() == got
+    assert client.calls == []
+
+
+def test_current_without_any_fees_raises(client, oracle):
+    client.down = True
+    with pytest.raises(fees.FeesUnavailable):
+        oracle.current()
+
+
+def test_current_keeps_last_fees_when_refresh_fails(client, oracle):
+    got = oracle.current()
+    oracle.max_age = 0
+    client.down = True
+    assert oracle.current() == got
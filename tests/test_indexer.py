@@ -0,0 +1,94 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import indexer, models
+
+CONTRACT = "0x00000000000000000000000000000000000000aa"
+
+
+class Eth:
+    """Blocks 0..head with hashes that change at and above `fork` once reorged."""
+
+    def __init__(self, head=200):
+        self.block_number = head
+        self.fork = None
+
+    def get_block(self, number):
+        tag = "b" if self.fork is not None and number >= self.fork else "a"
+        return {"hash": f"0x{tag}{number:04x}", "timestamp": 1_700_000_000 + number}
+
+
+@pytest.fixture
+def w3(monkeypatch):
+    monkeypatch.setattr(indexer, "CONTRACT_ADDR", CONTRACT)
+    return SimpleNamespace(eth=Eth())
+
+
+def _event(session, block, bundle_hash, contract=CONTRACT):
+    session.add(
+        models.AnchorEvent(
+            contract=contract,
+            bundle_hash=bundle_hash,
+            tx_hash=f"0xtx{block}",
+            log_index=0,
+            block_number=block,
+            block_hash=f"0xa{block:04x}",
+            anchored_at=datetime(2024, 1, 1),
+        )
+    )
+
+
+def _checkpoint(session, block):
+    cp = models.IndexCheckpoint(
+        contract=CONTRACT, start_block=10, block_number=block, block_hash=f"0xa{block:04x}", updated_at=datetime.utcnow()
+    )
+    session.add(cp)
+    session.commit()
+    return cp
+
+
+def test_reorg_rewinds_checkpoint_and_drops_recent_events(session, w3):
+    _event(session, 20, "0xold")
+    _event(session, 150, "0xrecent")
+    cp = _checkpoint(session, 180)
+    w3.eth.fork = 170
+
+    indexer.AnchorIndexer(reorg_depth=64)._rewind_if_reorged(session, w3, cp)
+
+    assert (cp.block_number, cp.block_hash) == (116, "0xa0074")
+    assert [e.bundle_hash for e in session.query(models.AnchorEvent)] == ["0xold"]
+
+
+def test_canonical_checkpoint_is_left_alone(session, w3):
+    _event(session, 150, "0xrecent")
+    cp = _checkpoint(session, 180)
+
+    indexer.AnchorIndexer(reorg_depth=64)._rewind_if_reorged(session, w3, cp)
+
+    assert cp.block_number == 180
+    assert session.query(models.AnchorEvent).count() == 1
+
+
+def test_rewind_stops_before_the_first_indexed_block(session, w3):
+    cp = _checkpoint(session, 30)
+    w3.eth.fork = 0
+    indexer.AnchorIndexer(reorg_depth=64)._rewind_if_reorged(session, w3, cp)
+    assert cp.block_number == 9
+
+
+def test_store_does_not_advance_a_checkpoint_moved_by_another_indexer(session, w3):
+    cp = _checkpoint(session, 100)
+    stale = models.IndexCheckpoint(contract=CONTRACT, start_block=10, block_number=90, block_hash="0x", updated_at=None)
+    assert not indexer.AnchorIndexer()._store(session, stale, [], 120, "0xa0078")
+    session.refresh(cp)
+    assert cp.block_number == 100
+
+
+def test_lookup_is_scoped_to_the_configured_contract(session, w3):
+    _event(session, 50, "0xbundle", contract="0x00000000000000000000000000000000000000bb")
+    _event(session, 60, "0xbundle")
+    session.commit()
+    match = indexer.lookup("0xBUNDLE")
+    assert match.txid == "0xtx60"
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import ingest, models
+
+
+def _tip(n, **fields):
+    tip = {
+        "tip_tx_hash": f"0xtip{n}",
+        "chain": "coston2",
+        "amount": "1",
+        "currency": "FLR",
+        "sender_wallet": "0xsender",
+        "receiver_wallet": "0xreceiver",
+        "reference": f"ref-{n}",
+    }
+    tip.update(fields)
+    return tip
+
+
+@pytest.fixture
+def client(session):
+    from app.main import app
+
+    return TestClient(app)
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_MAX_ITEMS", 3)
+    monkeypatch.setattr(ingest, "INGEST_CHUNK_ROWS", 2)
+
+
+def test_ndjson_over_limit_is_truncated_after_committed_chunks(client, session, small_limits):
+    body = "\n".join(json.dumps(_tip(n)) for n in range(5))
+    r = client.post("/v1/iso/record-tips:batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert r.status_code == 200
+    data = r.json()
+    assert data["truncated"] is True
+    assert data["created"] == 3
+    assert [it["index"] for it in data["items"]] == [0, 1, 2]
+    assert session.query(models.Receipt).count() == 3
+
+
+def test_json_array_over_limit_stores_nothing(client, session, small_limits):
+    r = client.post("/v1/iso/record-tips:batch", json=[_tip(n) for n in range(4)])
+
+    assert r.status_code == 413
+    assert session.query(models.Receipt).count() == 0
+
+
+def test_ndjson_at_limit_is_not_truncated(client, session, small_limits):
+    body = "\n".join(json.dumps(_tip(n)) for n in range(3)) + "\n"
+    r = client.post("/v1/iso/record-tips:batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert r.json()["truncated"] is False
+    assert r.json()["created"] == 3
+
+
+def test_batch_dedupes_within_the_batch_and_against_stored_tips(client, session, make_receipt):
+    known = make_receipt(tip_tx_hash="0xknown", reference="ref-known", status="anchored")
+    body = [_tip(1), _tip(1), _tip(2, tip_tx_hash="0xknown"), _tip(3, reference="ref-known"), {"chain": "coston2"}]
+    data = client.post("/v1/iso/record-tips:batch", json=body).json()
+
+    items = data["items"]
+    assert (data["created"], data["existing"], data["failed"]) == (1, 2, 2)
+    assert items[0]["created"] and not items[1]["created"]
+    assert items[1]["receipt_id"] == items[0]["receipt_id"]
+    assert (items[2]["receipt_id"], items[2]["status"]) == (str(known.id), "anchored")
+    assert items[3]["error"] == "reference already used by another tip"
+    assert "tip_tx_hash" in items[4]["error"]
+
+    # Exactly one receipt and one job were stored for the new tip
+    assert session.query(models.Receipt).count() == 2
+    assert session.query(models.Job).count() == 1
+
+
+def test_record_tip_is_idempotent(client, session):
+    first = client.post("/v1/iso/record-tip", json=_tip(1))
+    again = client.post("/v1/iso/record-tip", json=_tip(1))
+
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    assert session.query(models.Receipt).count() == 1
+    assert session.query(models.Job).count() == 1
+
+
+def test_record_tip_with_a_reused_reference_is_409(client, session):
+    client.post("/v1/iso/record-tip", json=_tip(1))
+    r = client.post("/v1/iso/record-tip", json=_tip(2, reference="ref-1"))
+
+    assert r.status_code == 409
+    assert session.query(models.Receipt).count() == 1
+    assert session.query(models.Job).count() == 1
@@ -0,0 +1,129 @@
+import io
+
+import pytest
+from lxml import etree
+
+from app import iso, iso_stream
+
+NS = iso.NS_PAIN001
+
+# Cut-down pain.001 shape: enough structure for context copies and unit paths
+XSD = f"""<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="{NS}" xmlns="{NS}"
+           elementFormDefault="qualified">
+  <xs:element name="Document">
+    <xs:complexType><xs:sequence>
+      <xs:element name="CstmrCdtTrfInitn">
+        <xs:complexType><xs:sequence>
+          <xs:element name="GrpHdr">
+            <xs:complexType><xs:sequence>
+              <xs:element name="MsgId" type="xs:string"/>
+              <xs:element name="NbOfTxs" type="xs:integer"/>
+            </xs:sequence></xs:complexType>
+          </xs:element>
+          <xs:element name="PmtInf" maxOccurs="unbounded">
+            <xs:complexType><xs:sequence>
+              <xs:element name="PmtInfId" type="xs:string"/>
+              <xs:element name="CdtTrfTxInf" maxOccurs="unbounded">
+                <xs:complexType><xs:sequence>
+                  <xs:element name="EndToEndId" type="xs:string"/>
+                  <xs:element name="Amt" type="xs:decimal"/>
+                </xs:sequence></xs:complexType>
+              </xs:element>
+            </xs:sequence></xs:complexType>
+          </xs:element>
+        </xs:sequence></xs:complexType>
+      </xs:element>
+    </xs:sequence></xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+
+def _document(pmt_infs=3, txs=50, bad=(), header=True):
+    """pain.001-shaped bytes, one element per line; `bad` holds (pmt, tx) pairs (1-based) with a bad amount."""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<Document xmlns="{NS}">', "<CstmrCdtTrfInitn>"]
+    if header:
+        lines += ["<GrpHdr>", "<MsgId>M1</MsgId>", f"<NbOfTxs>{pmt_infs * txs}</NbOfTxs>", "</GrpHdr>"]
+    where = {}
+    for p in range(1, pmt_infs + 1):
+        lines += ["<PmtInf>", f"<PmtInfId>P{p}</PmtInfId>"]
+        for t in range(1, txs + 1):
+            lines += ["<CdtTrfTxInf>", f"<EndToEndId>E{p}-{t}</EndToEndId>"]
+            amount = "lots" if (p, t) in bad else "1.00"
+            where[(p, t)] = len(lines) + 1
+            lines += [f"<Amt>{amount}</Amt>", "</CdtTrfTxInf>"]
+        lines.append("</PmtInf>")
+    lines += ["</CstmrCdtTrfInitn>", "</Document>"]
+    return "\n".join(lines).encode(), where
+
+
+@pytest.fixture
+def lxml_schema(monkeypatch):
+    schema = etree.XMLSchema(etree.fromstring(XSD.encode()))
+    monkeypatch.setattr(iso, "_get_fast_schema", lambda: schema)
+    return schema
+
+
+def test_valid_document_validates_every_unit(lxml_schema):
+    data, _ = _document()
+    result = iso_stream.validate_stream(io.BytesIO(data))
+    assert result.valid, result.errors
+    assert (result.validator, result.units, result.bytes_read) == ("lxml", 3 + 150, len(data))
+
+
+def test_errors_point_at_the_original_line_and_path(lxml_schema):
+    data, where = _document(bad={(2, 7)})
+    result = iso_stream.validate_stream(io.BytesIO(data))
+    [issue] = result.errors
+    assert issue.path == "/Document/CstmrCdtTrfInitn/PmtInf[2]/CdtTrfTxInf[7]/Amt"
+    assert issue.line == where[(2, 7)]
+
+
+def test_document_level_errors_are_reported(lxml_schema):
+    data, _ = _document(header=False)
+    result = iso_stream.validate_stream(io.BytesIO(data))
+    assert not result.valid
+    assert any("GrpHdr" in issue.message for issue in result.errors)
+
+
+def test_errors_stop_at_max_errors(lxml_schema):
+    data, _ = _document(pmt_infs=1, txs=20, bad={(1, t) for t in range(1, 21)})
+    result = iso_stream.validate_stream(io.BytesIO(data), max_errors=5)
+    assert len(result.errors) == 5 and result.truncated
+
+
+def test_progress_can_cancel(lxml_schema):
+    data, _ = _document(pmt_infs=20, txs=200)
+    seen = []
+
+    def progress(bytes_read, units):
+        seen.append(bytes_read)
+        return bytes_read < len(data) // 2
+
+    result = iso_stream.validate_stream(io.BytesIO(data), progress=progress)
+    assert result.cancelled and not result.valid
+    assert result.bytes_read < len(data)
+
+
+def test_malformed_xml(lxml_schema):
+    result = iso_stream.validate_stream(io.BytesIO(b"<Document><Unclosed></Document>"))
+    assert "not well-formed" in result.errors[0].message
+
+
+def test_xmlschema_fallback_finds_the_same_error(monkeypatch):
+    xmlschema = pytest.importorskip("xmlschema")
+    monkeypatch.setattr(iso, "_get_fast_schema", lambda: None)
+    monkeypatch.setattr(iso, "_get_schema", lambda: xmlschema.XMLSchema(XSD))
+    data, _ = _document(bad={(3, 2)})
+    result = iso_stream.validate_stream(io.BytesIO(data))
+    assert result.validator == "xmlschema"
+    [issue] = result.errors
+    # Lazy validation locates errors only down to the lazily loaded subtree
+    assert "'lots'" in issue.message and issue.path.startswith("/Document")
+
+
+def test_without_an_xsd_nothing_is_validated(monkeypatch):
+    monkeypatch.setattr(iso, "_get_fast_schema", lambda: None)
+    monkeypatch.setattr(iso, "_get_schema", lambda: None)
+    assert iso_stream.validate_stream(io.BytesIO(b"<x/>")).validator is None
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from app.logscan import LogScanner, is_range_error
+
+
+class Provider:
+    """eth_getLogs over blocks 0..N with one log per block; refuses spans above `limit`."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, lo, hi):
+        with self._lock:
+            self.spans.append(hi - lo + 1)
+        if hi - lo + 1 > self.limit:
+            raise ValueError("query exceeds max block range 100")
+        return [{"blockNumber": n, "logIndex": 0} for n in range(lo, hi + 1)]
+
+
+@pytest.mark.parametrize("newest_first", [True, False])
+def test_span_shrinks_to_the_provider_limit_and_covers_every_block(newest_first):
+    provider = Provider(limit=100)
+    scanner = LogScanner(provider, initial_chunk=1000, max_in_flight=3)
+
+    blocks = [log["blockNumber"] for log in scanner.scan(0, 2999, newest_first=newest_first)]
+
+    expected = list(range(3000))
+    assert blocks == (expected[::-1] if newest_first else expected)
+    assert scanner.chunk <= 100
+    assert scanner._ceiling <= 100
+
+
+def test_span_closes_in_on_the_limit_without_retrying_failed_spans():
+    provider = Provider(limit=400)
+    scanner = LogScanner(provider, initial_chunk=50, max_in_flight=1)
+    list(scanner.scan(0, 9999, newest_first=False))
+    assert 300 <= scanner.chunk <= scanner._ceiling
+    failures = [s for s in provider.spans if s > 400]
+    assert len(failures) <= 8
+
+
+def test_non_range_errors_propagate():
+    def broken(lo, hi):
+        raise ConnectionError("connection refused")
+
+    with pytest.raises(ConnectionError):
+        list(LogScanner(broken, initial_chunk=10).scan(0, 100))
+
+
+def test_stopping_early_skips_remaining_ranges():
+    provider = Provider(limit=10_000)
+    scanner = LogScanner(provider, initial_chunk=10, max_in_flight=1)
+    first = next(scanner.scan(0, 10_000, newest_first=True))
+    assert first["blockNumber"] == 10_000
+    assert len(provider.spans) <= 2
+
+
+def test_is_range_error():
+    assert is_range_error(ValueError("Log response size exceeded"))
+    assert not is_range_error(ValueError("invalid params"))
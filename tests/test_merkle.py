@@ -0,0 +1,88 @@
+import hashlib
+
+import pytest
+
+from app import anchor_batch, merkle
+
+
+def _leaves(n):
+    return [hashlib.sha256(f"bundle-{i}".encode()).digest() for i in range(n)]
+
+
+def _doc(levels, index):
+    return {
+        "algorithm": anchor_batch.PROOF_ALGORITHM,
+        "leaf": "0x" + levels[0][index].hex(),
+        "leaf_index": index,
+        "proof": ["0x" + p.hex() for p in merkle.inclusion_proof(levels, index)],
+        "root": "0x" + merkle.root_of(levels).hex(),
+    }
+
+
+def test_single_leaf_root_is_leaf():
+    leaf = _leaves(1)[0]
+    levels = merkle.build_tree([leaf])
+    assert merkle.root_of(levels) == leaf
+    assert merkle.inclusion_proof(levels, 0) == []
+    assert merkle.verify_proof(leaf, [], leaf)
+
+
+@pytest.mark.parametrize("n", [2, 3, 5, 7, 8, 9])
+def test_every_leaf_proves_the_root(n):
+    leaves = _leaves(n)
+    levels = merkle.build_tree(leaves)
+    root = merkle.root_of(levels)
+    for i, leaf in enumerate(leaves):
+        assert merkle.verify_proof(leaf, merkle.inclusion_proof(levels, i), root)
+
+
+def test_odd_node_is_promoted_unchanged():
+    a, b, c = _leaves(3)
+    levels = merkle.build_tree([a, b, c])
+    assert levels[1] == [merkle._hash_pair(a, b), c]
+    assert merkle.root_of(levels) == merkle._hash_pair(merkle._hash_pair(a, b), c)
+    # The promoted leaf has no sibling on the level it skipped
+    assert merkle.inclusion_proof(levels, 2) == [merkle._hash_pair(a, b)]
+
+
+def test_pair_order_does_not_matter():
+    a, b = _leaves(2)
+    assert merkle.root_of(merkle.build_tree([a, b])) == merkle.root_of(merkle.build_tree([b, a]))
+
+
+def test_wrong_proof_does_not_verify():
+    leaves = _leaves(5)
+    levels = merkle.build_tree(leaves)
+    root = merkle.root_of(levels)
+    assert not merkle.verify_proof(leaves[0], merkle.inclusion_proof(levels, 1), root)
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        merkle.build_tree([])
+    with pytest.raises(ValueError):
+        merkle.build_tree([b"short"])
+    levels = merkle.build_tree(_leaves(3))
+    with pytest.raises(IndexError):
+        merkle.inclusion_proof(levels, 3)
+
+
+@pytest.mark.parametrize("n", [1, 4, 5])
+def test_root_from_proof(n):
+    levels = merkle.build_tree(_leaves(n))
+    root = "0x" + merkle.root_of(levels).hex()
+    for i in range(n):
+        doc = _doc(levels, i)
+        assert anchor_batch.root_from_proof(doc, doc["leaf"]) == root
+
+
+def test_root_from_proof_rejects_mismatches():
+    levels = merkle.build_tree(_leaves(3))
+    doc = _doc(levels, 0)
+    other = "0x" + levels[0][1].hex()
+    with pytest.raises(ValueError, match="leaf"):
+        anchor_batch.root_from_proof(doc, other)
+    with pytest.raises(ValueError, match="root"):
+        anchor_batch.root_from_proof(dict(doc, root=other), doc["leaf"])
+    with pytest.raises(ValueError, match="algorithm"):
+        anchor_batch.root_from_proof(dict(doc, algorithm="keccak"), doc["leaf"])
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app import models, nonce
+
+
+class Chain:
+    """Transaction counts for the hot wallet, as eth_getTransactionCount reports them."""
+
+    def __init__(self, latest=0, pending=0):
+        self.counts = {"latest": latest, "pending": pending}
+
+    def __call__(self, ident):
+        return self.counts[ident]
+
+
+@pytest.fixture
+def chain():
+    return Chain(latest=7, pending=7)
+
+
+@pytest.fixture
+def mgr(session, chain):
+    return nonce.NonceManager("0xhot", chain)
+
+
+def _age(session, nonce_value, seconds):
+    session.execute(
+        update(models.AnchorTx)
+        .where(models.AnchorTx.nonce == nonce_value)
+        .values(updated_at=datetime.utcnow() - timedelta(seconds=seconds))
+    )
+    session.commit()
+
+
+def test_allocate_starts_at_chain_count_and_reuses_released(mgr):
+    assert [mgr.allocate() for _ in range(3)] == [7, 8, 9]
+
+    # Last nonce handed out: the counter steps back
+    mgr.release(9)
+    assert mgr.allocate() == 9
+
+    # A hole below the counter is handed out before new nonces
+    mgr.release(8)
+    assert mgr.allocate() == 8
+    assert mgr.allocate() == 10
+
+
+def test_counter_is_shared_through_the_database(mgr, chain):
+    assert mgr.allocate() == 7
+    other = nonce.NonceManager("0xhot", chain)
+    assert other.allocate() == 8
+
+
+def test_resync_jumps_to_chain_and_drops_stale_released(mgr, chain):
+    for _ in range(3):
+        mgr.allocate()
+    mgr.release(7)
+    chain.counts["pending"] = 12
+    mgr.resync()
+    assert mgr.allocate() == 12
+
+
+def test_sweep_marks_mined_and_replaces_stuck_head(session, mgr, chain, make_receipt):
+    mgr.record_sent(7, "0xa7", "0xbundle7", {"maxFeePerGas": 100, "maxPriorityFeePerGas": 10})
+    mgr.record_sent(8, "0xa8", "0xbundle8", {"maxFeePerGas": 100, "maxPriorityFeePerGas": 10})
+    rec = make_receipt(status="submitted", flare_txid="0xa8")
+    chain.counts.update(latest=8, pending=9)
+    _age(session, 8, nonce.NONCE_STUCK_SECONDS + 1)
+
+    sent = []
+
+    def resend(n, anchored, fees):
+        sent.append((n, anchored, fees))
+        return "0xb8", fees
+
+    mgr.sweep(resend)
+
+    [(n, anchored, fees)] = sent
+    assert (n, anchored) == (8, "0xbundle8")
+    # Nodes only accept a replacement with fees at least 10% higher
+    assert fees["maxFeePerGas"] >= 110 and fees["maxPriorityFeePerGas"] >= 11
+    rows = {r.nonce: r for r in session.query(models.AnchorTx)}
+    session.refresh(rows[8])
+    assert rows[7].status == "mined"
+    assert (rows[8].tx_hash, rows[8].replacements) == ("0xb8", 1)
+    assert mgr.tx_hashes(8) == ["0xb8", "0xa8"]
+    session.refresh(rec)
+    assert rec.flare_txid == "0xb8"
+
+
+def test_sweep_leaves_a_fresh_head_alone(session, mgr, chain):
+    mgr.record_sent(7, "0xa7", "0xbundle7", {"gasPrice": 5})
+    mgr.sweep(lambda *a: pytest.fail("fresh tx must not be replaced"))
+    assert mgr.current_tx_hash(7) == "0xa7"
+
+
+def test_ambiguous_replacement_is_recorded(session, mgr, chain):
+    mgr.record_sent(7, "0xa7", "0xbundle7", {"gasPrice": 100})
+    _age(session, 7, nonce.NONCE_STUCK_SECONDS + 1)
+
+    def resend(n, anchored, fees):
+        raise nonce.AmbiguousSend("0xb7", fees)
+
+    mgr.sweep(resend)
+    assert mgr.current_tx_hash(7) == "0xb7"
+    assert set(mgr.tx_hashes(7)) == {"0xa7", "0xb7"}
+
+
+def test_gap_is_filled_on_the_second_sweep(session, mgr, chain):
+    for _ in range(2):
+        mgr.allocate()
+    mgr.forget(7)  # hash unknown: nothing recorded for nonce 7
+    mgr.record_sent(8, "0xa8", "0xbundle8", {"gasPrice": 5})
+
+    fills = []
+
+    def resend(n, anchored, fees):
+        fills.append((n, anchored))
+        return "0xfill7", {"gasPrice": 5}
+
+    mgr.sweep(resend)
+    assert fills == []
+    mgr.sweep(resend)
+    assert fills == [(7, None)]
+    assert mgr.current_tx_hash(7) == "0xfill7"
+
+
+def test_outstanding_nonce_is_not_a_gap(session, mgr, chain):
+    for _ in range(2):
+        mgr.allocate()  # 7 is still being built and sent
+    mgr.record_sent(8, "0xa8", "0xbundle8", {"gasPrice": 5})
+    for _ in range(2):
+        mgr.sweep(lambda *a: pytest.fail("in-flight nonce must not be filled"))
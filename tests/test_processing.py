@@ -0,0 +1,76 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import anchor_batch, anchor_node, confirm, nonce, processing
+
+HASH = "0x" + "11" * 32
+
+
+@pytest.fixture
+def single_wait_mode(monkeypatch):
+    monkeypatch.setattr(anchor_batch, "ANCHOR_MODE", "single")
+    monkeypatch.setattr(confirm, "ANCHOR_CONFIRM_MODE", "wait")
+
+
+def _web3_anchor(monkeypatch, anchor_bundle):
+    # app.anchor needs web3; only its anchor_bundle is used here
+    fake = SimpleNamespace(anchor_bundle=anchor_bundle, submit_bundle=anchor_bundle)
+    monkeypatch.setitem(sys.modules, "app.anchor", fake)
+    monkeypatch.setattr(app, "anchor", fake, raising=False)
+
+
+def _node_anchor(monkeypatch, result=("0xnode", 7)):
+    calls = []
+
+    def anchor_bundle(h):
+        calls.append(h)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(anchor_node, "anchor_bundle", anchor_bundle)
+    return calls
+
+
+def test_unconfirmed_broadcast_is_submitted_not_anchored_again(monkeypatch, single_wait_mode):
+    def timed_out(h):
+        raise nonce.BroadcastUnconfirmed("0xsent")
+
+    _web3_anchor(monkeypatch, timed_out)
+    node_calls = _node_anchor(monkeypatch)
+    out = processing.anchor_artifacts(HASH, "artifacts/r/evidence.zip")
+    assert (out.status, out.txid) == ("submitted", "0xsent")
+    assert node_calls == []
+
+
+def test_node_fallback_when_nothing_was_sent(monkeypatch, single_wait_mode):
+    def no_key(h):
+        raise RuntimeError("ANCHOR_PRIVATE_KEY is not set")
+
+    _web3_anchor(monkeypatch, no_key)
+    node_calls = _node_anchor(monkeypatch)
+    out = processing.anchor_artifacts(HASH, "artifacts/r/evidence.zip")
+    assert (out.status, out.txid) == ("anchored", "0xnode")
+    assert node_calls == [HASH]
+
+
+def test_node_error_after_signing_is_submitted(monkeypatch, single_wait_mode):
+    def no_key(h):
+        raise RuntimeError("ANCHOR_PRIVATE_KEY is not set")
+
+    _web3_anchor(monkeypatch, no_key)
+    _node_anchor(monkeypatch, anchor_node.SidecarError("not mined in time", None, "0xsigned"))
+    out = processing.anchor_artifacts(HASH, "artifacts/r/evidence.zip")
+    assert (out.status, out.txid) == ("submitted", "0xsigned")
+
+
+def test_nothing_sent_anywhere_is_failed(monkeypatch, single_wait_mode):
+    def no_key(h):
+        raise RuntimeError("ANCHOR_PRIVATE_KEY is not set")
+
+    _web3_anchor(monkeypatch, no_key)
+    _node_anchor(monkeypatch, anchor_node.SidecarError("rejected", False, None))
+    assert processing.anchor_artifacts(HASH, "artifacts/r/evidence.zip").status == "failed"
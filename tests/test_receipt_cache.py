@@ -0,0 +1,16 @@
+from app import receipt_cache
+from app.receipt_cache import ReceiptCache, make_entry
+
+
+def test_only_anchored_receipts_use_the_long_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(receipt_cache.time, "monotonic", lambda: now[0])
+    cache = ReceiptCache(max_entries=10, ttl=2, terminal_ttl=3600)
+    for status in ("anchored", "failed", "submitted"):
+        cache.put(status, make_entry(status, status.encode()))
+
+    now[0] += 10
+    assert cache.get("anchored") is not None
+    # A failed receipt can be retried, so it expires like an in-flight one
+    assert cache.get("failed") is None
+    assert cache.get("submitted") is None
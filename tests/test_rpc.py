@@ -0,0 +1,108 @@
+import pytest
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from app import rpc
+
+
+class Resp:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """Answers posts per URL: a callable (payload -> data) or an exception to raise."""
+
+    def __init__(self, **handlers):
+        self.handlers = handlers
+        self.posts = []
+
+    def post(self, url, json, timeout):
+        self.posts.append((url, json))
+        handler = self.handlers[url]
+        if isinstance(handler, Exception):
+            raise handler
+        return Resp(handler(json))
+
+
+def _echo(payload):
+    def answer(item):
+        if item["method"] == "eth_fail":
+            return {"jsonrpc": "2.0", "id": item["id"], "error": {"code": -32000, "message": "boom"}}
+        return {"jsonrpc": "2.0", "id": item["id"], "result": item["method"]}
+
+    if isinstance(payload, list):
+        # Out of order and missing the last call: matched by id
+        return [answer(item) for item in payload[:-1]][::-1]
+    return answer(payload)
+
+
+def _client(**handlers):
+    client = rpc.RpcClient(urls=list(handlers))
+    client.session = FakeSession(**handlers)
+    return client
+
+
+def test_batch_is_one_request_with_results_in_call_order():
+    client = _client(a=_echo)
+    out = client.batch([("eth_blockNumber", []), ("eth_fail", []), ("eth_gasPrice", []), ("eth_chainId", [])])
+
+    assert len(client.session.posts) == 1
+    assert out[0] == "eth_blockNumber" and out[2] == "eth_gasPrice"
+    assert isinstance(out[1], rpc.RpcError) and out[1].code == -32000
+    assert isinstance(out[3], rpc.RpcError)  # no response for it
+
+
+def test_rejected_batch_falls_back_to_one_request_per_call():
+    def no_batches(payload):
+        if isinstance(payload, list):
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch not supported"}}
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": payload["method"]}
+
+    client = _client(a=no_batches)
+    assert client.batch([("eth_blockNumber", []), ("eth_gasPrice", [])]) == ["eth_blockNumber", "eth_gasPrice"]
+    assert len(client.session.posts) == 3
+
+
+def test_read_fails_over_and_cools_down_the_failed_endpoint():
+    client = _client(a=requests.ReadTimeout("read timed out"), b=_echo)
+    assert client.call("eth_blockNumber") == "eth_blockNumber"
+    assert [url for url, _ in client.session.posts] == ["a", "b"]
+    assert [e.url for e in client._ranked()] == ["b", "a"]
+
+
+def test_send_that_may_have_arrived_is_not_reposted():
+    client = _client(a=requests.ReadTimeout("read timed out"), b=_echo)
+    with pytest.raises(rpc.AmbiguousSendError) as exc:
+        client.call("eth_sendRawTransaction", ["0xsigned"])
+    assert exc.value.url == "a"
+    assert [url for url, _ in client.session.posts] == ["a"]
+
+
+def test_send_that_never_left_fails_over():
+    refused = requests.ConnectionError(NewConnectionError(None, "connection refused"))
+    client = _client(a=refused, b=_echo)
+    assert client.call("eth_sendRawTransaction", ["0xsigned"]) == "eth_sendRawTransaction"
+    assert [url for url, _ in client.session.posts] == ["a", "b"]
+
+
+def test_never_sent():
+    assert rpc.never_sent(requests.ConnectTimeout("connect timed out"))
+    assert rpc.never_sent(requests.ConnectionError(NewConnectionError(None, "refused")))
+    assert not rpc.never_sent(requests.ConnectionError("connection reset by peer"))
+    assert not rpc.never_sent(requests.ReadTimeout("read timed out"))
+
+
+def test_ambiguous_send_is_classified_for_the_nonce_manager():
+    from app import nonce
+
+    err = rpc.AmbiguousSendError("eth_sendRawTransaction", "a", requests.ReadTimeout("read timed out"))
+    assert nonce.is_ambiguous_send(err)
+    assert not nonce.is_ambiguous_send(requests.ConnectTimeout("connect timed out"))
+    assert not nonce.is_ambiguous_send(rpc.RpcError({"message": "nonce too low"}))
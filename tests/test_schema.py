@@ -0,0 +1,69 @@
+from sqlalchemy import Column, DateTime, MetaData, Numeric, String, Table, inspect, select
+
+from app import db, models
+
+
+def _baseline_receipts(metadata):
+    # receipts as created by the first release, before batching / job queue columns
+    return Table(
+        "receipts",
+        metadata,
+        Column("id", models.GUID, primary_key=True),
+        Column("reference", String, nullable=False, unique=True),
+        Column("tip_tx_hash", String, nullable=False),
+        Column("chain", String, nullable=False),
+        Column("amount", Numeric(38, 18), nullable=False),
+        Column("currency", String, nullable=False),
+        Column("sender_wallet", String, nullable=False),
+        Column("receiver_wallet", String, nullable=False),
+        Column("status", String, nullable=False, index=True),
+        Column("bundle_hash", String),
+        Column("flare_txid", String),
+        Column("xml_path", String),
+        Column("bundle_path", String),
+        Column("created_at", DateTime(timezone=True)),
+        Column("anchored_at", DateTime(timezone=True)),
+    )
+
+
+def test_create_schema_upgrades_an_existing_receipts_table():
+    models.Base.metadata.drop_all(bind=db.engine)
+    old = MetaData()
+    _baseline_receipts(old)
+    old.create_all(bind=db.engine)
+
+    models.create_schema(db.engine)
+    models.create_schema(db.engine)  # idempotent
+
+    insp = inspect(db.engine)
+    columns = {c["name"] for c in insp.get_columns("receipts")}
+    assert {"merkle_root", "batched_at"} <= columns
+    indexes = {i["name"] for i in insp.get_indexes("receipts")}
+    assert {"ix_receipts_status", "ix_receipts_merkle_root", "ix_receipts_bundle_hash"} <= indexes
+    assert "jobs" in insp.get_table_names()
+    with db.SessionLocal() as s:
+        assert s.scalars(select(models.Receipt)).all() == []
+
+
+def test_create_schema_rebuilds_an_anchor_index_without_contract_column():
+    models.Base.metadata.drop_all(bind=db.engine)
+    old = MetaData()
+    Table(
+        "anchor_events",
+        old,
+        Column("id", models.GUID, primary_key=True),
+        Column("bundle_hash", String, nullable=False, index=True),
+        Column("tx_hash", String, nullable=False),
+    )
+    Table("anchor_index_checkpoints", old, Column("contract", String, primary_key=True), Column("block_number", Numeric))
+    old.create_all(bind=db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(old.tables["anchor_index_checkpoints"].insert().values(contract="0xabc", block_number=10))
+
+    models.create_schema(db.engine)
+
+    insp = inspect(db.engine)
+    assert "contract" in {c["name"] for c in insp.get_columns("anchor_events")}
+    # The checkpoint went with the events, so the indexer scans the range again
+    with db.SessionLocal() as s:
+        assert s.scalars(select(models.IndexCheckpoint)).all() == []
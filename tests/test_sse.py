@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+from app import sse
+from app.broker import MemoryBroker
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    h = sse._SSEHub(MemoryBroker())
+    monkeypatch.setattr(sse, "hub", h)
+    return h
+
+
+def _frames(chunks):
+    """Parsed (id, event, data) of the event frames, skipping comments."""
+    out = []
+    for chunk in chunks:
+        fields = dict(line.split(": ", 1) for line in chunk.decode().strip().splitlines() if not line.startswith(":"))
+        if fields:
+            out.append((int(fields["id"]) if "id" in fields else None, fields.get("event"), json.loads(fields["data"])))
+    return out
+
+
+async def _read(gen, n):
+    return [await asyncio.wait_for(gen.__anext__(), 1) for _ in range(n)]
+
+
+async def _publish(hub, rid, status, **extra):
+    await hub.publish(rid, {"receipt_id": rid, "status": status, **extra})
+    return hub.last_event_id(rid)
+
+
+def test_reconnect_replays_exactly_the_missed_events(hub):
+    async def scenario():
+        hub.bind_loop(asyncio.get_running_loop())
+        first = await _publish(hub, "r1", "pending")
+        await _publish(hub, "r1", "submitted")
+        await _publish(hub, "r1", "anchored")
+
+        async def snapshot():
+            pytest.fail("replayable reconnect must not send a snapshot")
+
+        gen = sse.stream_events("r1", first, snapshot)
+        replayed = _frames(await _read(gen, 3))
+        await _publish(hub, "r1", "live")
+        live = _frames(await _read(gen, 1))
+        await gen.aclose()
+        return first, replayed, live
+
+    first, replayed, live = asyncio.run(scenario())
+    assert [d["status"] for _, _, d in replayed] == ["submitted", "anchored"]
+    assert all(event_id > first for event_id, _, _ in replayed)
+    assert live[0][2]["status"] == "live"
+
+
+def test_evicted_events_fall_back_to_a_snapshot_tagged_with_the_newest_id(hub, monkeypatch):
+    monkeypatch.setattr(sse, "SSE_REPLAY_EVENTS", 2)
+
+    async def scenario():
+        hub.bind_loop(asyncio.get_running_loop())
+        first = await _publish(hub, "r1", "pending")
+        for status in ("submitted", "anchored"):
+            newest = await _publish(hub, "r1", status)
+
+        async def snapshot():
+            return b'{"id":"r1","status":"anchored"}'
+
+        gen = sse.stream_events("r1", first - 1, snapshot)
+        frames = _frames(await _read(gen, 2))
+        await gen.aclose()
+        return newest, frames
+
+    newest, frames = asyncio.run(scenario())
+    assert frames == [(newest, "update", {"id": "r1", "status": "anchored"})]
+
+
+def test_filter_stream_replays_matching_events_or_resets(hub, monkeypatch):
+    match = sse.EventFilter(receiver_wallet="0xABC")
+
+    async def scenario():
+        hub.bind_loop(asyncio.get_running_loop())
+        start = await _publish(hub, "r0", "pending", receiver_wallet="0xabc")
+        await _publish(hub, "r1", "pending", receiver_wallet="0xother")
+        await _publish(hub, "r2", "anchored", receiver_wallet="0xAbc")
+
+        gen = sse.stream_many([], match, start)
+        replayed = _frames(await _read(gen, 2))
+        await gen.aclose()
+
+        gen = sse.stream_many([], match, hub._recent_evicted - 1)
+        reset = _frames(await _read(gen, 2))
+        await gen.aclose()
+        return replayed, reset
+
+    replayed, reset = asyncio.run(scenario())
+    assert [d["receipt_id"] for _, _, d in replayed] == ["r2"]
+    assert reset == [(None, "reset", {})]
+
+
+def test_parse_last_event_id():
+    assert sse.parse_last_event_id("42") == 42
+    assert sse.parse_last_event_id("nope") is None
+    assert sse.parse_last_event_id(None) is None
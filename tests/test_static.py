@@ -0,0 +1,32 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.static import RevalidatedStaticFiles, etag_matches
+
+
+def test_artifacts_revalidate_and_see_rewrites(tmp_path):
+    (tmp_path / "rid").mkdir()
+    proof = tmp_path / "rid" / "inclusion_proof.json"
+    proof.write_text('{"root": "0xaa"}')
+    app = FastAPI()
+    app.mount("/files", RevalidatedStaticFiles(directory=tmp_path), name="files")
+    client = TestClient(app)
+
+    first = client.get("/files/rid/inclusion_proof.json")
+    assert first.headers["cache-control"] == "no-cache"
+    etag = first.headers["etag"]
+    again = client.get("/files/rid/inclusion_proof.json", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    # A batch re-run rewrites the proof under the same path
+    proof.write_text('{"root": "0xbbbb"}')
+    rewritten = client.get("/files/rid/inclusion_proof.json", headers={"If-None-Match": etag})
+    assert rewritten.status_code == 200
+    assert rewritten.json() == {"root": "0xbbbb"}
+
+
+def test_etag_matches_weak_and_lists():
+    assert etag_matches('W/"a", "b"', '"b"')
+    assert etag_matches("*", '"x"')
+    assert not etag_matches(None, '"x"')
+    assert not etag_matches('"a"', '"b"')